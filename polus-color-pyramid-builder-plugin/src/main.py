@@ -123,6 +123,8 @@ if __name__=="__main__":
                         help='Path to a stitching vector.', required=False)
     parser.add_argument('--background', dest='background', type=str,
                         help='Background fill value.', required=False)
+    parser.add_argument('--resume', dest='resume', type=str,
+                        help='If true, skip chunks completed by a previous build.', required=False)
     
     # Output arguments
     parser.add_argument('--outDir', dest='outDir', type=str,
@@ -150,6 +152,8 @@ if __name__=="__main__":
     logger.info('stitchPath = {}'.format(stitch_path))
     background = args.background
     logger.info('background = {}'.format(background))
+    resume = args.resume == 'true'
+    logger.info('resume = {}'.format(resume))
     
     # Parse the layout
     layout = [None if l=='' else int(l) for l in layout.split(',')]
@@ -176,7 +180,7 @@ if __name__=="__main__":
         
         count += 1
         outDirFrame = outDir.joinpath('{}_files'.format(count))
-        outDirFrame.mkdir()
+        outDirFrame.mkdir(exist_ok=resume)
         bioreaders = []
         threads = []
         with ThreadPoolExecutor(max([multiprocessing.cpu_count()//2,2])) as executor:
@@ -246,6 +250,10 @@ if __name__=="__main__":
                 br_meta = br
         file_info = utils.dzi_file(br_meta,outDirFrame,count)
         encoder = utils.DeepZoomChunkEncoder(file_info)
-        file_writer = utils.DeepZoomWriter(outDirFrame)
+        file_writer = utils.DeepZoomWriter(outDirFrame,resume)
         
         utils._get_higher_res(0,bioreaders,file_writer,encoder,alpha,background,isinstance(stitch_path,str))
+        
+        # Only interrupted builds leave a manifest behind
+        if file_writer.manifest_path.exists():
+            file_writer.manifest_path.unlink()
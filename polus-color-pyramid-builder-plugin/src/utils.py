@@ -8,7 +8,7 @@ https://github.com/LabShare/polus-plugins/tree/master/polus-precompute-slide-plu
 
 from bfio.bfio import BioReader
 import numpy as np
-import copy, os
+import copy, os, threading
 from pathlib import Path
 import imageio, re, filepattern
 from concurrent.futures import ThreadPoolExecutor
@@ -27,6 +27,9 @@ UNITS = {'m':  10**9,
 # Chunk Scale
 CHUNK_SIZE = 1024
 
+# Prevents threads from writing to the chunk manifest at the same time
+_manifest_lock = threading.Lock()
+
 def get_number(s):
     """ Check that s is number
     
@@ -362,6 +365,10 @@ def _get_higher_res(S,bfio_reader,slide_writer,encoder,alpha,color=None,stitch=F
         X[1] = scale_info['size'][0]
     if Y[1] > scale_info['size'][1]:
         Y[1] = scale_info['size'][1]
+    
+    # Load the chunk if it was completed by a previous build
+    if slide_writer.is_complete(str(S),(X[0],X[1],Y[0],Y[1],0,1)):
+        return slide_writer.load_chunk(str(S),(X[0],X[1],Y[0],Y[1],0,1))
 
     # Initialize the output
     image = np.zeros((Y[1]-Y[0],X[1]-X[0],4),dtype=np.uint8)
@@ -449,15 +456,49 @@ class PyramidWriter():
     This class should not be called directly. It should be inherited by a pyramid
     writing class type.
     
+    Every chunk that is written is recorded in a manifest, which holds one
+    record of (scale, x, y) as three uint32 values for each completed chunk.
+    If resume is True, chunks in the manifest from a previous build are loaded
+    from disk instead of being rebuilt, so only missing chunks and their
+    parents are rebuilt.
+    
     Inputs:
         base_dir - Where pyramid folders and info file will be stored
+        resume - skip chunks recorded in the manifest by a previous build
     """
 
     can_write = True
     chunk_pattern = None
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, resume=False):
         self.base_path = Path(base_dir)
+        self.resume = resume
+        self.manifest_path = self.base_path.joinpath('manifest.bin')
+        self.completed = set()
+        
+        if self.manifest_path.exists():
+            if self.resume:
+                records = np.fromfile(str(self.manifest_path),dtype='<u4')
+                records = records[:records.size - records.size % 3].reshape(-1,3)
+                self.completed = set(map(tuple,records.tolist()))
+            else:
+                self.manifest_path.unlink()
+    
+    def is_complete(self, key, chunk_coords):
+        """ Check if a chunk was completed by a previous build
+        
+        Inputs:
+            key - pyramid scale
+            chunk_coords - X,Y,Z coordinates of the chunk
+        Outputs:
+            True if the chunk is in the manifest
+        """
+        return (int(key),chunk_coords[0],chunk_coords[2]) in self.completed
+    
+    def _record_chunk(self, key, chunk_coords):
+        with _manifest_lock:
+            with open(str(self.manifest_path),'ab') as f:
+                f.write(np.asarray([int(key),chunk_coords[0],chunk_coords[2]],dtype='<u4').tobytes())
 
     def store_chunk(self, buf, key, chunk_coords):
         """ Store a pyramid chunk
@@ -467,6 +508,11 @@ class PyramidWriter():
             key - pyramid scale, folder to save chunk to
             chunk_coords - X,Y,Z coordinates of data in buf
         """
+        
+        # Skip chunks written by a previous build
+        if self.is_complete(key,chunk_coords):
+            return
+        
         try:
             self._write_chunk(key,chunk_coords,buf)
         except OSError as exc:
@@ -474,6 +520,8 @@ class PyramidWriter():
                 "Error storing chunk {0} in {1}: {2}" .format(
                     self._chunk_path(key, chunk_coords),
                     self.base_path, exc))
+        
+        self._record_chunk(key,chunk_coords)
 
     def _chunk_path(self, key, chunk_coords, pattern=None):
         if pattern is None:
@@ -486,7 +534,10 @@ class PyramidWriter():
         return chunk_coords
 
     def _write_chunk(self,key,chunk_path,buf):
-        NotImplementedError("_write_chunk was never implemented.")
+        raise NotImplementedError("_write_chunk was never implemented.")
+
+    def load_chunk(self,key,chunk_coords):
+        raise NotImplementedError("load_chunk was never implemented.")
 
 class DeepZoomWriter(PyramidWriter):
     """ Method to write a DeepZoom pyramid
@@ -495,8 +546,8 @@ class DeepZoomWriter(PyramidWriter):
         base_dir - Where pyramid folders and info file will be stored
     """
 
-    def __init__(self, base_dir):
-        super().__init__(base_dir)
+    def __init__(self, base_dir, resume=False):
+        super().__init__(base_dir, resume)
         self.chunk_pattern = "{key}/{0}_{1}.png"
 
     def _chunk_coords(self,chunk_coords):
@@ -507,6 +558,10 @@ class DeepZoomWriter(PyramidWriter):
         chunk_path = self._chunk_path(key,chunk_coords)
         os.makedirs(str(chunk_path.parent), exist_ok=True)
         imageio.imwrite(str(chunk_path.with_name(chunk_path.name)),buf,format='PNG-FI',compression=1)
+    
+    def load_chunk(self,key,chunk_coords):
+        chunk_path = self._chunk_path(key,chunk_coords)
+        return imageio.imread(str(chunk_path),format='PNG-FI')
         
 # Modified and condensed from multiple functions and classes
 # https://github.com/HumanBrainProject/neuroglancer-scripts/blob/master/src/neuroglancer_scripts/chunk_encoding.py
@@ -5,16 +5,15 @@ from scipy.stats import skew
 from scipy.stats import kurtosis as kurto
 from scipy.stats import mode as modevalue
 from scipy.sparse import csr_matrix
-from scipy import stats
-from operator import itemgetter
 from bfio import BioReader
-from itertools import repeat
 from functools import partial
 import argparse
 import logging
 import os
 import math
 import itertools
+import threading
+import contextlib
 import filepattern
 import concurrent
 import cv2
@@ -28,325 +27,535 @@ logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(messa
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
 
-def read(img_file):
+def read(img_file, tile_size=None):
     """Read the .ome.tif image using BioReader.
     
     Args:
         img_directory (str): Path to the directory containing the input images.
+        tile_size (int): If given, the image is not loaded and is read one tile at a time during feature extraction.
         
     Returns:
-        Array of the image and the embedded unit in the metadata if present else it will be none.
+        Array of the image (or the path to the image if tile_size is given) and the embedded unit in the metadata if present else it will be none.
         
     """
     br = BioReader(img_file)
-    #Load only the first channel
-    image_bfio = br[:,:,0:1,0,0].squeeze()
     #Get embedded units from metadata (physical size)
     img_unit = br.ps_y[1]
+    if tile_size is not None:
+        br.close()
+        return img_file, img_unit
+    #Load only the first channel
+    image_bfio = br[:,:,0:1,0,0].squeeze()
     logger.info('Done reading the file: {}'.format(img_file.name))
     return image_bfio, img_unit
+
+#Halo needed to find the perimeter pixels of objects in a tile and their neighbors
+TILE_HALO = 2
+
+#Second moments closer than this (relative to uxx + uyy) are treated as equal, so that summation noise
+#does not change the orientation or eccentricity of symmetric objects with the order of summation
+MOMENT_TOLERANCE = 1e-10
+
+#Weights of perimeter pixels used by skimage.measure.perimeter (4-connectivity)
+PERIMETER_WEIGHTS = np.zeros(50, dtype=np.double)
+PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+PERIMETER_WEIGHTS[[21, 33]] = math.sqrt(2)
+PERIMETER_WEIGHTS[[13, 23]] = (1 + math.sqrt(2)) / 2
+
+def _central_moments(values, inverse, counts, orders):
+    """Calculate the mean and central moments of the values of each object.
+
+    Args:
+        values (ndarray): Pixel values.
+        inverse (ndarray): Index of the object each pixel belongs to.
+        counts (ndarray): Number of pixels in each object.
+        orders (list): Orders of the central moments to calculate.
+
+    Returns:
+        The mean of each object and a list with the sums of the deviations from the mean raised to each order.
+
+    """
+    mean = np.bincount(inverse, values, len(counts)) / counts
+    deviation = values - mean[inverse]
+    moments = [np.bincount(inverse, deviation**order, len(counts)) for order in orders]
+    return mean, moments
+
+def tile_statistics(label_tile, intensity_tile, core, origin):
+    """Calculate partial statistics of the objects in one tile.
+
+    Only pixels in the core of the tile are counted. The halo around the core is used to find which
+    core pixels are on the perimeter of an object, and the perimeter contribution of each of them.
+
+    Args:
+        label_tile (ndarray): Labeled tile, including the halo.
+        intensity_tile (ndarray): Intensity tile, including the halo. None if intensity features are not required.
+        core (tuple): Slices of the core of the tile.
+        origin (tuple): Position of the first pixel of the tile in the image.
+
+    Returns:
+        Dictionary of the partial statistics of each object in the core of the tile, None if there are no objects.
+
+    """
+    labels = label_tile[core]
+    mask = labels != 0
+    if not mask.any():
+        return None
+
+    #Get the position and label of all object pixels
+    rows, cols = np.nonzero(mask)
+    rows = rows + origin[0] + core[0].start
+    cols = cols + origin[1] + core[1].start
+    label, inverse = np.unique(labels[mask], return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse).astype(np.double)
+    stats = {'label': label,
+             'count': counts}
+
+    #Bounding box
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(counts[:-1]))).astype(int)
+    stats['row_min'] = np.minimum.reduceat(rows[order], starts)
+    stats['row_max'] = np.maximum.reduceat(rows[order], starts)
+    stats['col_min'] = np.minimum.reduceat(cols[order], starts)
+    stats['col_max'] = np.maximum.reduceat(cols[order], starts)
+
+    #Second moments of pixel positions
+    stats['row_mean'], (stats['row_m2'],) = _central_moments(rows.astype(np.double), inverse, counts, [2])
+    stats['col_mean'], (stats['col_m2'],) = _central_moments(cols.astype(np.double), inverse, counts, [2])
+    stats['rowcol_m2'] = np.bincount(inverse, (rows - stats['row_mean'][inverse]) * (cols - stats['col_mean'][inverse]), len(counts))
+
+    #Perimeter contributions, see skimage.measure.perimeter
+    padded = np.pad(label_tile, 1)
+    center = padded[1:-1, 1:-1]
+    border = (center != 0) & ((padded[:-2, 1:-1] != center) | (padded[2:, 1:-1] != center) |
+                              (padded[1:-1, :-2] != center) | (padded[1:-1, 2:] != center))
+    border_labels = np.pad(np.where(border, label_tile, 0), 1)
+    code = (border.astype(np.uint8)
+            + 2 * ((border_labels[:-2, 1:-1] == center).astype(np.uint8) + (border_labels[2:, 1:-1] == center)
+                   + (border_labels[1:-1, :-2] == center) + (border_labels[1:-1, 2:] == center))
+            + 10 * ((border_labels[:-2, :-2] == center).astype(np.uint8) + (border_labels[:-2, 2:] == center)
+                    + (border_labels[2:, :-2] == center) + (border_labels[2:, 2:] == center)))
+    stats['perimeter'] = np.bincount(inverse, PERIMETER_WEIGHTS[code[core][mask]], len(counts))
+
+    #Moments of intensity values
+    if intensity_tile is not None:
+        values = intensity_tile[core][mask].astype(np.double)
+        stats['intensity_min'] = np.minimum.reduceat(values[order], starts)
+        stats['intensity_max'] = np.maximum.reduceat(values[order], starts)
+        stats['intensity_mean'], (stats['intensity_m2'], stats['intensity_m3'], stats['intensity_m4']) = _central_moments(values, inverse, counts, [2, 3, 4])
+
+    return stats
+
+def merge_statistics(partials):
+    """Merge partial statistics of objects that cross tile boundaries.
+
+    Counts and perimeter contributions are summed, bounding boxes are combined, and central moments
+    are combined using the formulas for parallel calculation of moments (Pebay, 2008).
+
+    Args:
+        partials (list): List of dictionaries of partial statistics from tile_statistics.
+
+    Returns:
+        Dictionary of the statistics of each object, sorted by label.
+
+    """
+    partial = {key: np.concatenate([p[key] for p in partials]) for key in partials[0]}
+    label, inverse = np.unique(partial['label'], return_inverse=True)
+    inverse = inverse.ravel()
+    n = partial['count']
+    counts = np.bincount(inverse, n, len(label))
+    stats = {'label': label,
+             'count': counts,
+             'perimeter': np.bincount(inverse, partial['perimeter'], len(label))}
+
+    for key in [k for k in partial if k.endswith('_min')]:
+        stats[key] = np.full(len(label), np.inf)
+        np.minimum.at(stats[key], inverse, partial[key])
+    for key in [k for k in partial if k.endswith('_max')]:
+        stats[key] = np.full(len(label), -np.inf)
+        np.maximum.at(stats[key], inverse, partial[key])
+
+    #Merge the means and get the difference between each partial mean and the merged mean
+    delta = {}
+    for prefix in ['row', 'col', 'intensity']:
+        if prefix + '_mean' not in partial:
+            continue
+        stats[prefix + '_mean'] = np.bincount(inverse, n * partial[prefix + '_mean'], len(label)) / counts
+        delta[prefix] = partial[prefix + '_mean'] - stats[prefix + '_mean'][inverse]
+
+    for prefix in delta:
+        d = delta[prefix]
+        m2 = partial[prefix + '_m2']
+        stats[prefix + '_m2'] = np.bincount(inverse, m2 + n * d**2, len(label))
+        if prefix + '_m3' in partial:
+            m3 = partial[prefix + '_m3']
+            m4 = partial[prefix + '_m4']
+            stats[prefix + '_m3'] = np.bincount(inverse, m3 + 3 * d * m2 + n * d**3, len(label))
+            stats[prefix + '_m4'] = np.bincount(inverse, m4 + 4 * d * m3 + 6 * d**2 * m2 + n * d**4, len(label))
+    stats['rowcol_m2'] = np.bincount(inverse, partial['rowcol_m2'] + n * delta['row'] * delta['col'], len(label))
+
+    return stats
+
+def tiled_statistics(label_file, intensity_file, tile_size):
+    """Calculate the statistics of all objects in an image one tile at a time.
+
+    Tiles are read with a halo of TILE_HALO pixels and processed in parallel, so memory is bounded by
+    the tile size and number of threads rather than the image size. If there is no labeled image, all
+    pixels are treated as one object.
+
+    Args:
+        label_file (Path): Path to the labeled image. None if only intensity features are required.
+        intensity_file (Path): Path to the intensity image. None if only shape features are required.
+        tile_size (int): Size of the tiles.
+
+    Returns:
+        Dictionary of the statistics of each object, sorted by label.
+
+    """
+    with contextlib.ExitStack() as stack:
+        readers = {}
+        for name, file in [('label', label_file), ('intensity', intensity_file)]:
+            if file is not None:
+                readers[name] = (stack.enter_context(BioReader(file)), threading.Lock())
+        br = next(iter(readers.values()))[0]
+        height, width = br.Y, br.X
+
+        def read_tile(name, y0, y1, x0, x1):
+            reader, lock = readers[name]
+            with lock:
+                return reader[y0:y1, x0:x1, 0:1, 0, 0].reshape(y1 - y0, x1 - x0)
+
+        def process_tile(position):
+            y, x = position
+            y0, y1 = max(0, y - TILE_HALO), min(height, y + tile_size + TILE_HALO)
+            x0, x1 = max(0, x - TILE_HALO), min(width, x + tile_size + TILE_HALO)
+            core = (slice(y - y0, min(height, y + tile_size) - y0),
+                    slice(x - x0, min(width, x + tile_size) - x0))
+            if 'label' in readers:
+                label_tile = read_tile('label', y0, y1, x0, x1)
+            else:
+                label_tile = np.ones((y1 - y0, x1 - x0), dtype=np.uint8)
+            intensity_tile = read_tile('intensity', y0, y1, x0, x1) if 'intensity' in readers else None
+            return tile_statistics(label_tile, intensity_tile, core, (y0, x0))
+
+        positions = [(y, x) for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+            partials = [p for p in executor.map(process_tile, positions) if p is not None]
+
+    if len(partials) == 0:
+        stats = {'label': np.zeros(0, dtype=int), 'touching_border': np.zeros(0, dtype=bool)}
+        return stats
+    stats = merge_statistics(partials)
+    stats['touching_border'] = ((stats['row_min'] == 0) | (stats['col_min'] == 0) |
+                                (stats['row_max'] == height - 1) | (stats['col_max'] == width - 1))
+    return stats
+
+def _inertia_eigvals(stats):
+    """Eigenvalues of the inertia tensor of each object, largest first."""
+    counts = stats['count']
+    a = stats['row_m2'] / counts
+    c = stats['col_m2'] / counts
+    b = stats['rowcol_m2'] / counts
+    root = np.sqrt(((a - c) / 2)**2 + b**2)
+    root = np.where(root <= MOMENT_TOLERANCE * (a + c), 0, root)
+    return np.clip((a + c) / 2 + root, 0, None), np.clip((a + c) / 2 - root, 0, None)
+
+def _tiled_orientation(stats):
+    """Orientation of each object, calculated the same way as orientation in feature_extraction."""
+    uxx = stats['col_m2']
+    uyy = stats['row_m2']
+    uxy = stats['rowcol_m2']
+    tolerance = MOMENT_TOLERANCE * (uxx + uyy)
+    uxy = np.where(np.abs(uxy) <= tolerance, 0.0, uxy)
+    uyy = np.where(np.abs(uyy - uxx) <= tolerance, uxx, uyy)
+    root = np.sqrt((uyy - uxx)**2 + 4*uxy**2)
+    num = np.where(uyy > uxx, uyy - uxx + root, 2*uxy)
+    den = np.where(uyy > uxx, 2*uxy, uxx - uyy + root)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        orientation = -(180/math.pi) * np.arctan(num/den)
+    return np.where((num == 0) & (den == 0), 0, orientation)
+
+def _tiled_eccentricity(stats):
+    """Eccentricity of each object from the eigenvalues of the inertia tensor."""
+    l1, l2 = _inertia_eigvals(stats)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(l1 == 0, 0, np.sqrt(1 - l2 / l1))
+
+def _standardized_moment(counts, mean, m2, moment, order):
+    """Standardized moment from the sums of deviations from the mean, 0 if the values are constant (same as scipy.stats)."""
+    m2 = m2 / counts
+    zero = m2 <= (np.finfo(np.double).resolution * mean)**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(zero, 0, moment / counts / m2**(order / 2))
+
+def _tiled_moment(stats, order):
+    """Standardized moment of the intensity of each object."""
+    return _standardized_moment(stats['count'], stats['intensity_mean'], stats['intensity_m2'],
+                                stats['intensity_m{}'.format(order)], order)
+
+#Features that can be merged from the statistics of tiles, and the power of the unit length of each feature
+TILED_FEATURES = {
+    'area': (lambda stats: stats['count'], 2),
+    'perimeter': (lambda stats: stats['perimeter'], 1),
+    'orientation': (_tiled_orientation, 0),
+    'centroid_x': (lambda stats: stats['col_mean'], 0),
+    'centroid_y': (lambda stats: stats['row_mean'], 0),
+    'bbox_xmin': (lambda stats: stats['col_min'].astype(int), 0),
+    'bbox_ymin': (lambda stats: stats['row_min'].astype(int), 0),
+    'bbox_width': (lambda stats: (stats['col_max'] - stats['col_min'] + 1).astype(int), 0),
+    'bbox_height': (lambda stats: (stats['row_max'] - stats['row_min'] + 1).astype(int), 0),
+    'eccentricity': (_tiled_eccentricity, 0),
+    'equivalent_diameter': (lambda stats: np.sqrt(4 * stats['count'] / np.pi), 1),
+    'major_axis_length': (lambda stats: 4 * np.sqrt(_inertia_eigvals(stats)[0]), 1),
+    'minor_axis_length': (lambda stats: 4 * np.sqrt(_inertia_eigvals(stats)[1]), 1),
+    'mean_intensity': (lambda stats: stats['intensity_mean'], 0),
+    'max_intensity': (lambda stats: stats['intensity_max'].astype(int), 0),
+    'min_intensity': (lambda stats: stats['intensity_min'].astype(int), 0),
+    'standard_deviation': (lambda stats: np.sqrt(stats['intensity_m2'] / stats['count']), 0),
+    'skewness': (lambda stats: _tiled_moment(stats, 3), 0),
+    'kurtosis': (lambda stats: _tiled_moment(stats, 4), 0),
+}
     
-def box_border_search(label_image, boxsize=3):
-    """Get perimeter pixels of object for calculating neighbors and feret diameter memory efficiently.
+def intensity_statistics(label_image, intensity_image):
+    """Calculate the intensity statistics of all objects at once.
+
+    Pixels are sorted by label and intensity once, so every object is a contiguous run of sorted
+    intensities. Order statistics are read from each run, runs of equal intensities give the mode and
+    entropy, and moments are summed for all objects with np.bincount.
 
     Args:
         label_image (ndarray): Labeled image array.
-        boxsize (int): Box size value.
+        intensity_image (ndarray): Intensity image array.
 
     Returns:
-        An array containing the perimeter pixels of the object n.
+        Dictionary with an array of each statistic, sorted by label (the order of regionprops).
 
     """
-    #Get image shape values
-    height, width = label_image.shape
-
-    #Get boxsize values
-    floor_offset = math.floor(boxsize / 2)
-    ceil_offset = math.ceil(boxsize / 2)
-
-    #Create the integral image
-    int_image = np.zeros((height + 1, width + 1))
-    int_image[1:, 1:] = np.cumsum(np.cumsum(np.double(label_image), 0), 1)
-    int_image_transpose = int_image.T
-    int_image_int = int_image_transpose.astype(int)
-    del int_image, int_image_transpose
-
-    #Create indices for the original image
-    height_sequence = height - (boxsize - 1)
-    width_sequence = width - (boxsize - 1)
-    width_boxsize = np.linspace(0, width - boxsize, height_sequence)
-    height_boxsize = np.linspace(0, height - boxsize, width_sequence)
-    columns, rows = np.meshgrid(width_boxsize, height_boxsize)
-    columns_flat = columns.flatten(order = 'F')
-    columns_reshape = columns_flat.reshape(-1, 1)
-    rows_flat = rows.flatten(order = 'F')
-    rows_reshape = rows_flat.reshape(-1, 1)
-    #Upper left value
-    upper_left = (height + 1) * columns_reshape + rows_reshape
-    upper_left_int = upper_left.astype(int)
-    #Upper right value
-    upper_right = upper_left_int + (boxsize) * (height + 1)
-    upper_right_int = upper_right.astype(int)
-    #Lower left value
-    lower_left = upper_left + boxsize
-    lower_left_int = lower_left.astype(int)
-    #Lower right value
-    lower_right = upper_right_int + boxsize
-    lower_right_int = lower_right.astype(int)
-    del height_sequence, width_sequence, width_boxsize, height_boxsize, columns, columns_flat, rows, rows_flat, columns_reshape, rows_reshape, upper_right, lower_left, upper_left, lower_right
-
-    #Get the sum of local neighborhood defined by boxSize
-    int_image_flat = int_image_int.flatten(order = 'F')
-    int_image_flat_transpose = int_image_flat.T
-    neighborvals = (int_image_flat_transpose[upper_left_int]
-                    + int_image_flat_transpose[lower_right_int] 
-                    - int_image_flat_transpose[upper_right_int] 
-                    - int_image_flat_transpose[lower_left_int])
-    del lower_left_int, lower_right_int, upper_right_int, upper_left_int, int_image_flat_transpose, int_image_flat, int_image_int
-
-    #Divide the pixel averages by the pixel value
-    reshape_vals = np.reshape(neighborvals, (height - 2 * floor_offset, width - 2 * floor_offset))
-    double_image = label_image[ceil_offset - 1: -floor_offset, ceil_offset - 1: -floor_offset]
-    pix_mask = reshape_vals / double_image
-    pad = np.pad(pix_mask, ((floor_offset, floor_offset), (floor_offset, floor_offset)), mode='constant')
-    thresh = boxsize * boxsize
-    del neighborvals, reshape_vals, ceil_offset, double_image, pix_mask, floor_offset
-
-    #Get perimeter of the object     
-    pad_array = np.array(pad)
-    pad_flat = pad_array.flatten(order = 'F')
-    #Get perimeter indices
-    perimeter_indices = np.where(pad_flat != thresh)
-    perimeter_indices_array = np.asarray(perimeter_indices)
-    perimeter_indices_reshape = perimeter_indices_array.reshape(-1, 1)
-    perimeter_zeros = np.zeros(label_image.shape)
-    perimeter_int = perimeter_zeros.astype(int)
-    perimeter_flat = perimeter_int.flatten(order = 'F')
-    image_flat = label_image.flatten(order = 'F')
-    #Calculate perimeter
-    perimeter_flat[perimeter_indices_reshape] = image_flat[perimeter_indices_reshape]
-    perimeter_reshape = perimeter_flat.reshape(height, width)
-    perimeter_transpose = perimeter_reshape.T
-    del pad_array, pad_flat, thresh, perimeter_indices, perimeter_indices_array, perimeter_zeros, perimeter_int, image_flat, perimeter_indices_reshape, perimeter_flat, perimeter_reshape
-    return perimeter_transpose
-
-def neighbors_find(lbl_img, im_label,pixeldistance):
-    """Calculate the number of objects within d pixels of object n.
+    mask = label_image != 0
+    pixel_labels = label_image[mask]
+    values = intensity_image[mask]
+    order = np.lexsort((values, pixel_labels))
+    pixel_labels = pixel_labels[order]
+    values = values[order]
+    del mask, order
+
+    #Position of each object in the sorted pixels
+    label, starts, counts = np.unique(pixel_labels, return_index=True, return_counts=True)
+    last = starts + counts - 1
+    inverse = np.repeat(np.arange(len(label)), counts)
+    del pixel_labels
+    if len(label) == 0:
+        return {key: np.zeros(0) for key in ['label', 'count', 'min', 'max', 'median', 'mean', 'standard_deviation',
+                                             'skewness', 'kurtosis', 'mode', 'entropy']}
+
+    stats = {'label': label,
+             'count': counts,
+             'min': values[starts],
+             'max': values[last],
+             'median': (values[starts + (counts - 1)//2].astype(np.double) + values[starts + counts//2]) / 2}
+
+    #Moments
+    stats['mean'], (m2, m3, m4) = _central_moments(values.astype(np.double), inverse, counts, [2, 3, 4])
+    stats['standard_deviation'] = np.sqrt(m2 / counts)
+    stats['skewness'] = _standardized_moment(counts, stats['mean'], m2, m3, 3)
+    stats['kurtosis'] = _standardized_moment(counts, stats['mean'], m2, m4, 4)
+
+    #Runs of equal intensities in each object
+    run_starts = np.flatnonzero(np.concatenate(([True], (values[1:] != values[:-1]) | (inverse[1:] != inverse[:-1]))))
+    run_lengths = np.diff(np.append(run_starts, len(values)))
+    run_objects = inverse[run_starts]
+
+    #The mode is the longest run, and the smallest intensity if there is a tie
+    longest = np.lexsort((run_starts, -run_lengths, run_objects))
+    first = np.concatenate(([True], run_objects[longest][1:] != run_objects[longest][:-1]))
+    stats['mode'] = values[run_starts[longest[first]]]
+
+    #Shannon entropy (base 2) of the intensities
+    probability = run_lengths / counts[run_objects]
+    stats['entropy'] = -np.bincount(run_objects, probability * np.log2(probability), len(label))
+
+    return stats
+
+def label_adjacency(lbl_img, labels, pixeldistance):
+    """Find the pairs of objects that are within d pixels of each other.
+
+    Only the border pixels of each object are compared against the labels in
+    a (2d+1)x(2d+1) window, since any pixel within d pixels of another object
+    has a border pixel of its own object in between.
 
     Args:
-        lbl_image (ndarray): Labeled image array.
-        im_label (int): list of all labels in the image.
+        lbl_img (ndarray): Labeled image array.
+        labels (list): Sorted list of all labels in the image.
         pixeldistance (int): Pixel distance value.
 
     Returns:
-        An array showing the number of neighbors touching the object for each object in labeled image. 
+        A sparse boolean adjacency matrix, with rows and columns in the same order as labels.
 
     Note:
-        Number_of_Neighbors = neighbors_find(label_image, im_label, pixeldistance=None)
-        Computes the number of objects within 5 pixels of each object.
+        adjacency = label_adjacency(label_image, labels, pixeldistance=5)
+        Number_of_Neighbors = np.diff(adjacency.indptr)
+        Neighbors of labels[i] = labels[adjacency.indices[adjacency.indptr[i]:adjacency.indptr[i+1]]]
 
     """
-    nei=[]
-    num_nei=[]
-    shape_img = lbl_img.shape
-    #Find contours
-    contours = cv2.findContours((lbl_img==im_label).astype('uint8'),cv2.RETR_CCOMP, cv2.CHAIN_APPROX_TC89_KCOS)[0]
-    for contour in contours:
-        ck= [(contour[i][j]) for i in range(0,len(contour)) for j in  range(0,len(contour[i]))]
-        #Get borderpoints
-        pxx = [x[0] for x in ck]
-        pyy = [x[1] for x in ck]
-        pypdd = [int(py-pixeldistance) for py in pyy]
-        pxpdd = [int(px-pixeldistance) for px in pxx]
-        pypd_rnn=[int(py+pixeldistance) for py in pyy]
-        pxpd_rnn=[int(px+pixeldistance) for px in pxx]
-        cand = [(l,k) for pypd,pypd_rn,pxpd,pxpd_rn in zip(pypdd,pypd_rnn,pxpdd,pxpd_rnn) for l in range(pypd,pypd_rn+1) for k in range(pxpd,pxpd_rn+1)]
-        values=[lbl_img[l][k] for l,k in cand if(l<shape_img[0] and k<shape_img[1] and l>=0 and k>=0)]
-        nei.append(values)
-        #Get list of number of neighbors
-        uniq_nei=np.unique(nei)
-        num_nei.append(len(uniq_nei)-2)
-        nei=[]
-    num_nei = num_nei[0]
-    return num_nei
-
-def feret_diameter(lbl_img, boxsize, thetastart, thetastop):
-    """Calculate the maximum caliper diamter and minimum caliper diameter of an object at angle(1-180degrees).
+    labels = np.asarray(labels)
+    #Get border pixels of the objects
+    pad = np.pad(lbl_img, 1)
+    border = (lbl_img != 0) & ((pad[:-2, 1:-1] != lbl_img) | (pad[2:, 1:-1] != lbl_img) |
+                               (pad[1:-1, :-2] != lbl_img) | (pad[1:-1, 2:] != lbl_img))
+    rows, cols = np.nonzero(border)
+    source = lbl_img[rows, cols]
+    #Pad the image so every window is inside the image
+    pad = np.pad(lbl_img, pixeldistance)
+    pairs = []
+    for dy in range(2 * pixeldistance + 1):
+        shifted = []
+        for dx in range(2 * pixeldistance + 1):
+            target = pad[rows + dy, cols + dx]
+            keep = (target != 0) & (target != source)
+            shifted.append(np.stack((source[keep], target[keep])))
+        pairs.append(np.unique(np.concatenate(shifted, axis=1), axis=1))
+    pairs = np.unique(np.concatenate(pairs, axis=1), axis=1)
+    #Make the adjacency symmetric
+    pairs = np.searchsorted(labels, np.concatenate((pairs, pairs[::-1]), axis=1))
+    adjacency = csr_matrix((np.ones(pairs.shape[1], dtype=bool), (pairs[0], pairs[1])),
+                           shape=(len(labels), len(labels)))
+    adjacency.sum_duplicates()
+    return adjacency
+
+def feret_diameter(lbl_img, labels):
+    """Calculate the maximum and minimum caliper diameters of every object with rotating calipers.
+
+    Pixels are treated as unit squares, so the calipers are run on the convex hull of the pixel corners
+    of each object. The hulls are walked for all objects at once, one hull edge at a time.
 
     Args:
-        lbl_image (ndarray): Labeled image array.
-        boxsize (int): Box size value.
-        thetastart (int): Angle start value by default it is 1.
-        thetastop (int): Angle stop value by default it is 180.
+        lbl_img (ndarray): Labeled image array.
+        labels (list): Sorted list of all labels in the image.
 
     Returns:
-        An array with feret diameters of the corresponding objects at each of the angles in theta.
+        Arrays with the maximum feret diameter, minimum feret diameter, and the angles (in degrees,
+        counterclockwise from the x-axis) of the maximum and minimum feret diameters of each object.
 
     """
-    counts_scalar_copy=None
-
-    #Convert to radians
-    theta = np.arange(thetastart, thetastop + 1)
-    theta = np.asarray(theta)
-    theta = np.radians(theta)
-
-    #Get perimeter of objects
-    obj_edges = box_border_search(lbl_img, boxsize=3)
-
-    #Get indices and label of all pixels
-    obj_edges_flat = obj_edges.flatten(order = 'F')
-    obj_edges_reshape = obj_edges_flat.reshape(-1, 1)
-    objnum = obj_edges_reshape[obj_edges_reshape != 0]
-    obj_edges_transpose = obj_edges.T
-    positionx = np.where(obj_edges_transpose)[0]
-    positionx_reshape = positionx.reshape(-1, 1)
-    positiony = np.where(obj_edges_transpose)[1]
-    positiony_reshape = positiony.reshape(-1, 1)
-    index = list(range(len(objnum)))
-    index = np.asarray(index).reshape(objnum.shape)
-    stack_index_objnum = np.column_stack((index, objnum))
-    del obj_edges_flat, obj_edges_reshape, objnum, index, obj_edges, positionx, obj_edges_transpose, positiony
-
-    #Sort pixels by label
-    sort_index_objnum = sorted(stack_index_objnum, key=itemgetter(1))
-    index_objnum_array = np.asarray(sort_index_objnum)
-    index_split = index_objnum_array[:, 0]
-    objnum_split = index_objnum_array[:, 1]
-    positionx_index = positionx_reshape[index_split]
-    positiony_index = positiony_reshape[index_split]
-    del positiony_reshape, index_split, stack_index_objnum, sort_index_objnum, index_objnum_array, positionx_reshape
-
-    #Get number of pixels for each object     
-    objnum_reshape = np.asarray(objnum_split).reshape(-1, 1)
-    difference_objnum = np.diff(objnum_reshape, axis=0)
-    stack_objnum = np.vstack((1, difference_objnum, 1))
-    objbounds = np.where(stack_objnum)
-    objbounds_array = np.asarray(objbounds)
-    objbounds_split = objbounds_array[0, :]
-    objbounds_reshape = objbounds_split.reshape(-1, 1)
-    objbounds_counts = objbounds_reshape[1:]-objbounds_reshape[:-1]
-    del objnum_split, difference_objnum, stack_objnum, objbounds, objbounds_array, objbounds_split, objnum_reshape, objbounds_reshape
-
-    uniqueindices_list = []
-    #Create cell with x, y positions of each objects border
-    for counts in objbounds_counts:
-        counts_scalar = np.asscalar(counts)
-        if counts_scalar == objbounds_counts[0]:
-            uniqueindices_x = positionx_index[:counts_scalar]
-            uniqueindices_y = positiony_index[:counts_scalar]
-            counts_scalar_copy = counts_scalar
-        if counts_scalar != objbounds_counts[0]:
-            index_range = counts_scalar_copy + counts_scalar
-            uniqueindices_x = positionx_index[counts_scalar_copy: index_range]
-            uniqueindices_y = positiony_index[counts_scalar_copy: index_range]
-            counts_scalar_copy = index_range
-        uniqueindices_x_reshape = uniqueindices_x.reshape(-1, 1)
-        uniqueindices_y_reshape = uniqueindices_y.reshape(-1, 1)
-        uniqueindices_concate = np.concatenate((uniqueindices_x_reshape, uniqueindices_y_reshape), axis=1)
-        uniqueindices_list.append(uniqueindices_concate)
-        del uniqueindices_concate, uniqueindices_x, uniqueindices_y, uniqueindices_x_reshape, uniqueindices_y_reshape
-
-    #Center points based on object centroid     
-    uniqueindices_array = np.asarray(uniqueindices_list)
-    meanind_list = []
-    for indices in uniqueindices_array:
-        repitations= (len(indices), 2)
-        sum_indices0 = np.sum(indices[:, 0])
-        sum_indices1 = np.sum(indices[:, 1])
-        length_indices0 =(sum_indices0 / len(indices))
-        length_indices1 =(sum_indices1 / len(indices))
-        mean_tile0 = np.tile(length_indices0, repitations)
-        sub_mean0_indices = np.subtract(indices, mean_tile0)
-        sub_mean0_indices = sub_mean0_indices[:, 0]
-        mean_tile1 = np.tile(length_indices1, repitations)
-        sub_mean1_indices = np.subtract(indices, mean_tile1)
-        sub_mean1_indices = sub_mean1_indices[:, 1]
-        meanind0_reshape = sub_mean0_indices.reshape(-1, 1)
-        meanind1_reshape = sub_mean1_indices.reshape(-1, 1)
-        meanind_concate = np.concatenate((meanind0_reshape, meanind1_reshape), axis=1)
-        meanind_list.append(meanind_concate)
-        del meanind_concate, sum_indices0, sum_indices1, length_indices0, mean_tile0, repitations, length_indices1, indices, mean_tile1, sub_mean0_indices, sub_mean1_indices
-    del uniqueindices_array     
-    center_point = np.asarray(meanind_list)
-
-    #Create transformation matrix
-    rot_trans = np.array((np.cos(theta), -np.sin(theta)))
-    rot_trans = rot_trans.T
-    rot_list = []
-    rot_position=[]
-    sub_rot_list=[]
-
-    #Calculate rotation positions
-    for point in center_point:
-        rot_position.clear()
-        for rotation in rot_trans:
-            rot_mul = np.multiply(rotation, point)
-            rot_add = np.add(rot_mul[:, 0], rot_mul[:, 1])
-            rot_position.append(rot_add)
-        rot_array = np.asarray(rot_position)
-        rot_list.append(rot_array)
-        del rot_array, rotation, rot_mul, rot_add
-    rot_position.clear()
-    del point, center_point
-
-    feretdiam = []
-    #Get Ferets diameter  
-    for rot in rot_list:
-        sub_rot_list.clear()
-        for rt,trans in zip(rot, rot_trans):
-            sub_rot = np.subtract(np.max(rt), np.min(rt))
-            sub_rot_add = np.add(sub_rot, np.sum(abs(trans)))
-            sub_rot_list.append(sub_rot_add)
-            del sub_rot_add, sub_rot, trans, rt
-        convert_array = np.asarray(sub_rot_list)
-        convert_reshape = convert_array.reshape(-1, 1)
-        feretdiam.append(convert_reshape)
-        del convert_reshape, convert_array
-    sub_rot_list.clear()
-    feret_diameter = np.asarray(feretdiam)
-    del feretdiam, rot_list, theta, rot
-    return feret_diameter
+    labels = np.asarray(labels)
+    num_objects = len(labels)
+    maxferet = np.zeros(num_objects)
+    minferet = np.full(num_objects, np.inf)
+    maxferet_angle = np.zeros(num_objects)
+    minferet_angle = np.zeros(num_objects)
+    if num_objects == 0:
+        return maxferet, minferet, maxferet_angle, minferet_angle
+
+    #Get the first and last pixel of every run of pixels in a row, which contain the convex hull
+    pad = np.pad(lbl_img, ((0, 0), (1, 1)))
+    rows_start, cols_start = np.nonzero((lbl_img != 0) & (pad[:, :-2] != lbl_img))
+    rows_stop, cols_stop = np.nonzero((lbl_img != 0) & (pad[:, 2:] != lbl_img))
+    objnum = np.searchsorted(labels, np.concatenate((lbl_img[rows_start, cols_start], lbl_img[rows_stop, cols_stop])))
+    #Outer corners of the pixels, with the y-axis pointing up
+    x = np.concatenate((cols_start, cols_stop + 1))
+    y = -np.concatenate((rows_start, rows_stop))
+    order = np.argsort(objnum, kind='stable')
+    corners = np.concatenate((np.stack((x, y), axis=1)[order], np.stack((x, y - 1), axis=1)[order]))
+    bounds = np.searchsorted(objnum[order], np.arange(num_objects + 1))
+    corners = [np.concatenate((corners[start:stop], corners[start + len(order):stop + len(order)]))
+               for start, stop in zip(bounds[:-1], bounds[1:])]
+    del pad, rows_start, cols_start, rows_stop, cols_stop, objnum, x, y, order, bounds
+
+    #Get the counterclockwise convex hull of each object, largest hulls first
+    hulls = [cv2.convexHull(points.astype(np.int32), clockwise=False)[:, 0, :] for points in corners]
+    hull_sizes = np.array([len(hull) for hull in hulls])
+    objorder = np.argsort(-hull_sizes, kind='stable')
+    hull_sizes = hull_sizes[objorder]
+    hull = np.concatenate([hulls[i] for i in objorder]).astype(np.int64)
+    offsets = np.concatenate(([0], np.cumsum(hull_sizes)[:-1]))
+    del corners, hulls
+
+    #Rotate the calipers along each hull edge, keeping the vertex farthest from the edge
+    antipode = np.ones(num_objects, dtype=np.int64)
+    max_squared = np.zeros(num_objects, dtype=np.int64)
+    max_vector = np.zeros((num_objects, 2), dtype=np.int64)
+    min_width = np.full(num_objects, np.inf)
+    min_edge = np.zeros((num_objects, 2), dtype=np.int64)
+    for edge_index in range(hull_sizes[0]):
+        active = np.count_nonzero(hull_sizes > edge_index)
+        offset = offsets[:active]
+        size = hull_sizes[:active]
+        point0 = hull[offset + edge_index]
+        point1 = hull[offset + (edge_index + 1) % size]
+        edge = point1 - point0
+        farthest = antipode[:active]
+        while True:
+            step = hull[offset + (farthest + 1) % size] - hull[offset + farthest % size]
+            advance = edge[:, 0] * step[:, 1] - edge[:, 1] * step[:, 0] > 0
+            if not advance.any():
+                break
+            farthest[advance] += 1
+        point = hull[offset + farthest % size]
+        #Minimum feret is the smallest distance between an edge and its farthest vertex
+        width = (edge[:, 0] * (point - point0)[:, 1] - edge[:, 1] * (point - point0)[:, 0]) / np.hypot(edge[:, 0], edge[:, 1])
+        smaller = width < min_width[:active]
+        min_width[:active][smaller] = width[smaller]
+        min_edge[:active][smaller] = edge[smaller]
+        #Maximum feret is the largest distance between antipodal vertices
+        for vertex in (point0, point1):
+            vector = point - vertex
+            squared = (vector ** 2).sum(axis=1)
+            larger = squared > max_squared[:active]
+            max_squared[:active][larger] = squared[larger]
+            max_vector[:active][larger] = vector[larger]
+
+    maxferet[objorder] = np.sqrt(max_squared)
+    minferet[objorder] = min_width
+    maxferet_angle[objorder] = np.degrees(np.arctan2(max_vector[:, 1], max_vector[:, 0])) % 180
+    #The minimum feret is measured perpendicular to its hull edge
+    minferet_angle[objorder] = (np.degrees(np.arctan2(min_edge[:, 1], min_edge[:, 0])) + 90) % 180
+    return maxferet, minferet, maxferet_angle, minferet_angle
 
 def polygonality_hexagonality(area, perimeter, neighbors, solidity, maxferet, minferet):
-    """Calculate the polygonality score, hexagonality score and hexagonality standard deviation of object n.
+    """Calculate the polygonality score, hexagonality score and hexagonality standard deviation of all objects.
 
     Args:
-        area (int): Number of pixels of the region.
-        perimeter (float): Perimeter of object which approximates the contour as a line through the centers of border pixels using a 4-connectivity.
-        neighbors (int): Number of neighbors touching the object.
-        solidity (float): Ratio of pixels in the region to pixels of the convex hull image.
-        maxferet (float): Maximum caliper distance across the entire object.
-        minferet (float): Minimum caliper distance across the entire object.
+        area (array): Number of pixels of each region.
+        perimeter (array): Perimeter of each object which approximates the contour as a line through the centers of border pixels using a 4-connectivity.
+        neighbors (array): Number of neighbors touching each object.
+        solidity (array): Ratio of pixels in each region to pixels of the convex hull image.
+        maxferet (array): Maximum caliper distance across each object.
+        minferet (array): Minimum caliper distance across each object.
 
     Returns:
         The polygonality score ranges from -infinity to 10. Score 10 indicates the object shape is polygon and score -infinity indicates the object shape is not polygon.
         The hexagonality score ranges from -infinity to 10. Score 10 indicates the object shape is hexagon and score -infinity indicates the object shape is not hexagon.
         The dispersion of hexagonality_score relative to its mean.
+        Each is an array with one value per object, which is nan for objects with less than 3 neighbors or no perimeter.
 
     """
-    area_list=[]
-    perim_list=[]
+    area = np.asarray(area, dtype=float)
+    perimeter = np.asarray(perimeter, dtype=float)
+    neighbors = np.asarray(neighbors, dtype=int)
+    solidity = np.asarray(solidity, dtype=float)
+    maxferet = np.asarray(maxferet, dtype=float)
+    minferet = np.asarray(minferet, dtype=float)
 
-    #Calculate area hull
-    area_hull = area / solidity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #Calculate area hull
+        area_hull = area / solidity
 
-    #Calculate Perimeter hull
-    perim_hull = 6 * math.sqrt(area_hull / (1.5 * math.sqrt(3)))
+        #Calculate Perimeter hull
+        perim_hull = 6 * np.sqrt(area_hull / (1.5 * math.sqrt(3)))
 
-    if neighbors == 0:
-        perimeter_neighbors = float("NAN")
-    elif neighbors > 0:
-        perimeter_neighbors = perimeter / neighbors
+        perimeter_neighbors = np.where(neighbors > 0, perimeter / neighbors, np.nan)
 
-    #Polygonality metrics calculated based on the number of sides of the polygon
-    if neighbors > 2:
-        poly_size_ratio = 1 - math.sqrt((1 - (perimeter_neighbors / (math.sqrt((4 * area) / (neighbors * (1 / (math.tan(math.pi / neighbors)))))))) * (1 -(perimeter_neighbors / (math.sqrt(( 4 * area) / (neighbors * (1 / (math.tan(math.pi / neighbors)))))))))
-        poly_area_ratio = 1 - math.sqrt((1 - (area / (0.25 * neighbors * perimeter_neighbors * perimeter_neighbors * (1 / (math.tan(math.pi / neighbors)))))) * (1 - (area / (0.25 * neighbors * perimeter_neighbors * perimeter_neighbors * (1 / (math.tan(math.pi / neighbors)))))))
+        #Polygonality metrics calculated based on the number of sides of the polygon
+        cot_neighbors = 1 / np.tan(math.pi / neighbors)
+        poly_size = perimeter_neighbors / np.sqrt((4 * area) / (neighbors * cot_neighbors))
+        poly_size_ratio = 1 - np.sqrt((1 - poly_size) * (1 - poly_size))
+        poly_area = area / (0.25 * neighbors * perimeter_neighbors * perimeter_neighbors * cot_neighbors)
+        poly_area_ratio = 1 - np.sqrt((1 - poly_area) * (1 - poly_area))
 
         #Calculate Polygonality Score
         poly_ave = 10 * (poly_size_ratio + poly_area_ratio) / 2
 
-        #Hexagonality metrics calculated based on a convex, regular, hexagon     
+        #Hexagonality metrics calculated based on a convex, regular, hexagon
         apoth1 = math.sqrt(3) * perimeter / 12
         apoth2 = math.sqrt(3) * maxferet / 4
         apoth3 = minferet / 2
@@ -355,94 +564,73 @@ def polygonality_hexagonality(area, perimeter, neighbors, solidity, maxferet, mi
         side3 = minferet / math.sqrt(3)
         side4 = perim_hull / 6
 
-        #Unique area calculations from the derived and primary measures above          
-        area1 = 0.5 * (3 * math.sqrt(3)) * side1 * side1
-        area2 = 0.5 * (3 * math.sqrt(3)) * side2 * side2
-        area3 = 0.5 * (3 * math.sqrt(3)) * side3 * side3
-        area4 = 3 * side1 * apoth2
-        area5 = 3 * side1 * apoth3
-        area6 = 3 * side2 * apoth3
-        area7 = 3 * side4 * apoth1
-        area8 = 3 * side4 * apoth2
-        area9 = 3 * side4 * apoth3
-        area10 = area_hull
-        area11 = area
-
-        #Create an array of all unique areas
-        list_area=[area1, area2, area3, area4, area5, area6, area7, area8, area9, area10, area11]
-        area_uniq = np.asarray(list_area, dtype=float)
-
-        #Create an array of the ratio of all areas to eachother    
-        for ib in range (0, len(area_uniq)):
-            for ic in range (ib + 1, len(area_uniq)):
-                area_ratio = 1 - math.sqrt((1 - (area_uniq[ib] / area_uniq[ic])) * (1 - (area_uniq[ib] / area_uniq[ic])))
-                area_list.append(area_ratio)
-        area_array = np.asarray(area_list)
-        stat_value_area = stats.describe(area_array)
-        del area_uniq, list_area, area_array, area_list
-
-        #Create Summary statistics of all array ratios      
-        area_ratio_ave = stat_value_area.mean
-        area_ratio_sd = math.sqrt(stat_value_area.variance)
+        #Create an array of all unique areas from the derived and primary measures above
+        area_uniq = np.stack((0.5 * (3 * math.sqrt(3)) * side1 * side1,
+                              0.5 * (3 * math.sqrt(3)) * side2 * side2,
+                              0.5 * (3 * math.sqrt(3)) * side3 * side3,
+                              3 * side1 * apoth2,
+                              3 * side1 * apoth3,
+                              3 * side2 * apoth3,
+                              3 * side4 * apoth1,
+                              3 * side4 * apoth2,
+                              3 * side4 * apoth3,
+                              area_hull,
+                              area), axis=1)
+
+        #Create an array of the ratio of all areas to eachother
+        ib, ic = np.triu_indices(area_uniq.shape[1], 1)
+        area_ratio = area_uniq[:, ib] / area_uniq[:, ic]
+        area_array = 1 - np.sqrt((1 - area_ratio) * (1 - area_ratio))
+
+        #Create Summary statistics of all array ratios
+        area_ratio_ave = area_array.mean(axis=1)
+        area_ratio_sd = area_array.std(axis=1, ddof=1)
 
         #Set the hexagon area ratio equal to the average Area Ratio
         hex_area_ratio = area_ratio_ave
 
         # Perimeter Ratio Calculations
-        # Two extra apothems are now useful                      
+        # Two extra apothems are now useful
         apoth4 = math.sqrt(3) * perim_hull / 12
-        apoth5 = math.sqrt(4 * area_hull / (4.5 * math.sqrt(3)))
-
-        perim1 = math.sqrt(24 * area / math.sqrt(3))
-        perim2 = math.sqrt(24 * area_hull / math.sqrt(3))
-        perim3 = perimeter
-        perim4 = perim_hull
-        perim5 = 3 * maxferet
-        perim6 = 6 * minferet / math.sqrt(3)
-        perim7 = 2 * area / (apoth1)
-        perim8 = 2 * area / (apoth2)
-        perim9 = 2 * area / (apoth3)
-        perim10 = 2 * area / (apoth4)
-        perim11 = 2 * area / (apoth5)
-        perim12 = 2 * area_hull / (apoth1)
-        perim13 = 2 * area_hull / (apoth2)
-        perim14 = 2 * area_hull / (apoth3)
+        apoth5 = np.sqrt(4 * area_hull / (4.5 * math.sqrt(3)))
 
         #Create an array of all unique Perimeters
-        list_perim = [perim1, perim2, perim3, perim4, perim5, perim6, perim7, perim8, perim9, perim10, perim11, perim12, perim13, perim14]
-        perim_uniq = np.asarray(list_perim, dtype=float)
-        del list_perim
-
-        #Create an array of the ratio of all Perimeters to eachother     
-        for ib in range (0, len(perim_uniq)):
-            for ic in range (ib + 1, len(perim_uniq)):
-                perim_ratio = 1 - math.sqrt((1 - (perim_uniq[ib] / perim_uniq[ic])) * (1 - (perim_uniq[ib] / perim_uniq[ic])))
-                perim_list.append(perim_ratio)
-                del perim_ratio
-        perim_array = np.asarray(perim_list)
-        stat_value_perim = stats.describe(perim_array)
-        del perim_uniq, perim_list, perim_array
-
-        #Create Summary statistics of all array ratios     
-        perim_ratio_ave = stat_value_perim.mean
-        perim_ratio_sd = math.sqrt(stat_value_perim.variance)
-
-        #Set the HSR equal to the average Perimeter Ratio     
+        perim_uniq = np.stack((np.sqrt(24 * area / math.sqrt(3)),
+                               np.sqrt(24 * area_hull / math.sqrt(3)),
+                               perimeter,
+                               perim_hull,
+                               3 * maxferet,
+                               6 * minferet / math.sqrt(3),
+                               2 * area / (apoth1),
+                               2 * area / (apoth2),
+                               2 * area / (apoth3),
+                               2 * area / (apoth4),
+                               2 * area / (apoth5),
+                               2 * area_hull / (apoth1),
+                               2 * area_hull / (apoth2),
+                               2 * area_hull / (apoth3)), axis=1)
+
+        #Create an array of the ratio of all Perimeters to eachother
+        ib, ic = np.triu_indices(perim_uniq.shape[1], 1)
+        perim_ratio = perim_uniq[:, ib] / perim_uniq[:, ic]
+        perim_array = 1 - np.sqrt((1 - perim_ratio) * (1 - perim_ratio))
+
+        #Create Summary statistics of all array ratios
+        perim_ratio_ave = perim_array.mean(axis=1)
+        perim_ratio_sd = perim_array.std(axis=1, ddof=1)
+
+        #Set the HSR equal to the average Perimeter Ratio
         hex_size_ratio = perim_ratio_ave
         hex_sd = np.sqrt((area_ratio_sd**2 + perim_ratio_sd**2) / 2)
 
         # Calculate Hexagonality score
         hex_ave = 10 * (hex_area_ratio + hex_size_ratio) / 2
 
-    if neighbors < 3 or perimeter == 0:
-        poly_size_ratio = "NAN"
-        poly_area_ratio = "NAN"
-        poly_ave = "NAN"
-        hex_size_ratio = "NAN"
-        hex_area_ratio = "NAN"
-        hex_ave = "NAN"
-        hex_sd = "NAN"
-    return(poly_ave, hex_ave, hex_sd)
+    invalid = (neighbors < 3) | (perimeter == 0)
+    poly_ave[invalid] = np.nan
+    hex_ave[invalid] = np.nan
+    hex_sd[invalid] = np.nan
+    return poly_ave, hex_ave, hex_sd
 
 def feature_extraction(features,
                         embeddedpixelsize,
@@ -454,7 +642,8 @@ def feature_extraction(features,
                         img_emb_unit=None,
                         label_image=None,
                         seg_file_names1=None,
-                        int_file_name=None):
+                        int_file_name=None,
+                        tile_size=None):
     """Calculate shape and intensity based features.
 
     Args:
@@ -468,15 +657,13 @@ def feature_extraction(features,
         intensity_image (ndarray): Intensity image array.
         pixelDistance (int): Distance between pixels to calculate the neighbors touching the object and default valus is 5.
         channel (int): Channel of the image.
+        tile_size (int): If given, label_image and intensity_image are paths to the images, and features are calculated one tile at a time.
         
     Returns:
         Dataframe containing the features extracted and the filename of the labeled image.
 
     """ 
     df_insert = pd.DataFrame([])
-    boxsize = 3
-    thetastart = 1
-    thetastop = 180
     if pixelDistance is None:
         pixelDistance = 5
         
@@ -521,6 +708,11 @@ def feature_extraction(features,
             uxx = (y**2).sum()
             uyy = (x**2).sum()
             uxy = (x*y).sum()
+            tolerance = MOMENT_TOLERANCE * (uxx + uyy)
+            if abs(uxy) <= tolerance:
+                uxy = 0.0
+            if abs(uyy - uxx) <= tolerance:
+                uyy = uxx
             if (uyy > uxx):
                 num = uyy - uxx + np.sqrt((uyy - uxx)**2 + 4*uxy**2)
                 den = 2*uxy
@@ -641,12 +833,17 @@ def feature_extraction(features,
         logger.debug('Completed extracting solidity for ' + seg_file_names1.name)
         return data_dict
 
+    intensity_stats = {}
+    def label_intensity_statistics():
+        """Calculate the intensity statistics of all the regions of interest once, and reuse them for every intensity feature."""
+        if not intensity_stats:
+            intensity_stats.update(intensity_statistics(label_image, intensity_image))
+        return intensity_stats
+
     def mean_intensity(*args):
         """Calculate mean_intensity for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [(np.mean(intensity[seg])) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = label_intensity_statistics()['mean'].tolist()
         else:
             data_dict =np.mean(intensity_image.reshape(-1))
         logger.debug('Completed extracting mean intensity for ' + int_file_name)
@@ -655,9 +852,7 @@ def feature_extraction(features,
     def max_intensity(*args):
         """Calculate maximum intensity for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [int((np.max(intensity[seg]))) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = [int(value) for value in label_intensity_statistics()['max']]
         else:
             data_dict = np.max(intensity_image.reshape(-1))
         logger.debug('Completed extracting maximum intensity for ' + int_file_name)
@@ -666,9 +861,7 @@ def feature_extraction(features,
     def min_intensity(*args):
         """Calculate minimum intensity for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [int((np.min(intensity[seg]))) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = [int(value) for value in label_intensity_statistics()['min']]
         else:
             data_dict = np.min(intensity_image.reshape(-1))
         logger.debug('Completed extracting minimum intensity for ' + int_file_name)
@@ -677,9 +870,7 @@ def feature_extraction(features,
     def median(*args):
         """Calculate median for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [int((np.median(intensity[seg]))) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = [int(value) for value in label_intensity_statistics()['median']]
         else:
             data_dict = np.median(intensity_image.reshape(-1))
         logger.debug('Completed extracting median for ' + int_file_name)
@@ -688,10 +879,7 @@ def feature_extraction(features,
     def mode(*args):
         """Calculate mode for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            mode_list = [modevalue(intensity[seg])[0] for intensity, seg in zip(intensity_images, imgs)]
-            data_dict = [str(mode_ls)[1:-1] for mode_ls in mode_list]
+            data_dict = [str(mode_ls) for mode_ls in label_intensity_statistics()['mode'].tolist()]
         else:
             data_dict = modevalue(intensity_image.reshape(-1))[0]
         logger.debug('Completed extracting mode for ' + int_file_name)
@@ -700,9 +888,7 @@ def feature_extraction(features,
     def standard_deviation(*args):
         """Calculate standard deviation for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [(np.std(intensity[seg])) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = label_intensity_statistics()['standard_deviation'].tolist()
         else:
             data_dict= np.std(intensity_image.reshape(-1))
         logger.debug('Completed extracting standard deviation for ' + int_file_name)
@@ -711,9 +897,7 @@ def feature_extraction(features,
     def skewness(*args):
         """Calculate skewness for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [skew(intensity[seg], axis=0, bias=True) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = label_intensity_statistics()['skewness'].tolist()
         else:
             data_dict= skew(intensity_image.reshape(-1),axis=0, bias=True)
         logger.debug('Completed extracting skewness for ' + int_file_name)
@@ -722,9 +906,7 @@ def feature_extraction(features,
     def entropy(*args):
         """Calculate entropy for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [shannon_entropy(intensity[seg]) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = label_intensity_statistics()['entropy'].tolist()
         else:
             data_dict = shannon_entropy(intensity_image.reshape(-1))
         logger.debug('Completed extracting entropy for ' + int_file_name)
@@ -733,9 +915,7 @@ def feature_extraction(features,
     def kurtosis(*args):
         """Calculate kurtosis for all the regions of interest in the image."""
         if label_image is not None:
-            intensity_images = [region.intensity_image for region in regions]
-            imgs = [region.image for region in regions]
-            data_dict = [kurto(intensity[seg], axis=0, fisher=False, bias=True) for intensity, seg in zip(intensity_images, imgs)]
+            data_dict = label_intensity_statistics()['kurtosis'].tolist()
         else:
             data_dict= kurto(intensity_image.reshape(-1),axis=0, fisher=False, bias=True)
         logger.debug('Completed extracting kurtosis for ' + int_file_name)
@@ -743,19 +923,23 @@ def feature_extraction(features,
 
     def neighbors(seg_img, *args):
         """Calculate neighbors for all the regions of interest in the image."""
-        data_dict=[]
         label=[region.label for region in regions]
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers = multiprocessing.cpu_count())
-        results = executor.map(neighbors_find, repeat(seg_img), label,repeat(pixelDistance))
-        data_dict = list(results)
+        adjacency = label_adjacency(seg_img, label, pixelDistance)
+        data_dict = np.diff(adjacency.indptr).tolist()
         logger.debug('Completed extraction neighbors for ' + seg_file_names1.name)
         return data_dict
 
+    feret_stats = {}
+    def label_feret_diameter(seg_img):
+        """Calculate the feret diameters of all the regions of interest once, and reuse them for every feret feature."""
+        if not feret_stats:
+            label=[region.label for region in regions]
+            feret_stats['maxferet'], feret_stats['minferet'], _, _ = feret_diameter(seg_img, label)
+        return feret_stats
+
     def maxferet(seg_img, *args):
         """Calculate maxferet for all the regions of interest in the image."""
-        edges= box_border_search(seg_img, boxsize)
-        feretdiam = feret_diameter(edges, boxsize, thetastart, thetastop)
-        maxferet1 = [np.max(feret) for feret in feretdiam]
+        maxferet1 = label_feret_diameter(seg_img)['maxferet'].tolist()
         if unitLength and not embeddedpixelsize:
             maxferet = [dt_pixel / pixelsPerunit for dt_pixel in maxferet1]
         else:
@@ -765,9 +949,7 @@ def feature_extraction(features,
 
     def minferet(seg_img, *args):
         """Calculate minferet for all the regions of interest in the image."""
-        edges= box_border_search(seg_img, boxsize)
-        feretdiam = feret_diameter(edges, boxsize, thetastart, thetastop)
-        minferet1 = [np.min(feret) for feret in feretdiam]
+        minferet1 = label_feret_diameter(seg_img)['minferet'].tolist()
         if unitLength and not embeddedpixelsize:
             minferet = [dt_pixel / pixelsPerunit for dt_pixel in minferet1]
         else:
@@ -783,29 +965,29 @@ def feature_extraction(features,
         poly_solidity = solidity(seg_img)
         poly_maxferet = maxferet(seg_img, units)
         poly_minferet = minferet(seg_img, units)
-        poly_hex= [polygonality_hexagonality(area_metric, perimeter_metric, int(neighbor_metric), solidity_metric, maxferet_metric, minferet_metric) for area_metric, perimeter_metric, neighbor_metric, solidity_metric, maxferet_metric, minferet_metric in zip(poly_area, poly_peri, poly_neighbor, poly_solidity, poly_maxferet, poly_minferet)]
+        poly_hex = polygonality_hexagonality(poly_area, poly_peri, poly_neighbor, poly_solidity, poly_maxferet, poly_minferet)
+        #Objects with less than 3 neighbors or no perimeter are not scored
+        poly_hex = [['NAN' if np.isnan(score) else score for score in scores] for scores in poly_hex]
         return poly_hex
 
     def polygonality_score(seg_img, units, *args):
         """Get polygonality score for all the regions of interest in the image."""
-        if features == 'all':
-            poly_hex = poly_hex_score(seg_img, units)
         poly_hex = poly_hex_score(seg_img, units)
-        polygonality_score = [poly[0] for poly in poly_hex]
+        polygonality_score = poly_hex[0]
         logger.debug('Completed extracting polygonality score for ' + seg_file_names1.name)
         return polygonality_score
 
     def hexagonality_score(seg_img, units, *args):
         """Get hexagonality score for all the regions of interest in the image."""
         poly_hex = poly_hex_score(seg_img, units)
-        hexagonality_score = [poly[1] for poly in poly_hex]
+        hexagonality_score = poly_hex[1]
         logger.debug('Completed extracting hexagonality score for ' + seg_file_names1.name)
         return hexagonality_score
 
     def hexagonality_sd(seg_img, units, *args):
         """Get hexagonality standard deviation for all the regions of interest in the image."""
         poly_hex = poly_hex_score(seg_img, units)
-        hexagonality_sd = [poly[2] for poly in poly_hex]
+        hexagonality_sd = poly_hex[2]
         logger.debug('Completed extracting hexagonality standard deviation for ' + seg_file_names1.name)
         return hexagonality_sd
     
@@ -818,11 +1000,9 @@ def feature_extraction(features,
         #calculate neighbors
         all_neighbor = neighbors(seg_img)
         #calculate maxferet
-        edges= box_border_search(seg_img, boxsize)
-        feretdiam = feret_diameter(edges, boxsize, thetastart, thetastop)
-        all_maxferet = [np.max(feret) for feret in feretdiam]
+        all_maxferet = label_feret_diameter(seg_img)['maxferet'].tolist()
         #calculate minferet
-        all_minferet = [np.min(feret) for feret in feretdiam]  
+        all_minferet = label_feret_diameter(seg_img)['minferet'].tolist()
         if unitLength and not embeddedpixelsize:
             maxferet = [dt_pixel / pixelsPerunit for dt_pixel in all_maxferet]
             minferet = [dt_pixel / pixelsPerunit for dt_pixel in all_minferet]
@@ -858,12 +1038,13 @@ def feature_extraction(features,
         #calculate minor axis length
         all_minor_axis_length = minor_axis_length(seg_img, units)
         #calculate polygonality_score
-        all_polygon_score = [polygonality_hexagonality(area_metric, perimeter_metric, int(neighbor_metric), solidity_metric, maxferet_metric, minferet_metric) for area_metric, perimeter_metric, neighbor_metric, solidity_metric, maxferet_metric, minferet_metric in zip(all_area, all_peri, all_neighbor, all_solidity, all_maxferet, all_minferet)]#seg_img, units)
-        all_polygonality_score = [poly[0] for poly in all_polygon_score]
+        all_polygon_score = polygonality_hexagonality(all_area, all_peri, all_neighbor, all_solidity, all_maxferet, all_minferet)
+        all_polygon_score = [['NAN' if np.isnan(score) else score for score in scores] for scores in all_polygon_score]
+        all_polygonality_score = all_polygon_score[0]
         #calculate hexagonality_score
-        all_hexagonality_score = [poly[1] for poly in all_polygon_score]
+        all_hexagonality_score = all_polygon_score[1]
         #calculate hexagonality standarddeviation
-        all_hexagonality_sd = [poly[2] for poly in all_polygon_score]
+        all_hexagonality_sd = all_polygon_score[2]
         #calculate mean intensity
         all_mean_intensity =  mean_intensity(seg_img, int_img)
         #calculate maximum intensity value
@@ -917,11 +1098,12 @@ def feature_extraction(features,
             'hexagonality_sd': hexagonality_sd,
             'all': all}
     
-    if label_image is not None:
+    if label_image is not None and tile_size is None:
         #Calculate features given as input for all images
         regions = measure.regionprops(label_image, intensity_image)
         #Remove the cells touching the border
         cleared = clear_border(label_image)
+    if label_image is not None:
 
         #pass the filename in csv
         title = seg_file_names1.name
@@ -958,6 +1140,26 @@ def feature_extraction(features,
         features.remove('boundingbox_dimension')
         features.append('bbox_width')
         features.append('bbox_height')
+
+    if tile_size is not None:
+        #Only features that can be merged across tiles are calculated in tiles
+        unsupported = [f for f in features if f not in TILED_FEATURES]
+        if unsupported:
+            raise ValueError('Features {} cannot be extracted in tiles.'.format(unsupported))
+        stats = tiled_statistics(label_image, intensity_image, tile_size)
+
+        def tiled_feature(each_feature, *args):
+            """Get a feature of all the regions of interest from the statistics merged across tiles."""
+            feature, power = TILED_FEATURES[each_feature]
+            if len(stats['label']) == 0:
+                return []
+            data_dict = feature(stats)
+            if unitLength and not embeddedpixelsize and power > 0:
+                data_dict = data_dict / pixelsPerunit**power
+            logger.debug('Completed extracting {} for {}'.format(each_feature, title))
+            return data_dict.tolist()
+
+        FEAT = {each_feature: partial(tiled_feature, each_feature) for each_feature in TILED_FEATURES}
     
     for each_feature in features:
         #Dynamically call the function based on the features required
@@ -1061,7 +1263,10 @@ def feature_extraction(features,
     
     if label_image is not None:
         #Lists all the labels in the image
-        label = [r.label for r in regions]
+        if tile_size is None:
+            label = [r.label for r in regions]
+        else:
+            label = stats['label'].tolist()
         
         if len(label)==1:
             df_insert.insert(0, 'mask_image', title)
@@ -1069,13 +1274,17 @@ def feature_extraction(features,
                df_insert.insert(1, 'intensity_image', int_file_name) 
 
         else:
-            #Measure region props for only the object not touching the border
-            regions1 = np.unique(cleared)[1:]
-            #List of labels for only objects that are not touching the border
-            label_nt_touching = regions1-1
-            #Find whether the object is touching border or not 
-            border_cells = np.full((len(regions)),True,dtype=bool)       
-            border_cells[label_nt_touching]=False
+            if tile_size is None:
+                #Measure region props for only the object not touching the border
+                regions1 = np.unique(cleared)[1:]
+                #List of labels for only objects that are not touching the border
+                label_nt_touching = regions1-1
+                #Find whether the object is touching border or not 
+                border_cells = np.full((len(regions)),True,dtype=bool)       
+                border_cells[label_nt_touching]=False
+            else:
+                #Objects touching the border were found from the merged bounding boxes
+                border_cells = stats['touching_border']
             if intensity_image is None:
             #Create column label and image
                 data = { 'mask_image':title,
@@ -1127,6 +1336,8 @@ def main():
                         help='Pixel distance to calculate the neighbors touching cells', required=False)
     parser.add_argument('--segDir', dest='segDir', type=str,
                         help='Segmented image collection', required=False)
+    parser.add_argument('--tileSize', dest='tileSize', type=int,
+                        help='Extract features one tile at a time for large images', required=False)
     parser.add_argument('--outDir', dest='outDir', type=str,
                         help='Output collection', required=True)
 
@@ -1169,6 +1380,12 @@ def main():
     segDir = args.segDir
     logger.info('segDir = {}'.format(segDir))
 
+    #Size of tiles for out-of-core feature extraction
+    tileSize = args.tileSize
+    logger.info('tileSize = {}'.format(tileSize))
+    if tileSize is not None and tileSize <= 0:
+        raise ValueError('tileSize must be a positive integer.')
+
     #Path to save output csv files
     outDir = args.outDir
     logger.info('outDir = {}'.format(outDir))
@@ -1231,7 +1448,7 @@ def main():
         for intfile in files_int:
             df=None
             channel=None
-            intensity_image,img_emb_unit = read(intfile[0]['file'])
+            intensity_image,img_emb_unit = read(intfile[0]['file'], tileSize)
             int_name = intfile[0]['file'].name
             df,title = feature_extraction(features,
                                           embeddedpixelsize,
@@ -1243,7 +1460,8 @@ def main():
                                           img_emb_unit,
                                           label_image=None,
                                           seg_file_names1=None,
-                                          int_file_name=int_name)
+                                          int_file_name=int_name,
+                                          tile_size=tileSize)
             os.chdir(outDir)
             if csvfile == 'separatecsv':
                 logger.info('Saving dataframe to csv for ' + intfile[0]['file'].name)
@@ -1254,7 +1472,7 @@ def main():
     elif segDir:   
         #Run analysis for each labeled image in the list
         for img_file in itertools.zip_longest(files_seg,files_int):
-            label_image,img_emb_unit = read(img_file[0][0]['file'])
+            label_image,img_emb_unit = read(img_file[0][0]['file'], tileSize)
             df = None
             files=''
             channel=''
@@ -1271,7 +1489,7 @@ def main():
                        if df==None:
                            continue
                     else:
-                        intensity_image,img_emb_unit = read(files[0]['file'])
+                        intensity_image,img_emb_unit = read(files[0]['file'], tileSize)
                         int_filename = files[0]['file'].name
                         
                     #Check length of files to mention channels in output only when there is more than one channel
@@ -1291,7 +1509,8 @@ def main():
                                           img_emb_unit,
                                           label_image,
                                           img_file[0][0]['file'],
-                                          int_filename)
+                                          int_filename,
+                                          tileSize)
                         if df is None:
                             df = dfc
                         else:
@@ -1304,7 +1523,7 @@ def main():
                     if len(files_seg) != len(files_int) :
                         raise ValueError("Number of labeled/segmented images is not equal to number of intensity images")
                     #Read intensity image
-                    intensity_image,img_emb_unit = read(img_file[1][0]['file'])
+                    intensity_image,img_emb_unit = read(img_file[1][0]['file'], tileSize)
                     int_file = img_file[1][0]['file'].name
                     channel=None
                 
@@ -1324,7 +1543,8 @@ def main():
                                           img_emb_unit,
                                           label_image,
                                           seg_file_names1=img_file[0][0]['file'],
-                                          int_file_name=int_filename
+                                          int_file_name=int_filename,
+                                          tile_size=tileSize
                                           )
             #Save each csv file separately
             os.chdir(outDir)
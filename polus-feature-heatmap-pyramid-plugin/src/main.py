@@ -1,9 +1,10 @@
 from bfio import BioWriter, BioReader
 import bioformats
 import javabridge as jutil
-import argparse, logging, time, os, re, math
+import argparse, logging, time, os, re
 from filepattern import FilePattern
 import numpy as np
+import pandas
 from pathlib import Path
 
 STITCH_VARS = ['file','correlation','posX','posY','gridX','gridY'] # image stitching values
@@ -15,130 +16,158 @@ logging.basicConfig(format='%(asctime)s - %(name)-8s - %(levelname)-8s - %(messa
 logger = logging.getLogger("main")
 logger.setLevel(logging.INFO)
 
-def mean(data_list):
-    """ Fast mean
+def _group_sum(values,groups,counts):
+    """ Sum of the values in each group
+
+    Inputs:
+        values - a 1D array of floats
+        groups - the group index of each value
+        counts - the number of values in each group
+    Outputs:
+        val - The sum of values in each group
+    """
+    
+    return np.bincount(groups,weights=values,minlength=len(counts))
+
+def mean(values,groups,counts):
+    """ Mean of the data in each group
     
-    Calculates the artithmetic mean. This is faster than the method of the same name
-    in the statistics package (1.5-10x speed improvement based on list size).
+    All methods in METHODS take the same inputs, where the values of every
+    group are stored in one array that is sorted by group and then by value.
+    Groups without values have a value of NaN.
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The arithmetic mean of data_list
+        val - The arithmetic mean of each group
     """
     
-    return sum(data_list)/len(data_list)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return _group_sum(values,groups,counts)/counts
 
-def count(data_list):
+def count(values,groups,counts):
     """ Count number of objects
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The number of objects in an image
+        val - The number of objects in each image
     """
     
-    return len(data_list)
+    return counts.astype(np.float64)
 
-def var(data_list):
+def var(values,groups,counts):
     """ Variance of the data
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The variance of the data
+        val - The variance of each group
     """
-    mean_sqr = mean(data_list)**2
-    sqr_mean = mean([d**2 for d in data_list])
-    return sqr_mean - mean_sqr
+    
+    deviation = values - mean(values,groups,counts)[groups]
+    return mean(deviation**2,groups,counts)
 
-def median(data_list):
+def median(values,groups,counts):
     """ Median of the data
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The median of the data
+        val - The median of each group
     """
     
-    num_obj = count(data_list)
-    data_list.sort()
-    val = (data_list[(num_obj-1)//2] + data_list[num_obj//2]) / 2
+    starts = np.cumsum(counts) - counts
+    val = np.full(len(counts),np.nan)
+    valid = counts > 0
+    starts, n = starts[valid], counts[valid]
+    val[valid] = (values[starts + (n-1)//2] + values[starts + n//2]) / 2
     return val
     
-def std(data_list):
+def std(values,groups,counts):
     """ Standard deviation of the data
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The standard deviation of the data
+        val - The standard deviation of each group
     """
     
-    return math.sqrt(var(data_list))
+    return np.sqrt(var(values,groups,counts))
+
+def _moment(values,groups,counts,order):
+    """ Standardized moment of the data, NaN if the standard deviation is 0 """
+    
+    sigma = std(values,groups,counts)
+    deviation = values - mean(values,groups,counts)[groups]
+    
+    with np.errstate(divide='ignore',invalid='ignore'):
+        moment = _group_sum(deviation**order,groups,counts)/(counts*sigma**order)
+    moment[sigma == 0] = np.nan
+    
+    return moment
     
-def skewness(data_list):
+def skewness(values,groups,counts):
     """ Skewness of the data
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The skewness of the data
+        val - The skewness of each group
     """
     
-    sigma = std(data_list)
-    mu = mean(data_list)
-    n = count(data_list)
+    return _moment(values,groups,counts,3)
     
-    if n == 0 or sigma == 0:
-        return 'NaN'
-    
-    skew = sum([(x-mu)**3 for x in data_list])/(n*sigma**3)
-    
-    return skew
-    
-def kurtosis(data_list):
+def kurtosis(values,groups,counts):
     """ Kurtosis of the data
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The kurtosis of the data
+        val - The kurtosis of each group
     """
     
-    sigma = std(data_list)
-    mu = mean(data_list)
-    n = count(data_list)
-    
-    if n == 0 or sigma == 0:
-        return 'NaN'
-    
-    kurt = sum([(x-mu)**4 for x in data_list])/(n*sigma**4) - 3
-    
-    return kurt
+    return _moment(values,groups,counts,4) - 3
 
-def iqr(data_list):
+def iqr(values,groups,counts):
     """ Interquartile range of the data
+    
+    The quartiles are the medians of the lower and upper halves of the data,
+    excluding the median when there are an odd number of values.
 
     Inputs:
-        data_list - a list of floats
+        values - a 1D array of floats, sorted by group and then value
+        groups - the group index of each value
+        counts - the number of values in each group
     Outputs:
-        val - The interquartile range of the data
+        val - The interquartile range of each group
     """
     
-    n = count(data_list)
+    starts = np.cumsum(counts) - counts
+    val = np.full(len(counts),np.nan)
+    valid = counts > 1
+    starts, n = starts[valid], counts[valid]
     cnt = n//2
-    
-    if cnt ==0:
-        return 'NaN'
-    
-    data_list.sort()
-    l_half = data_list[:cnt]
-    u_half = data_list[-cnt:]
-    q1 = (l_half[(len(l_half)-1)//2] + l_half[len(l_half)//2]) / 2
-    q3 = (u_half[(len(u_half)-1)//2] + u_half[len(u_half)//2]) / 2
-    iqr = q3-q1
-    return iqr
+    l_start = starts
+    u_start = starts + n - cnt
+    q1 = (values[l_start + (cnt-1)//2] + values[l_start + cnt//2]) / 2
+    q3 = (values[u_start + (cnt-1)//2] + values[u_start + cnt//2]) / 2
+    val[valid] = q3 - q1
+    return val
 
 METHODS = {'mean': mean,
            'count': count,
@@ -169,30 +198,29 @@ def get_number(s):
     except ValueError:
         return False
 
-def _get_file_dict(fp,fname):
-    """ Find an image matching fname in the collection
+def _get_file_index(fp):
+    """ Index the images in the collection by file name
     
-    This function searches files in a FilePattern object to find the image dictionary
-    that matches the file name, fname.
+    This function maps the name of every file in a FilePattern object to its
+    image dictionary, so that images can be found by name without searching
+    the collection. If more than one file has the same name, the first one is
+    used.
 
     Inputs:
         fp - A FilePattern object
-        fname - The name of the file to find in fp
     Outputs:
-        current_image - The image dictionary matching fname, None if no matches found
+        file_index - Dictionary mapping file names to image dictionaries
     """
-    current_image = None
+    file_index = {}
     for f in fp.iterate():
-        if Path(f['file']).name == fname:
-            current_image = f
-            break
+        file_index.setdefault(Path(f['file']).name,f)
     
-    return current_image
+    return file_index
 
-def _parse_stitch(stitchPath,fp):
+def _parse_stitch(stitchPath,file_index):
     """ Load and parse image stitching vectors
     
-    This function adds keys to the FilePattern object (fp) that indicate image positions
+    This function adds keys to the image dictionaries in file_index that indicate image positions
     extracted from the stitching vectors found at the stitchPath location.
 
     As the stitching vector is parsed, images in the stitching vector are analyzed to
@@ -201,8 +229,8 @@ def _parse_stitch(stitchPath,fp):
     the images in the original pyramid.
 
     Inputs:
-        fp - A FilePattern object
         stitchPath - A path to stitching vectors
+        file_index - Dictionary mapping file names to image dictionaries
     Outputs:
         unique_width - List of all unique widths (in pixels) in the image stitching vectors
         unique_height - List of all unique heights (in pixels) in the image stitching vectors
@@ -233,7 +261,7 @@ def _parse_stitch(stitchPath,fp):
                 stitch_groups = {key:val for key,val in zip(STITCH_VARS,stitch_groups.groups())}
 
                 # Get the image dictionary associated with the current line
-                current_image = _get_file_dict(fp,stitch_groups['file'])
+                current_image = file_index.get(stitch_groups['file'])
                 
                 # If an image in the vector doesn't match an image in the collection, then skip it
                 if current_image == None:
@@ -258,21 +286,25 @@ def _parse_stitch(stitchPath,fp):
 
     return unique_width,unique_height
 
-def _parse_features(featurePath,fp,method):
+def _parse_features(featurePath,file_index,method):
     """ Load and parse the feature list
     
-    This function adds mean feature values to the FilePattern object (fp) for every image
-    in the FilePattern object if the image is listed in the feature csv file.
+    This function adds feature values to the image dictionaries in file_index for every image
+    that is in a stitching vector and is listed in the feature csv file.
 
     For example, if there are 100 object values in an "area" column for one image, then
     an "area" key is created in the image dictionary with the mean value of all 100 values.
+    
+    Each csv is loaded by column, and rows are grouped by file name. The values
+    of every image are then aggregated at once by the method in METHODS.
+    Values that are not finite numbers are ignored.
 
     Inputs:
-        fp - A FilePattern object
-        stitchPath - A path to stitching vectors
+        featurePath - A path to feature csv files
+        file_index - Dictionary mapping file names to image dictionaries
+        method - Name of the method in METHODS used to aggregate values
     Outputs:
-        unique_width - List of all unique widths (in pixels) in the image stitching vectors
-        unique_height - List of all unique heights (in pixels) in the image stitching vectors
+        feature_list - Dictionary of the aggregated values of every feature
     """
     # Get the csv files containing features
     csv_files = [f.name for f in Path(featurePath).iterdir() if f.is_file() and f.suffix=='.csv']
@@ -281,68 +313,41 @@ def _parse_features(featurePath,fp,method):
     feature_list = {}
     
     # Open each csv files
+    fnum = 0
     for feat_file in csv_files:
         fpath = os.path.join(featurePath,feat_file)
-        with open(fpath,'r') as fr:
-            # Read the first line, which should contain headers
-            first_line = fr.readline()
-            headers = first_line.rstrip('\n').split(',')
-            var_ind = {key:val for key,val in enumerate(headers)} # map headers to line positions
-
-            # Add unique features to the feature_list
-            feature_list.update({key:[] for key in headers if key not in feature_list.keys() and key != 'file'})
-
-            # Get the first line of data
-            line = fr.readline()
-
-            # Read each line in the stitching vector
-            fnum = 0
-            fcheck = 0
-            while line:
-                # Parse the current line as a dictionary
-                p_line = {var_ind[ind]:val for ind,val in enumerate(line.rstrip('\n').split(','))}
-                for key,val in p_line.items():
-                    v = get_number(val)
-                    if isinstance(v,float):
-                        p_line[key] = [v]
-                    elif key != 'file':
-                        p_line[key] = []
-
-                # Get the image associated with the current line
-                current_image = _get_file_dict(fp,p_line['file'])
-
-                if current_image == None or 'line' not in current_image.keys():
-                    line = fr.readline()
-                    continue
-
-                # Loop through rows until the filename changes
-                line = fr.readline()
-                np_line = {var_ind[ind]:val for ind,val in enumerate(line.rstrip('\n').split(','))}
-                while line and p_line['file'] == np_line['file']:
-                    # Store the values in a feature list
-                    for key,val in np_line.items():
-                        v = get_number(val)
-                        if isinstance(v,float):
-                            p_line[key].append(float(val))
-
-                    # Get the next line
-                    line = fr.readline()
-                    np_line = {var_ind[ind]:val for ind,val in enumerate(line.rstrip('\n').split(','))}
-
-                # Get the mean of the feature list, save in the file dictionary
-                for key,val in p_line.items():
-                    if isinstance(val,list):
-                        try:
-                            current_image[key] = METHODS[method](val)
-                            feature_list[key].append(current_image[key])
-                        except ZeroDivisionError:
-                            current_image[key] = 'NaN'
-                
-                # Checkpoint
-                fnum += 1
-                if fnum//1000 > fcheck:
-                    fcheck += 1
-                    logger.info('Files parsed: {}'.format(fnum))
+        data = pandas.read_csv(fpath,dtype={'file': str})
+
+        # Add unique features to the feature_list
+        feature_list.update({key:[] for key in data.columns if key not in feature_list.keys() and key != 'file'})
+
+        # Group rows by file, skipping images that are not in a stitching vector
+        codes, files = pandas.factorize(data['file'])
+        images = [file_index.get(f) for f in files]
+        keep = np.asarray([image is not None and 'line' in image.keys() for image in images],dtype=bool)
+        rows = (codes >= 0) & keep[codes]
+        groups = (np.cumsum(keep) - 1)[codes[rows]]
+        images = [image for image,k in zip(images,keep) if k]
+
+        for key in data.columns:
+            if key == 'file':
+                continue
+            
+            # Get the finite values of the feature, sorted by image and value
+            values = pandas.to_numeric(data[key],errors='coerce').to_numpy(dtype=np.float64)[rows]
+            valid = np.isfinite(values)
+            values, vgroups = values[valid], groups[valid]
+            order = np.lexsort((values,vgroups))
+            values, vgroups = values[order], vgroups[order]
+            counts = np.bincount(vgroups,minlength=len(images))
+            
+            # Aggregate the feature list, save in the file dictionary
+            for image,val in zip(images,METHODS[method](values,vgroups,counts)):
+                image[key] = 'NaN' if np.isnan(val) else float(val)
+                feature_list[key].append(image[key])
+        
+        fnum += len(images)
+        logger.info('Files parsed: {}'.format(fnum))
 
     return feature_list
 
@@ -392,14 +397,15 @@ if __name__=="__main__":
 
     # Set up the fileparser
     fp = FilePattern(inpDir,'.*.ome.tif')
+    file_index = _get_file_index(fp)
 
     # Parse the stitching vector
     logger.info('Parsing stitching vectors...')
-    widths, heights = _parse_stitch(vector,fp)
+    widths, heights = _parse_stitch(vector,file_index)
 
     # Parse the features
     logger.info('Parsing features...')
-    feature_list = _parse_features(features,fp,method)
+    feature_list = _parse_features(features,file_index,method)
 
     # Determine the min, max, and unique values for each data set
     logger.info('Setting feature scales...')
@@ -453,15 +459,17 @@ if __name__=="__main__":
     # Build the output stitching vector
     logger.info('Generating the heatmap...')
     file_name = '{}_{}_{}.ome.tif'
+    line_index = {}
+    for f in fp.iterate():
+        if 'line' in f:
+            line_index.setdefault(f['line'],f)
     for num,feat in enumerate(feature_list):
         fpath = str(Path(outVectors).joinpath('img-global-positions-' + str(num+1) + '.txt').absolute())
         with open(fpath,'w') as fw:
             line = 0
             while True:
-                for f in fp.iterate():
-                    if 'line' in f and f['line'] == line:
-                        break
-                if 'line' in f and f['line'] == line:
+                if line in line_index:
+                    f = line_index[line]
                     fw.write("file: {}; corr: {}; position: ({}, {}); grid: ({}, {});\n".format(file_name.format(f['width'],f['height'],f[feat]),
                                                                                                 f['correlation'],
                                                                                                 f['posX'],
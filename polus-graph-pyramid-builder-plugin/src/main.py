@@ -1,6 +1,5 @@
 import pandas, multiprocessing, argparse, logging, matplotlib, copy, imageio
 from pathlib import Path
-from multiprocessing import Pool
 
 from matplotlib.colors import ListedColormap
 import matplotlib.pyplot as plt
@@ -16,6 +15,22 @@ from textwrap import wrap
 # Chunk Scale
 CHUNK_SIZE = 1024
 
+# Value of missing data after quantization, must be larger than bincount
+NAN_BIN = 255
+
+# Maximum number of rows loaded, quantized, and binned at a time
+ROW_CHUNK = 2**20
+
+# Maximum number of values in each chunk of rows
+CHUNK_VALUES = 2**25
+
+# Arrays shared with the processes that bin data
+_shared = {}
+
+# Pre-rendered parts of graphs and label sprites, rendered once per process
+_frame = {}
+_sprites = {}
+
 # DZI file template
 DZI = '<?xml version="1.0" encoding="utf-8"?><Image TileSize="' + str(CHUNK_SIZE) + '" Overlap="0" Format="png" xmlns="http://schemas.microsoft.com/deepzoom/2008"><Size Width="{}" Height="{}"/></Image>'
 
@@ -33,18 +48,18 @@ def is_number(value):
     except:
         return False
 
-def load_csv(fpath):
-    """ Load a csv and select data
+def get_columns(fpath):
+    """ Find the columns of a csv to build graphs for
     
-    Data is loaded from a csv, and data columns containing numeric values are 
-    returned in a pandas Dataframe. The second row of the csv may contain
-    column classifiers, so the second row is first loaded and checked to
-    determine if the classifiers are present.
+    Only the first data row of the csv is loaded. The second row of the csv may
+    contain column classifiers, so it is checked to determine if the
+    classifiers are present, and columns containing numeric values are
+    selected.
     Inputs:
         fpath - Path to csv file
     Outputs:
-        data - A pandas Dataframe
-        cnames - Names of columns
+        cnames - Names and indices of columns
+        is_coded - True if the second row of the csv contains classifiers
     """
 
     # Check if the first row is column coding, and if it is then find valid columns
@@ -63,38 +78,141 @@ def load_csv(fpath):
         else:
             logging.info('Skipping column {} for reason: one hot encodings'.format(fname))
     
-    # Load the data
-    if is_coded:
-        data = pandas.read_csv(fpath,skiprows=[1],usecols=[c[0] for c in cnames])
+    return cnames, is_coded
 
-    else:
-        data = pandas.read_csv(fpath,usecols=[c[0] for c in cnames])
+def _chunk_rows(nfeats):
+    """ Number of rows loaded at a time, keeping chunks under CHUNK_VALUES values """
+    return max(1, min(ROW_CHUNK, CHUNK_VALUES//max(nfeats,1)))
+
+def load_csv(fpath, cnames, is_coded):
+    """ Load a csv in chunks of rows
+    
+    Only the selected columns are loaded, and the rows are loaded lazily so
+    that the whole csv is never held in memory.
+    Inputs:
+        fpath - Path to csv file
+        cnames - Names and indices of columns to load
+        is_coded - True if the second row of the csv contains classifiers
+    Outputs:
+        chunks - Iterator of pandas Dataframes
+    """
+
+    skiprows = [1] if is_coded else None
+    
+    return pandas.read_csv(fpath,
+                           skiprows=skiprows,
+                           usecols=[c[0] for c in cnames],
+                           chunksize=_chunk_rows(len(cnames)))
+
+def log_transform(values):
+    """ Logarithmically scale data, adjusting for behavior near zero
+    
+    https://iopscience.iop.org/article/10.1088/0957-0233/24/2/027001
+    """
+    C = 1/np.log(10)# Derivative of Natural Log e, d(ln(x))/dx = 1/x
+    return np.sign(values) * np.log10(1 + (abs(values/C)))
 
-    return data, cnames
+def get_bin_stats(fpath, cnames, is_coded, scales):
+    """ Get the bin sizes of each column
+    
+    This is the first pass over the csv. The minimum and maximum of every
+    column are found one chunk of rows at a time, for the linear and
+    logarithmically transformed data. Each column is divided into bincount
+    bins, and each bin is 1/bincount the size of the difference between the
+    maximum and minimum of the column.
+    Inputs:
+        fpath - Path to csv file
+        cnames - Names and indices of columns
+        is_coded - True if the second row of the csv contains classifiers
+        scales - List of scales to get stats for ('linear' and/or 'log')
+    Outputs:
+        nrows - Number of rows in the csv
+        bin_stats - Dictionary of stats for each scale, with the minimum,
+                    maximum, and bin width of each column
+    """
 
-def bin_data(data, bin_stats):
+    column_names = [c[0] for c in cnames]
+    
+    nrows = 0
+    fmin = {scale: np.full(len(cnames),np.nan) for scale in scales}
+    fmax = {scale: np.full(len(cnames),np.nan) for scale in scales}
+    for chunk in load_csv(fpath,cnames,is_coded):
+        values = chunk[column_names].to_numpy(dtype=np.float64,copy=True)
+        nrows += values.shape[0]
+        for scale in scales:
+            if scale == 'log':
+                scaled = log_transform(values)
+            else:
+                scaled = values
+            fmin[scale] = np.fmin(fmin[scale],np.fmin.reduce(scaled,axis=0))
+            fmax[scale] = np.fmax(fmax[scale],np.fmax.reduce(scaled,axis=0))
+    
+    bin_stats = {}
+    for scale in scales:
+        smin = pandas.Series(fmin[scale],index=column_names)
+        smax = pandas.Series(fmax[scale],index=column_names)
+        bin_stats[scale] = {'min': smin,
+                            'max': smax,
+                            'binwidth': (smax-smin+10**-6)/bincount}
+    
+    return nrows, bin_stats
+
+def _offset(feat1, nfeats):
+    """ Index of the first graph of feat1 (the graph of feat1 and feat1+1) """
+    return feat1*nfeats - (feat1*(feat1 + 1))//2
+
+def _bin_feature(feat1, nrows):
+    """ Add the row chunk in shared memory to the histograms of one feature
+    
+    This function is run in worker processes, and updates the histograms of
+    feat1 plotted against every feature after it. Since every graph belongs to
+    exactly one feat1, workers never update the same histogram.
+    
+    Each histogram is counted with np.bincount on the linear bin index
+    (feat1 * bincount + feat2), which fits in uint16 for up to 255 bins. Rows
+    missing either value are moved past the last bin and dropped.
+    Inputs:
+        feat1 - index of the feature on the histogram rows
+        nrows - number of rows in the chunk
+    """
+    
+    data = _shared['data'][:,:nrows]
+    bins = _shared['bins']
+    nfeats = data.shape[0]
+    nbins = bincount**2
+    
+    feat1_bins = data[feat1]
+    rows = feat1_bins.astype(np.uint16) * bincount
+    rows[feat1_bins == NAN_BIN] = nbins
+    
+    graph = _offset(feat1,nfeats)
+    for feat2 in range(feat1 + 1, nfeats):
+        index = rows + data[feat2]
+        if _shared['missing'][feat2]:
+            index[data[feat2] == NAN_BIN] = nbins
+        counts = np.bincount(index,minlength=nbins)[:nbins]
+        bins[graph] += counts.reshape(bincount,bincount).astype(bins.dtype)
+        graph += 1
+
+def bin_data(chunks, nfeats, nrows):
     """ This function bins the data 
+    
+    Histograms for all pairs of features are counted in one pass over the rows
+    of data. Rows are quantized to uint8 bin positions one chunk at a time, and
+    each chunk is placed in shared memory and counted with np.bincount by a
+    pool of processes, where each process handles all graphs for one feature at
+    a time. The histograms are also in shared memory, so they are never copied
+    between processes.
     Inputs:
-        data - pandas dataframe of data
-        bin_stats - stats of the data 
+        chunks - iterable of bin positions, each with shape (nfeats, rows)
+        nfeats - number of features
+        nrows - total number of rows in all chunks
     Outputs:
         bins - binned data ranging from (0, bincount)
         graph_index - Numeric value of column index from original csv
         graph_dict - a dictionary containing the indexes of graphs
     """
 
-    column_names = data.columns
-    nfeats = data.shape[1] 
-    nrows = data.shape[0]
-
-    # Handle NaN values
-    data_ind = pandas.notnull(data)
-    data[~data_ind] = 255
-    
-    data = data.astype(np.uint16)       # cast to save memory
-    data[data>=bincount] = bincount - 1 # in case of numerical precision issues
-
-    
     if nrows < 2**8:
         dtype = np.uint8
     elif nrows < 2**16:
@@ -105,85 +223,91 @@ def bin_data(data, bin_stats):
         dtype = np.uint64
         
     totalgraphs = int((nfeats**2 - nfeats)/2)
-    bins = np.zeros((totalgraphs, bincount, bincount), dtype=dtype)
-    graph_index = []
-    graph_dict = {}
-
-    # Create a linear index for feature bins
-    i = 0
-    for feat1 in range(nfeats):
-        name1 = column_names[feat1]
-        feat1_tf = data[name1] * bincount
-        
-        for feat2 in range(feat1 + 1, nfeats):
-            graph_dict[(feat1, feat2)] = i
-            name2 = column_names[feat2]
-            
-            feat2_tf = data[name2]
-            feat2_tf = feat2_tf[data_ind[name1] & data_ind[name2]]
-                      
-            if feat2_tf.size<=1:
-                continue
-            
-            # sort linear matrix indices
-            SortedFeats = np.sort(feat1_tf[data_ind[name1] & data_ind[name2]] + feat2_tf)
+    
+    # Allocate the row chunk and histograms in shared memory before the worker
+    # processes are forked
+    chunk_size = max(1, min(nrows, _chunk_rows(nfeats)))
+    chunk = multiprocessing.RawArray('B', nfeats*chunk_size)
+    _shared['data'] = np.frombuffer(chunk, dtype=np.uint8).reshape(nfeats,chunk_size)
+    missing = multiprocessing.RawArray('B', nfeats)
+    _shared['missing'] = np.frombuffer(missing, dtype=np.uint8)
+    hist = multiprocessing.RawArray('B', totalgraphs*bincount*bincount*np.dtype(dtype).itemsize)
+    _shared['bins'] = np.frombuffer(hist, dtype=dtype).reshape(totalgraphs,bincount,bincount)
+    
+    # Features with the most graphs are counted first to balance the work
+    features = list(range(nfeats - 1))
+    
+    with multiprocessing.get_context('fork').Pool(multiprocessing.cpu_count()) as pool:
+        for values in chunks:
             
-            # Do math to get the indices
-            ind2 = np.nonzero(np.diff(SortedFeats))[0]                              # nonzeros are cumulative sum of all bin values
-            ind2 = np.append(ind2,SortedFeats.size-1)
-            rows = (SortedFeats[ind2]/bincount).astype(np.uint8)    # calculate row from linear index
-            cols = np.mod(SortedFeats[ind2],bincount)               # calculate column from linear index
-            counts = np.diff(ind2)                                  # calculate the number of values in each bin
+            # Quantize the chunk, missing values are set to NAN_BIN
+            missing = np.isnan(values)
+            values[missing] = 0
+            values = np.clip(values,0,bincount - 1) # in case of numerical precision issues
+            values = values.astype(np.uint8)
+            values[missing] = NAN_BIN
             
-            bins[i,rows[0],cols[0]] = ind2[0] + 1 
-            bins[i,rows[1:],cols[1:]] = counts 
-            graph_index.append([feat1,feat2])
-            i = i + 1
+            _shared['data'][:,:values.shape[1]] = values
+            _shared['missing'][:] = missing.any(axis=1)
+            pool.starmap(_bin_feature, [(feat1, values.shape[1]) for feat1 in features], chunksize=1)
+    
+    bins = _shared.pop('bins')
+    del _shared['data'], _shared['missing']
+    
+    # Skip graphs with less than two values
+    keep = bins.reshape(totalgraphs,-1).sum(axis=1) > 1
+    pairs = [(feat1, feat2) for feat1 in range(nfeats) for feat2 in range(feat1 + 1, nfeats)]
+    graph_index = [list(pair) for pair, k in zip(pairs, keep) if k]
+    graph_dict = {tuple(pair): i for i, pair in enumerate(graph_index)}
+    if not keep.all():
+        bins = bins[keep]
 
     return bins, graph_index, graph_dict
 
-def transform_data(data,column_names, typegraph):
+def transform_data(fpath, cnames, is_coded, nrows, bin_stats, typegraph):
     """ Bin the data
     
-    Data from a pandas Dataframe is binned in two dimensions. Binning is performed by
+    Data from a csv is binned in two dimensions. Binning is performed by
     binning data in one column along one axis and another column is binned along the
     other axis. All combinations of columns are binned without repeats or transposition.
-    There are only bincount number of bins in each dimension, and each bin is 1/bincount the size of the
-    difference between the maximum and minimum of each column. 
+    
+    This is the second pass over the csv. Each chunk of rows is transformed
+    into bin positions using the stats from the first pass (get_bin_stats),
+    and added to the histograms, so the whole csv is never held in memory.
     If the data needs to be logarithmically scaled, then the data is transformed by the algorithm presented
     in this paper: https://iopscience.iop.org/article/10.1088/0957-0233/24/2/027001
     Inputs:
-        data - A pandas Dataframe, with nfeats number of columns
-        column_names - Names of Dataframe columns
+        fpath - Path to csv file
+        cnames - Names and indices of columns
+        is_coded - True if the second row of the csv contains classifiers
+        nrows - Number of rows in the csv
+        bin_stats - Stats of each column for the scale, from get_bin_stats
         typegraph - Defines whether logarithmic scale or linear scalef
     Outputs:
         bins - A numpy matrix that has shape (int((nfeats**2 - nfeats)/2),bincount,bincount)
-        bin_feats - A list containing the minimum and maximum values of each column
         index - Numeric value of column index from original csv
         diction - a dictionary containing the indexes of graphs
     """
 
-    nfeats = len(column_names)
-
-    # If logarithmic, need to transform the data
-    # https://iopscience.iop.org/article/10.1088/0957-0233/24/2/027001
-    # Adjusts for behavior near zero
-
-    if typegraph == "log":
-        C = 1/np.log(10)# Derivative of Natural Log e, d(ln(x))/dx = 1/x
-        data = data.astype(np.float64)
-        data = np.sign(data) * np.log10(1 + (abs(data/C)))
-
-    bin_stats = {'min': data.min(),
-                 'max': data.max(),
-                 'binwidth': (data.max()-data.min()+10**-6)/bincount}    
- 
+    column_names = [c[0] for c in cnames]
+    fmin = bin_stats['min'][column_names].to_numpy()
+    binwidth = bin_stats['binwidth'][column_names].to_numpy()
     
-    # Transform data into bin positions for fast binning
-    data = ((data - bin_stats['min'])/bin_stats['binwidth']).apply(np.floor)
+    def quantize():
+        for chunk in load_csv(fpath,cnames,is_coded):
+            values = chunk[column_names].to_numpy(dtype=np.float64,copy=True)
+            
+            # If logarithmic, need to transform the data
+            if typegraph == "log":
+                values = log_transform(values)
+            
+            # Transform data into bin positions for fast binning
+            values -= fmin
+            values /= binwidth
+            yield np.floor(values,out=values).T
 
-    bins, index, diction = bin_data(data, bin_stats)
-    return bins, bin_stats, index, diction
+    bins, index, diction = bin_data(quantize(), len(column_names), nrows)
+    return bins, index, diction
 
 """ 2. Plot Generation """
 def format_ticks(out):
@@ -282,6 +406,157 @@ def get_cmap():
 
     return cmap
 
+def _tick_values(ticks, bin_width, fmin, typegraph):
+    """ This function calculates the tick values for the graphs """
+
+    if typegraph == "linear":
+        tick_vals = [t for t in ticks*bin_width+fmin]
+    if typegraph == "log": 
+        C = 1/np.log(10)
+        tick_vals = [np.sign(t)*C*(-1+(10**abs(t))) for t in ticks*bin_width+fmin]
+    return tick_vals
+
+def _fit_text(fig, text, width, height, sizefont=12):
+    """ This function decreases the size of a label until it fits in width x height """
+    
+    text.set_fontsize(sizefont)
+    bbx = text.get_window_extent(renderer = fig.canvas.renderer)
+    decreasefont = sizefont - 1
+    while (bbx.x0 < 0 or bbx.x1 > width) or (bbx.y0 < 0 or bbx.y1 > height):
+        text.set_fontsize(decreasefont)
+        bbx = text.get_window_extent(renderer = fig.canvas.renderer)
+        decreasefont = decreasefont - 1
+
+def _draw(fig):
+    """ Draw a figure and return the pixels """
+    
+    fig.canvas.draw()
+    return np.array(fig.canvas.renderer.buffer_rgba())
+
+def get_frame(fig, ax, data):
+    """ Render the parts of a graph that are the same for every graph
+    
+    The default figure is drawn without the heatmap, tick labels, and axis
+    labels, and the layout of the figure is fixed so that every graph places
+    the heatmap and labels at the same pixels. The pixel to bin mapping of the
+    heatmap and the colormap lookup table are also calculated here.
+    
+    After the frame is drawn, the figure only draws text so it can be used to
+    render label sprites (see get_label_sprite).
+    Inputs:
+        fig - pregenerated figure
+        ax - pregenerated axis
+        data - pregenerated heatmap artist
+    Outputs:
+        frame - A dictionary containing the frame pixels, the heatmap bounding
+                box and pixel to bin indices, the pixels of the axis lines inside
+                the heatmap, and the colormap lookup table
+    """
+    
+    # Fix the layout using tick labels as wide as formatted tick values
+    ticks = ax.get_xticks()
+    ax.set_xticklabels(['-8.88k']*len(ticks), rotation=45, fontsize=5, ha='right')
+    ax.set_yticklabels(['-8.88k']*len(ticks), fontsize=5, ha='right')
+    _draw(fig)
+    fig.set_tight_layout(False)
+    
+    data.set_visible(False)
+    ax.set_xticklabels([])
+    ax.set_yticklabels([])
+    image = _draw(fig)
+    
+    # Bounding box of the heatmap in pixels, where the pixel origin is top left
+    bbox = ax.get_window_extent()
+    y0 = int(round(image.shape[0] - bbox.y1))
+    y1 = int(round(image.shape[0] - bbox.y0))
+    x0 = int(round(bbox.x0))
+    x1 = int(round(bbox.x1))
+    
+    # Bin displayed by each pixel, heatmap rows increase from bottom to top
+    rows = bincount - 1 - ((np.arange(y1-y0) + 0.5) * bincount / (y1-y0)).astype(int)
+    cols = ((np.arange(x1-x0) + 0.5) * bincount / (x1-x0)).astype(int)
+    
+    # Axis lines drawn on top of the heatmap
+    spines = np.nonzero((image[y0:y1,x0:x1,:3] != 255).any(axis=2))
+    
+    frame = {
+        'image': image,
+        'box': (y0,y1,x0,x1),
+        'rows': rows,
+        'cols': cols,
+        'spines': spines,
+        'lut': data.get_cmap()(np.arange(256)/255, bytes=True),
+        'line_color': (np.asarray(matplotlib.colors.to_rgba('C0'))*255).astype(np.uint8),
+        'line_width': matplotlib.rcParams['lines.linewidth'] * fig.dpi / 72
+    }
+    
+    # Only draw text from now on
+    fig.patch.set_visible(False)
+    ax.patch.set_visible(False)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.tick_params(length=0)
+    
+    return frame
+
+def get_label_sprite(col, axis, column_names, bin_stats, typegraph, fig, ax):
+    """ Render the tick labels and axis label of a column
+    
+    The labels of a column are the same in every graph the column appears in,
+    so they are drawn once using matplotlib and cached. Labels are black, so
+    only the alpha channel is kept, cropped to the pixels that were drawn.
+    Inputs:
+        col - index of the column
+        axis - 'x' or 'y', the axis the column is plotted on
+        column_names - list of column names
+        bin_stats - a list containing the min,max values of each column
+        typegraph - specifies whether the data is log scaled or linearly scaled
+        fig - figure drawn by get_frame
+        ax - axis of the figure drawn by get_frame
+    Outputs:
+        sprite - A tuple containing the alpha of the labels and the row and
+                 column of the top left pixel of the sprite in the graph
+    """
+    
+    cname = column_names[col]
+    fmin = bin_stats['min'][cname]
+    binwidth = bin_stats['binwidth'][cname]
+    
+    key = (cname, axis, fmin, binwidth, typegraph)
+    if key in _sprites:
+        return _sprites[key]
+    
+    axlabel = fig.axes[1]
+    aylabel = fig.axes[2]
+    for label_ax in [axlabel, aylabel]:
+        while len(label_ax.texts) > 0:
+            label_ax.texts[-1].remove()
+    
+    if axis == 'x':
+        # This is to decrease the size of the title labels if the name is too large (X AXIS LABEL)
+        text = axlabel.text(0.5, 0.5, "\n".join(wrap(cname, 60)), va = 'center', ha = 'center', wrap = True)
+        _fit_text(fig, text, CHUNK_SIZE, CHUNK_SIZE*.075)
+        tick_vals = _tick_values(ax.get_xticks(), binwidth, fmin, typegraph)
+        ax.set_xticklabels(format_ticks(tick_vals), rotation=45, fontsize = 5, ha='right')
+        ax.set_yticklabels([])
+    else:
+        # This is to decrease the size of the title labels if the name is too large (Y AXIS LABEL)
+        text = aylabel.text(0.5, 0.5, "\n".join(wrap(cname, 60)), va = 'center', ha = 'center', rotation = 90, wrap = True)
+        _fit_text(fig, text, CHUNK_SIZE*.075, CHUNK_SIZE)
+        tick_vals = _tick_values(ax.get_yticks(), binwidth, fmin, typegraph)
+        ax.set_yticklabels(format_ticks(tick_vals), fontsize=5, ha='right')
+        ax.set_xticklabels([])
+    
+    alpha = _draw(fig)[...,3]
+    
+    # Crop the sprite to the drawn pixels
+    rows = np.nonzero(alpha.any(axis=1))[0]
+    cols = np.nonzero(alpha.any(axis=0))[0]
+    sprite = (alpha[rows[0]:rows[-1]+1,cols[0]:cols[-1]+1].copy(), rows[0], cols[0])
+    _sprites[key] = sprite
+    
+    return sprite
+
 def gen_plot(col1,
              col2,
              indexdict,
@@ -293,6 +568,12 @@ def gen_plot(col1,
              typegraph):
     """ Generate a heatmap
     Generate a heatmap of data for column 1 against column 2.
+    
+    Graphs are drawn with array operations instead of matplotlib. The heatmap
+    is mapped through the colormap lookup table into a pre-rendered frame (see
+    get_frame), and the label sprites of each column are blended on top (see
+    get_label_sprite). Matplotlib only renders the label sprites, once for
+    each column.
     Inputs:
         col1 - the column plotted on the y-axis
         col2 - column plotted on the x-axis
@@ -301,28 +582,12 @@ def gen_plot(col1,
         bin_stats - a list containing the min,max values of each column
         fig - pregenerated figure
         ax - pregenerated axis
-        data - p  regenerated heatmap bbox artist
+        data - pregenerated heatmap artist
         typegraph - specifies whether the data is log scaled or linearly scaled
     Outputs:
         hmap - A numpy array containing pixels of the heatmap
     """
-    def keepdecreasing(labeltexts0, decreasefont, bbxtext):
-        """ This function decreases the size of the labels if its too big """
-        labeltexts0.set_fontsize(decreasefont)
-        bbxtext = labeltexts0.get_window_extent(renderer = fig.canvas.renderer)
-        decreasefont = decreasefont - 1 
-        return bbxtext, decreasefont
-
-    def calculateticks(ticks, bin_width, fmin, typegraph):
-        """ This functio n calculates the tick values for the graphs """
-
-        if typegraph == "linear":
-            tick_vals = [t for t in ticks*bin_width+fmin]
-        if typegraph == "log": 
-            C = 1/np.log(10)
-            tick_vals = [np.sign(t)*C*(-1+(10**abs(t))) for t in ticks*bin_width+fmin]
-        return tick_vals
-
+    
     if col2>col1:
         d = np.squeeze(bins[indexdict[col1, col2],:,:])
         r = col1
@@ -335,67 +600,41 @@ def gen_plot(col1,
         d = np.zeros((bincount,bincount))
         r = col1
         c = col2
-
-    data.set_data(np.ceil(d/d.max() * 255))
-    data.set_clim(0, 255)
-
-    sizefont = 12 
-    axlabel = fig.axes[1]
-    aylabel = fig.axes[2] 
-
-    cname_c = column_names[c]
-    cname_r = column_names[r]
-
     
-    # This is to decrease the size of the title labels if the name is too large (X AXIS LABEL)
-    if len(axlabel.texts) == 0:
-        axlabel.text(0.5, 0.5, "\n".join(wrap(cname_c, 60)), va = 'center', ha = 'center', fontsize = sizefont, wrap = True)
-    else:
-        axlabeltext0 = axlabel.texts[0]
-        axlabeltext0.set_text("\n".join(wrap(cname_c, 60)))
-        axlabeltext0.set_fontsize(sizefont)
-
-    bbxtext = (axlabel.texts[0]).get_window_extent(renderer = fig.canvas.renderer)
-    decreasefont = sizefont - 1
-    while (bbxtext.x0 < 0 or bbxtext.x1 > CHUNK_SIZE) or (bbxtext.y0 < 0 or bbxtext.y1 > (CHUNK_SIZE*.075)):
-        bbxtext, decreasefont = keepdecreasing(axlabel.texts[0], decreasefont, bbxtext)
-
-    # This is to decrease the size of the title labels if the name is too large (Y AXIS LABEL)
-    if len(aylabel.texts) == 0:
-        aylabel.text(0.5, 0.5, "\n".join(wrap(cname_r, 60)), va = 'center', ha = 'center', fontsize = sizefont, rotation = 90, wrap = True)
-    else:
-        aylabeltext0 = aylabel.texts[0]
-        aylabeltext0.set_text("\n".join(wrap(cname_r, 60)))
-        aylabeltext0.set_fontsize(sizefont)
-
-    bbytext = (aylabel.texts[0]).get_window_extent(renderer = fig.canvas.renderer)
-    decreasefont = sizefont - 1
-    while (bbytext.y0 < 0 or bbytext.y1 > CHUNK_SIZE) or (bbytext.x0 < 0 or bbytext.x1 > (CHUNK_SIZE*.075)):
-        bbytext, decreasefont = keepdecreasing(aylabel.texts[0], decreasefont, bbytext)
-    
-    while len(ax.lines) > 0:
-        ax.lines[-1].remove()
-
-    # Calculating the value of each tick in the graph (fixed width)
-    fmin_c = bin_stats['min'][cname_c]
-    fmax_c = bin_stats['max'][cname_c]
-    binwidth_c = bin_stats['binwidth'][cname_c]
-    tick_vals_c= calculateticks(ax.get_xticks(), binwidth_c, fmin_c, typegraph)
-    if fmin_c < 0: # draw x=0
-        ax.axvline(x=abs(fmin_c)/binwidth_c)
-    ax.set_xticklabels(format_ticks(tick_vals_c), rotation=45, fontsize = 5, ha='right')
-
-    # Calculating the value of each tick in the graph (fixed width)
-    fmin_r = bin_stats['min'][cname_r]
-    fmax_r = bin_stats['max'][cname_r]
-    binwidth_r = bin_stats['binwidth'][cname_r]
-    tick_vals_r = calculateticks(ax.get_yticks(), binwidth_r, fmin_r, typegraph)
-    if fmin_r < 0: # draw y=0
-        ax.axhline(y=abs(fmin_r)/binwidth_r)
-    ax.set_yticklabels(format_ticks(tick_vals_r), fontsize=5, ha='right')
-
-    fig.canvas.draw()
-    hmap = np.array(fig.canvas.renderer.buffer_rgba())
+    # The frame is rendered once in each process
+    if len(_frame) == 0:
+        _frame.update(get_frame(fig, ax, data))
+    
+    hmap = _frame['image'].copy()
+    y0,y1,x0,x1 = _frame['box']
+    
+    # Map the bin counts through the colormap
+    heatmap = _frame['lut'][np.ceil(d/max(d.max(),1) * 255).astype(np.uint8)]
+    heatmap = heatmap.take(_frame['rows'],axis=0).take(_frame['cols'],axis=1)
+    
+    # Draw x=0 and y=0
+    for cname, axis in [(column_names[c], 1), (column_names[r], 0)]:
+        fmin = bin_stats['min'][cname]
+        if fmin >= 0:
+            continue
+        size = heatmap.shape[axis]
+        position = abs(fmin)/bin_stats['binwidth'][cname] * size / bincount
+        if axis == 0:
+            position = size - position
+        start = int(round(position - _frame['line_width']/2))
+        end = int(round(position + _frame['line_width']/2))
+        line = [slice(None), slice(None)]
+        line[axis] = slice(max(start,0),max(end,0))
+        heatmap[tuple(line)] = _frame['line_color']
+    
+    heatmap[_frame['spines']] = hmap[y0:y1,x0:x1][_frame['spines']]
+    hmap[y0:y1,x0:x1] = heatmap
+    
+    # Blend the black labels on top of the graph
+    for col, axis in [(c, 'x'), (r, 'y')]:
+        alpha, row0, col0 = get_label_sprite(col, axis, column_names, bin_stats, typegraph, fig, ax)
+        region = hmap[row0:row0+alpha.shape[0],col0:col0+alpha.shape[1],:3]
+        region[:] = region * (255 - alpha[...,np.newaxis].astype(np.uint16)) // 255
 
     return hmap
 
@@ -520,13 +759,28 @@ def metadata_to_graph_info(outPath,outFile, ngraphs):
     return info
 
 
-def _get_higher_res(S,info,cnames, outpath,out_file,indexscale,indexdict,binstats, typegraph, X=None,Y=None):
+def _parallel_scale(info):
+    """ Find the lowest resolution scale with at least two tiles per processor """
+    
+    num_scales = len(info['scales'])
+    for S in range(num_scales):
+        size = info['scales'][num_scales-S-1]['size']
+        ntiles = np.ceil(size[0]/CHUNK_SIZE) * np.ceil(size[1]/CHUNK_SIZE)
+        if ntiles >= 2*multiprocessing.cpu_count():
+            return S
+    return num_scales - 1
+
+def _get_higher_res(S,info,cnames, outpath,out_file,indexscale,indexdict,binstats, typegraph, X=None,Y=None,pool=None,tiles=None):
     """
     The following function builds the image pyramid at scale S by building up only
     the necessary information at high resolution layers of the pyramid. So, if 0 is
     the original resolution of the image, getting a tile at scale 2 will generate
     only the necessary information at layers 0 and 1 to create the desired tile at
     layer 2. This function is recursive and can be parallelized.
+    
+    If a pool is given, every tile at the lowest resolution scale with at least
+    two tiles per process (and all tiles below them) is built in the pool, and
+    the tiles above them are built from the results as they finish.
     Inputs:
         S - current scale
         info - dictionary of scale information
@@ -535,6 +789,8 @@ def _get_higher_res(S,info,cnames, outpath,out_file,indexscale,indexdict,binstat
         indexscale - index of the graph 
         binstats - stats for the binned data
         typegraph - specifies whether the data is linear or logarithmically scaled
+        pool - multiprocessing Pool used to build tiles
+        tiles - tiles that are being built in the pool
     Outputs:
         DeepZoom format of images.
     """
@@ -556,6 +812,29 @@ def _get_higher_res(S,info,cnames, outpath,out_file,indexscale,indexdict,binstat
     if Y[1] > scale_info['size'][1]:
         Y[1] = scale_info['size'][1]
     
+    # Start building tiles in the pool
+    if pool is not None:
+        P = _parallel_scale(info)
+        size = info['scales'][num_scales-P-1]['size']
+        tiles = {}
+        for y in range(0,int(size[1]),CHUNK_SIZE):
+            for x in range(0,int(size[0]),CHUNK_SIZE):
+                tiles[(P,x,y)] = pool.apply_async(_get_higher_res,(P,
+                                                                   info,
+                                                                   cnames,
+                                                                   outpath,
+                                                                   out_file,
+                                                                   indexscale,
+                                                                   indexdict,
+                                                                   binstats,
+                                                                   typegraph,
+                                                                   [x,x+CHUNK_SIZE],
+                                                                   [y,y+CHUNK_SIZE]))
+    
+    # Get the tile from the pool if it is being built there
+    if tiles is not None and (S,X[0],Y[0]) in tiles:
+        return tiles.pop((S,X[0],Y[0])).get()
+    
     # Initialize the output
     image = np.zeros((int(Y[1]-Y[0]),int(X[1]-X[0]),4),dtype=np.uint8)
     
@@ -589,30 +868,18 @@ def _get_higher_res(S,info,cnames, outpath,out_file,indexscale,indexdict,binstat
             for x in range(0,len(subgrid_dimX)-1):
                 subgrid_X_ind0 = np.ceil((subgrid_dimX[x] - subgrid_dimX[0])/2).astype('int')
                 subgrid_X_ind1 = np.ceil((subgrid_dimX[x+1] - subgrid_dimX[0])/2).astype('int')
-                if S==(num_scales - 6): #to use multiple processors to compute faster.
-                    sub_image = _get_higher_res_par(S=S+1,
-                                                    info=info,
-                                                    cnames=cnames,
-                                                    outpath=outpath,
-                                                    out_file=out_file,
-                                                    indexscale=indexscale,
-                                                    indexdict=indexdict,
-                                                    binstats=binstats,
-                                                    typegraph=typegraph, 
-                                                    X=subgrid_dimX[x:x+2],
-                                                    Y=subgrid_dimY[y:y+2])
-                else:
-                    sub_image = _get_higher_res(S=S+1,
-                                                info=info,
-                                                cnames=cnames,
-                                                outpath=outpath,
-                                                out_file=out_file,
-                                                indexscale=indexscale,
-                                                indexdict=indexdict,
-                                                binstats=binstats,
-                                                typegraph=typegraph, 
-                                                X=subgrid_dimX[x:x+2],
-                                                Y=subgrid_dimY[y:y+2])
+                sub_image = _get_higher_res(S=S+1,
+                                            info=info,
+                                            cnames=cnames,
+                                            outpath=outpath,
+                                            out_file=out_file,
+                                            indexscale=indexscale,
+                                            indexdict=indexdict,
+                                            binstats=binstats,
+                                            typegraph=typegraph, 
+                                            X=subgrid_dimX[x:x+2],
+                                            Y=subgrid_dimY[y:y+2],
+                                            tiles=tiles)
                                                 
                 image[subgrid_Y_ind0:subgrid_Y_ind1, subgrid_X_ind0:subgrid_X_ind1,:] = _avg2(sub_image)
                 del sub_image
@@ -624,83 +891,6 @@ def _get_higher_res(S,info,cnames, outpath,out_file,indexscale,indexdict,binstat
     logger.info('Finished building tile (scale,X,Y): ({},{},{})'.format(S,int(X[0]/CHUNK_SIZE),int(Y[0]/CHUNK_SIZE)))
     return image
 
-# This function performs the same operation as _get_highe_res, except it uses multiprocessing to grab higher
-# resolution layers at a specific layer.
-def _get_higher_res_par(S,info, cnames, outpath,out_file,indexscale, indexdict, binstats, typegraph, X=None,Y=None):
-    # Get the scale info
-    num_scales = len(info['scales'])
-    scale_info = info['scales'][num_scales-S-1]
-
-    if scale_info==None:
-        ValueError("No scale information for resolution {}.".format(S))
-        
-    if X == None:
-        X = [0,scale_info['size'][0]]
-    if Y == None:
-        Y = [0,scale_info['size'][1]]
-    
-    # Modify upper bound to stay within resolution dimensions
-    if X[1] > scale_info['size'][0]:
-        X[1] = scale_info['size'][0]
-    if Y[1] > scale_info['size'][1]:
-        Y[1] = scale_info['size'][1]
-    
-    # Initialize the output
-    image = np.zeros((Y[1]-Y[0],X[1]-X[0],4),dtype=np.uint8)
-    # If requesting from the lowest scale, then just generate the graph
-    if S==int(info['scales'][0]['key']):
-        index = (int(Y[0]/CHUNK_SIZE) + int(X[0]/CHUNK_SIZE) * info['rows'])
-        if index>=len(indexscale):
-            image = np.ones((CHUNK_SIZE,CHUNK_SIZE,4),dtype=np.uint8) * (bincount + 55)
-        else:
-            image = gen_plot(col1=indexscale[index][0],
-                             col2=indexscale[index][1],
-                             indexdict=indexdict,
-                             column_names=cnames,
-                             bin_stats=binstats,
-                             fig=fig,
-                             ax=ax,
-                             data=datacolor,
-                             typegraph=typegraph)
-
-    else:
-        # Set the subgrid dimensions
-        subgrid_dimX = list(np.arange(2*X[0], 2*X[1], CHUNK_SIZE).astype('int'))
-        subgrid_dimX.append(2*X[1])
-        subgrid_dimY = list(np.arange(2*Y[0], 2*Y[1], CHUNK_SIZE).astype('int'))
-        subgrid_dimY.append(2*Y[1])
-
-        subgrid_images = []
-        
-        with Pool(processes=np.min(4,initial=multiprocessing.cpu_count())) as pool:
-            for y in range(0,len(subgrid_dimY)-1):
-                subgrid_Y_ind0 = np.ceil((subgrid_dimY[y] - subgrid_dimY[0])/2).astype('int')
-                subgrid_Y_ind1 = np.ceil((subgrid_dimY[y+1] - subgrid_dimY[0])/2).astype('int')
-                for x in range(0,len(subgrid_dimX)-1):
-                    subgrid_X_ind0 = np.ceil((subgrid_dimX[x] - subgrid_dimX[0])/2).astype('int')
-                    subgrid_X_ind1 = np.ceil((subgrid_dimX[x+1] - subgrid_dimX[0])/2).astype('int')
-                    subgrid_images.append(pool.apply_async(_get_higher_res,(S+1,
-                                                                           info,
-                                                                           cnames,
-                                                                           outpath,
-                                                                           out_file,
-                                                                           indexscale,
-                                                                           indexdict,
-                                                                           binstats,
-                                                                           typegraph,
-                                                                           subgrid_dimX[x:x+2],
-                                                                           subgrid_dimY[y:y+2])))
-                    image[subgrid_Y_ind0:subgrid_Y_ind1,subgrid_X_ind0:subgrid_X_ind1,:] = _avg2((subgrid_images[y*(len(subgrid_dimX)-1) + x]).get())
-        
-        del subgrid_images
-
-    # Write the chunk
-    outpath = Path(outpath).joinpath('{}_files'.format(out_file),str(S))
-    outpath.mkdir(exist_ok=True)
-    imageio.imwrite(outpath.joinpath('{}_{}.png'.format(int(X[0]/CHUNK_SIZE),int(Y[0]/CHUNK_SIZE))),image,format='PNG-FI',compression=1)
-    logger.info('Finished building tile (scale,X,Y): ({},{},{})'.format(S,int(X[0]/CHUNK_SIZE),int(Y[0]/CHUNK_SIZE)))
-    return image
-
 def write_csv(cnames,index,f_info,out_path,out_file):
     """ This function writes the csv file necessary for the Deep Zoom format """
 
@@ -749,6 +939,8 @@ if __name__=="__main__":
     input_path = args.inpDir
     output_path = Path(args.outDir)
     bincount = args.bin_count
+    if bincount >= NAN_BIN:
+        raise ValueError('bincount must be less than {}'.format(NAN_BIN))
     scales = [args.scale.lower()]
     all_scales = ['linear','log']
     if scales[0] not in all_scales:
@@ -770,13 +962,18 @@ if __name__=="__main__":
     logger.info('Generating colormap and default figure...')
     cmap = get_cmap()
     fig, ax, datacolor = get_default_fig(cmap)
+    _frame.update(get_frame(fig, ax, datacolor))
     logger.info('Done!')
 
     for f in input_files:
         
         logger.info('Loading csv: {}'.format(f))
-        data, cnames = load_csv(f)
+        cnames, is_coded = get_columns(f)
         column_names = [c[0] for c in cnames]
+        
+        # Get the bins of every scale in one pass over the csv
+        logger.info('Getting bin sizes for {} features...'.format(len(column_names)))
+        nrows, scale_stats = get_bin_stats(f, cnames, is_coded, scales)
 
         for scale in scales:
             
@@ -788,7 +985,8 @@ if __name__=="__main__":
 
             # Bin the data
             loggers[scale].info('Binning data for {} {} features...'.format(len(column_names),scale.upper()))
-            bins, bin_stats, data_index, data_dict = transform_data(data,column_names, scale)
+            bin_stats = scale_stats[scale]
+            bins, data_index, data_dict = transform_data(f, cnames, is_coded, nrows, bin_stats, scale)
 
             # Generate the dzi file
             loggers[scale].info('Generating pyramid {} metadata...'.format(scale.upper()))
@@ -800,7 +998,14 @@ if __name__=="__main__":
             write_csv(cnames,data_index,info_data,output_path,folder_name)
             loggers[scale].info('Done!')
 
+            # Render the labels of every column before the pool processes are forked
+            loggers[scale].info('Rendering {} labels...'.format(scale.upper()))
+            for col in range(len(column_names)):
+                for axis in ['x','y']:
+                    get_label_sprite(col, axis, column_names, bin_stats, scale, fig, ax)
+
             # Create the pyramid
             loggers[scale].info('Building {} pyramids...'.format(scale.upper()))
-            image_data = _get_higher_res(0, info_data,column_names, output_path,folder_name,data_index, data_dict, bin_stats, scale)
+            with multiprocessing.get_context('fork').Pool(multiprocessing.cpu_count()) as pool:
+                image_data = _get_higher_res(0, info_data,column_names, output_path,folder_name,data_index, data_dict, bin_stats, scale, pool=pool)
             loggers[scale].info('Done!')
@@ -0,0 +1,125 @@
+""" Benchmark the _mode2 downsampling function
+
+Compares the vectorized _mode2 function used to build segmentation pyramids
+with the previous implementation on random label tiles. Run from the plugin
+directory:
+
+    python benchmarks/mode2.py
+"""
+import sys, pathlib, timeit
+import numpy as np
+
+sys.path.insert(0,str(pathlib.Path(__file__).parent.parent.joinpath('src')))
+from utils import _mode2
+
+def _legacy_mode2(image: np.ndarray) -> np.ndarray:
+    """ Previous implementation of _mode2, used for comparison
+    
+    This method approximates the mode by finding the largest number that occurs
+    at least twice in a 2x2 grid of pixels, then sets that value to the output
+    pixel.
+    
+    Args:
+        image - numpy array with only two dimensions (m,n)
+    Returns:
+        mode_img - numpy array with only two dimensions (round(m/2),round(n/2))
+    """
+
+    y_max = image.shape[0] - image.shape[0] % 2
+    x_max = image.shape[1] - image.shape[1] % 2
+
+    # Initialize the mode output image (Half the size)
+    mode_img = np.zeros(np.ceil([d/2 for d in image.shape]).astype(int),dtype=image.dtype)
+    
+    # Default the output to the upper left pixel value
+    mode_img[0:y_max//2,0:x_max//2] = image[0:-1:2, 0:-1:2]
+    
+    # Handle images with odd-valued image dimensions
+    if y_max != image.shape[0]:
+        mode_img[-1,:x_max//2] = image[-1,0:x_max-1:2]
+    if x_max != image.shape[1]:
+        mode_img[:y_max//2,-1] = image[0:y_max-1:2,-1]
+    if y_max != image.shape[0] and x_max != image.shape[1]:
+        mode_img[-1,-1] = image[-1,-1]
+        
+    # Garnering the four different pixels that we would find the modes of
+    # Finding the mode of: 
+    # vals00[1], vals01[1], vals10[1], vals11[1] 
+    # vals00[2], vals01[2], vals10[2], vals11[2]
+    # etc 
+    vals00 = image[0:-1:2, 0:-1:2]
+    vals01 = image[0:-1:2,   1::2]
+    vals10 = image[  1::2, 0:-1:2]
+    vals11 = image[  1::2,   1::2]
+
+    # Finding where pixels adjacent to the top left pixel are not identical
+    index = (vals00 != vals01) | (vals00 != vals10)
+
+    # Initialize indexes where the two pixels are not the same
+    valueslist = [vals00[index], vals01[index], vals10[index], vals11[index]]
+    
+    # Do a deeper mode search for non-matching pixels
+    temp_mode = mode_img[:y_max//2,:x_max//2]
+    for i in range(3):
+        rvals = valueslist[i]
+        for j in range(i+1,4):
+            cvals = valueslist[j]
+            ind = np.logical_and(cvals==rvals,rvals>temp_mode[index])
+            temp_mode[index][ind] = rvals[ind]
+        
+    mode_img[:y_max//2,:x_max//2] = temp_mode
+
+    return mode_img
+
+def _label_tile(shape, dtype, num_labels, region_size, seed=0):
+    """ Generate a tile of labeled regions
+    
+    Labels are assigned to square regions, with a fraction of pixels
+    randomized so that optical fields on region borders contain ties.
+    """
+    rng = np.random.default_rng(seed)
+    grid = [int(np.ceil(d/region_size)) for d in shape]
+    tile = rng.integers(0,num_labels,grid,dtype=dtype)
+    for axis in range(len(shape)):
+        tile = tile.repeat(region_size,axis=axis)
+    tile = tile[tuple(slice(0,d) for d in shape)]
+    noise = rng.random(shape) < 0.1
+    tile[noise] = rng.integers(0,num_labels,noise.sum(),dtype=dtype)
+    return tile
+
+def _reference_mode2(image, max_ties=False):
+    """ Slow reference mode, one optical field at a time """
+    image = np.pad(image,[(0,d % 2) for d in image.shape],mode='edge')
+    out = np.zeros([d//2 for d in image.shape],dtype=image.dtype)
+    for index in np.ndindex(*out.shape):
+        field = image[tuple(slice(2*i,2*i+2) for i in index)].ravel()
+        values,first,counts = np.unique(field,return_index=True,return_counts=True)
+        tied = counts == counts.max()
+        if max_ties:
+            out[index] = values[tied].max()
+        else:
+            out[index] = field[first[tied].min()]
+    return out
+
+if __name__ == "__main__":
+    
+    # Check the vectorized function against the reference
+    for shape in [(63,65),(31,33,17)]:
+        tile = _label_tile(shape,np.uint32,8,3)
+        for max_ties in [False,True]:
+            assert np.array_equal(_mode2(tile,max_ties),_reference_mode2(tile,max_ties))
+    
+    print('{:<10}{:<16}{:>12}{:>12}{:>10}'.format('dtype','shape','legacy (ms)','_mode2 (ms)','speedup'))
+    for dtype in [np.uint16,np.uint32]:
+        for shape in [(1024,1024),(2048,2048)]:
+            tile = _label_tile(shape,dtype,1000,16)
+            legacy = min(timeit.repeat(lambda: _legacy_mode2(tile),number=5,repeat=3))/5
+            vectorized = min(timeit.repeat(lambda: _mode2(tile),number=5,repeat=3))/5
+            print('{:<10}{:<16}{:>12.2f}{:>12.2f}{:>9.1f}x'.format(np.dtype(dtype).name,str(shape),
+                                                                   1000*legacy,1000*vectorized,
+                                                                   legacy/vectorized))
+        
+        shape = (256,256,64)
+        tile = _label_tile(shape,dtype,1000,16)
+        vectorized = min(timeit.repeat(lambda: _mode2(tile),number=5,repeat=3))/5
+        print('{:<10}{:<16}{:>12}{:>12.2f}{:>10}'.format(np.dtype(dtype).name,str(shape),'-',1000*vectorized,'-'))
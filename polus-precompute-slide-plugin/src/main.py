@@ -17,7 +17,15 @@ def main(input_dir: pathlib.Path,
          pyramid_type: str,
          image_type: str,
          file_patter: str,
-         output_dir: pathlib.Path):
+         output_dir: pathlib.Path,
+         sharded: bool = False,
+         encoding: str = 'raw',
+         build_method: str = 'recursive',
+         resume: bool = False,
+         codec: str = 'zstd',
+         clevel: int = 3,
+         shuffle: str = 'bitshuffle',
+         chunk_sizes: typing.List[int] = None):
     
     # Set ProcessManager config and initialize
     ProcessManager.num_processes(multiprocessing.cpu_count())
@@ -46,6 +54,7 @@ def main(input_dir: pathlib.Path,
     image_dir = ''
     
     processes = []
+    pyramid_writers = {}
     
     for files in fp(group_by=group_by):
         
@@ -84,10 +93,21 @@ def main(input_dir: pathlib.Path,
                     'image_depth': z,
                     'output_depth': depth,
                     'max_output_depth': depth_max,
-                    'image_type': image_type
+                    'image_type': image_type,
+                    'build_method': build_method,
+                    'resume': resume
                 }
+                if pyramid_type == 'Neuroglancer':
+                    pyramid_args['sharded'] = sharded
+                    pyramid_args['encoding'] = encoding
+                elif pyramid_type == 'Zarr':
+                    pyramid_args['codec'] = codec
+                    pyramid_args['clevel'] = clevel
+                    pyramid_args['shuffle'] = shuffle
+                    pyramid_args['chunk_sizes'] = chunk_sizes
                 
                 pw = PyramidWriter[pyramid_type](**pyramid_args)
+                pyramid_writers[pw.base_path] = pw
                 
                 ProcessManager.submit_process(pw.write_slide)
                 
@@ -97,11 +117,16 @@ def main(input_dir: pathlib.Path,
                     pw.write_info()
         
         if pyramid_type in ['Neuroglancer','Zarr']:
-            if image_type == 'segmentation':
+            # Shards are assembled after all chunks have been written
+            if image_type == 'segmentation' or sharded:
                 ProcessManager.join_processes()
             pw.write_info()
     
     ProcessManager.join_processes()
+    
+    # Only interrupted builds leave a manifest behind
+    for pw in pyramid_writers.values():
+        pw.remove_manifest()
 
 if __name__ == "__main__":
     
@@ -122,6 +147,22 @@ if __name__ == "__main__":
                         help='Filepattern of the images in input', required=False)
     parser.add_argument('--imageType', dest='image_type', type=str,
                         help='Either a image or a segmentation, defaults to image', required=False)
+    parser.add_argument('--sharded', dest='sharded', type=str,
+                        help='Write Neuroglancer pyramids in the sharded format, defaults to false', required=False)
+    parser.add_argument('--encoding', dest='encoding', type=str,
+                        help='Neuroglancer chunk encoding (raw, gzip, or compressed_segmentation), defaults to raw', required=False)
+    parser.add_argument('--buildMethod', dest='build_method', type=str,
+                        help='Build the pyramid recursively or breadth-first, defaults to recursive', required=False)
+    parser.add_argument('--resume', dest='resume', type=str,
+                        help='Skip chunks completed by a previous build, defaults to false', required=False)
+    parser.add_argument('--codec', dest='codec', type=str,
+                        help='Blosc compressor for Zarr pyramids, defaults to zstd', required=False)
+    parser.add_argument('--clevel', dest='clevel', type=str,
+                        help='Blosc compression level (0-9) for Zarr pyramids, defaults to 3', required=False)
+    parser.add_argument('--shuffle', dest='shuffle', type=str,
+                        help='Blosc shuffle (noshuffle, shuffle, or bitshuffle) for Zarr pyramids, defaults to bitshuffle', required=False)
+    parser.add_argument('--chunkSizes', dest='chunk_sizes', type=str,
+                        help='Comma separated Zarr chunk sizes for each pyramid level, defaults to 1024', required=False)
 
     '''Parse arguments'''
     args = parser.parse_args()
@@ -155,8 +196,74 @@ if __name__ == "__main__":
 
     logger.info('file_pattern = %s', file_pattern)
     
+    # Default sharded to false
+    sharded = args.sharded == 'true'
+    logger.info('sharded = %s', sharded)
+    if sharded and pyramid_type != 'Neuroglancer':
+        raise ValueError("Sharded output can only be used for Neuroglancer pyramids.")
+    
+    # Default encoding to 'raw'
+    encoding = args.encoding
+    if encoding == None:
+        encoding = 'raw'
+    logger.info('encoding = %s', encoding)
+    assert encoding in utils.NEUROGLANCER_ENCODERS, 'encoding must be one of {}'.format(list(utils.NEUROGLANCER_ENCODERS.keys()))
+    if encoding != 'raw' and pyramid_type != 'Neuroglancer':
+        raise ValueError("Chunk encoding can only be set for Neuroglancer pyramids.")
+    if encoding == 'compressed_segmentation' and image_type != 'segmentation':
+        raise ValueError("compressed_segmentation encoding can only be used with segmentation images.")
+    
+    # Default build_method to 'recursive'
+    build_method = args.build_method
+    if build_method == None:
+        build_method = 'recursive'
+    logger.info('build_method = %s', build_method)
+    assert build_method in utils.BUILD_METHODS, 'buildMethod must be one of {}'.format(utils.BUILD_METHODS)
+    
+    # Default resume to false
+    resume = args.resume == 'true'
+    logger.info('resume = %s', resume)
+    
+    # Default Zarr compression to zstd, level 3, with bitshuffle
+    codec = args.codec
+    if codec == None:
+        codec = 'zstd'
+    logger.info('codec = %s', codec)
+    assert codec in utils.ZARR_CODECS, 'codec must be one of {}'.format(utils.ZARR_CODECS)
+    clevel = args.clevel
+    if clevel == None:
+        clevel = 3
+    clevel = int(clevel)
+    logger.info('clevel = %s', clevel)
+    assert clevel in range(10), 'clevel must be an integer from 0-9'
+    shuffle = args.shuffle
+    if shuffle == None:
+        shuffle = 'bitshuffle'
+    logger.info('shuffle = %s', shuffle)
+    assert shuffle in utils.ZARR_SHUFFLE, 'shuffle must be one of {}'.format(list(utils.ZARR_SHUFFLE.keys()))
+    
+    # Default Zarr chunk sizes to the pyramid chunk size
+    chunk_sizes = args.chunk_sizes
+    if chunk_sizes != None:
+        chunk_sizes = [int(c) for c in chunk_sizes.split(',')]
+        for c in chunk_sizes:
+            assert c > 0 and utils.CHUNK_SIZE % c == 0, 'chunkSizes must evenly divide {}'.format(utils.CHUNK_SIZE)
+    logger.info('chunk_sizes = %s', chunk_sizes)
+    
+    if pyramid_type != 'Zarr' and (args.codec != None or args.clevel != None or
+                                   args.shuffle != None or args.chunk_sizes != None):
+        raise ValueError("codec, clevel, shuffle, and chunkSizes can only be used for Zarr pyramids.")
+    
     main(input_dir,
          pyramid_type,
          image_type,
          file_pattern,
-         output_dir)
+         output_dir,
+         sharded,
+         encoding,
+         build_method,
+         resume,
+         codec,
+         clevel,
+         shuffle,
+         chunk_sizes)
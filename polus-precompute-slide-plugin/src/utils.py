@@ -1,4 +1,4 @@
-import copy, os, json, filepattern, imageio, pathlib, typing, abc, zarr
+import copy, os, json, filepattern, imageio, pathlib, typing, abc, zarr, gzip, shutil, threading
 import bfio
 import numpy as np
 from numcodecs import Blosc
@@ -17,63 +17,78 @@ UNITS = {'m':  10**9,
 # Chunk Scale
 CHUNK_SIZE = 1024
 
-def _mode2(image: np.ndarray) -> np.ndarray:
+# Methods used to build pyramids
+BUILD_METHODS = ['recursive','breadth-first']
+
+# Sharded Neuroglancer format settings
+# Each minishard holds 2**SHARD_PRESHIFT_BITS chunks, and each shard holds
+# 2**SHARD_MINISHARD_BITS minishards
+SHARD_PRESHIFT_BITS = 2
+SHARD_MINISHARD_BITS = 4
+
+# Zarr Blosc compression settings
+ZARR_CODECS = ['blosclz','lz4','lz4hc','zlib','zstd']
+ZARR_SHUFFLE = {'noshuffle': Blosc.NOSHUFFLE,
+                'shuffle': Blosc.SHUFFLE,
+                'bitshuffle': Blosc.BITSHUFFLE}
+
+# Prevents threads from writing to the same staging file at the same time
+_staging_lock = threading.Lock()
+
+# Prevents threads from writing to the same chunk manifest at the same time
+_manifest_lock = threading.Lock()
+
+def _mode2(image: np.ndarray, max_ties: bool = False) -> np.ndarray:
     """ Find mode of pixels in optical field 2x2 and stride 2
     
-    This method approximates the mode by finding the largest number that occurs
-    at least twice in a 2x2 grid of pixels, then sets that value to the output
-    pixel.
+    For 3-dimensional images, the optical field is 2x2x2. The mode is found
+    by counting how many times each pixel value occurs in its optical field,
+    which is done for all optical fields at once without looping over pixels.
+    
+    When more than one value occurs the most times in an optical field, the
+    first value in the optical field (the upper left pixel first) is used. If
+    max_ties is True, the largest value is used instead.
+    
+    Images with odd-valued dimensions are padded by repeating the last pixel
+    along the dimension.
     
     Args:
-        image - numpy array with only two dimensions (m,n)
+        image - numpy array with two dimensions (m,n) or three dimensions (m,n,p)
+        max_ties - use the largest value when values are tied for the mode
     Returns:
-        mode_img - numpy array with only two dimensions (round(m/2),round(n/2))
+        mode_img - numpy array with dimensions (ceil(m/2),ceil(n/2)) or
+                   (ceil(m/2),ceil(n/2),ceil(p/2))
     """
-
-    y_max = image.shape[0] - image.shape[0] % 2
-    x_max = image.shape[1] - image.shape[1] % 2
-
-    # Initialize the mode output image (Half the size)
-    mode_img = np.zeros(np.ceil([d/2 for d in image.shape]).astype(int),dtype=image.dtype)
     
-    # Default the output to the upper left pixel value
-    mode_img[0:y_max//2,0:x_max//2] = image[0:-1:2, 0:-1:2]
+    assert image.ndim in [2,3], 'image must be 2 or 3 dimensional'
+    
+    if any(d % 2 for d in image.shape):
+        image = np.pad(image,[(0,d % 2) for d in image.shape],mode='edge')
+    
+    # Get the pixels in each optical field
+    if image.ndim == 2:
+        vals = [image[y::2,x::2] for y in range(2) for x in range(2)]
+    else:
+        vals = [image[y::2,x::2,z::2] for y in range(2) for x in range(2) for z in range(2)]
+    
+    # Count the number of times each pixel value occurs in its optical field
+    counts = [np.ones(vals[0].shape,dtype=np.uint8) for _ in vals]
+    for i in range(len(vals)):
+        for j in range(i+1,len(vals)):
+            matches = vals[i] == vals[j]
+            counts[i] += matches
+            counts[j] += matches
+    
+    # Keep the most frequent value, checking values in optical field order
+    mode_img = vals[0].copy()
+    max_counts = counts[0]
+    for val,count in zip(vals[1:],counts[1:]):
+        update = count > max_counts
+        if max_ties:
+            update |= (count == max_counts) & (val > mode_img)
+        np.copyto(mode_img,val,where=update)
+        max_counts = np.maximum(max_counts,count)
     
-    # Handle images with odd-valued image dimensions
-    if y_max != image.shape[0]:
-        mode_img[-1,:x_max//2] = image[-1,0:x_max-1:2]
-    if x_max != image.shape[1]:
-        mode_img[:y_max//2,-1] = image[0:y_max-1:2,-1]
-    if y_max != image.shape[0] and x_max != image.shape[1]:
-        mode_img[-1,-1] = image[-1,-1]
-        
-    # Garnering the four different pixels that we would find the modes of
-    # Finding the mode of: 
-    # vals00[1], vals01[1], vals10[1], vals11[1] 
-    # vals00[2], vals01[2], vals10[2], vals11[2]
-    # etc 
-    vals00 = image[0:-1:2, 0:-1:2]
-    vals01 = image[0:-1:2,   1::2]
-    vals10 = image[  1::2, 0:-1:2]
-    vals11 = image[  1::2,   1::2]
-
-    # Finding where pixels adjacent to the top left pixel are not identical
-    index = (vals00 != vals01) | (vals00 != vals10)
-
-    # Initialize indexes where the two pixels are not the same
-    valueslist = [vals00[index], vals01[index], vals10[index], vals11[index]]
-    
-    # Do a deeper mode search for non-matching pixels
-    temp_mode = mode_img[:y_max//2,:x_max//2]
-    for i in range(3):
-        rvals = valueslist[i]
-        for j in range(i+1,4):
-            cvals = valueslist[j]
-            ind = np.logical_and(cvals==rvals,rvals>temp_mode[index])
-            temp_mode[index][ind] = rvals[ind]
-        
-    mode_img[:y_max//2,:x_max//2] = temp_mode
-
     return mode_img
 
 def _avg2(image: np.ndarray) -> np.ndarray:
@@ -138,6 +153,20 @@ class PyramidWriter():
     
     Inputs:
         base_dir - Where pyramid folders and info file will be stored
+        build_method - recursive builds each chunk from the chunks below it
+                       using _get_higher_res, breadth-first builds one scale
+                       at a time from strips of the image using _get_lower_res
+        resume - skip chunks recorded in the manifest by a previous build
+    
+    Every chunk that is written is recorded in a manifest, which holds one
+    record of (scale, x, y) as three uint32 values for each completed chunk.
+    There is one manifest for each output depth, stored in the manifest folder
+    of the pyramid. Since a chunk is recorded only after it has been written,
+    a build that is interrupted can be resumed without rewriting the chunks
+    that were already completed. When building recursively, a completed chunk
+    is loaded from disk rather than being rebuilt from the chunks below it, so
+    only the parents of missing chunks are rebuilt. The manifests are removed
+    once every depth of the pyramid is built.
     """
 
     chunk_pattern = None
@@ -148,7 +177,9 @@ class PyramidWriter():
                  image_depth: int = 0,
                  output_depth: int = 0,
                  max_output_depth: int = None,
-                 image_type: str = "image"):
+                 image_type: str = "image",
+                 build_method: str = "recursive",
+                 resume: bool = False):
         
         if isinstance(image_path,str):
             image_path = pathlib.Path(image_path)
@@ -161,6 +192,12 @@ class PyramidWriter():
         self.max_output_depth = max_output_depth
         self.image_type = image_type
         
+        if build_method not in BUILD_METHODS:
+            raise ValueError('build_method must be one of {}'.format(BUILD_METHODS))
+        self.build_method = build_method
+        self.resume = resume
+        self.completed = set()
+        
         if image_type == 'image':
             self.scale = _avg2
         elif image_type == 'segmentation':
@@ -168,15 +205,19 @@ class PyramidWriter():
         else:
             raise ValueError('image_type must be one of ["image","segmentation"]')
             
-        self.info = bfio_metadata_to_slide_info(self.image_path,
-                                                self.base_path,
-                                                self.max_output_depth,
-                                                self.image_type)
+        self.info = self._slide_info()
         
         self.dtype = self.info['data_type']
         
         self.encoder = self._encoder()
     
+    def _slide_info(self):
+        
+        return bfio_metadata_to_slide_info(self.image_path,
+                                           self.base_path,
+                                           self.max_output_depth,
+                                           self.image_type)
+    
     @abc.abstractmethod
     def _encoder(self):
         pass
@@ -193,6 +234,80 @@ class PyramidWriter():
     def write_segment_info(self):
         pass
     
+    def _manifest_path(self):
+        return self.base_path.joinpath('manifest','{}.bin'.format(self.output_depth))
+    
+    def load_manifest(self):
+        """ Load the chunks completed by a previous build
+        
+        If not resuming, the manifest from any previous build is removed so
+        that all chunks are rebuilt. A partial record left by an interrupted
+        build is ignored.
+        """
+        
+        manifest_path = self._manifest_path()
+        self.completed = set()
+        
+        if not manifest_path.exists():
+            return
+        
+        if not self.resume:
+            manifest_path.unlink()
+            return
+        
+        records = np.fromfile(str(manifest_path),dtype='<u4')
+        records = records[:records.size - records.size % 3].reshape(-1,3)
+        self.completed = set(map(tuple,records.tolist()))
+    
+    def is_complete(self, key, chunk_coords):
+        """ Check if a chunk was completed by a previous build
+        
+        Inputs:
+            key - pyramid scale
+            chunk_coords - X,Y coordinates of the chunk
+        Returns:
+            True if the chunk is in the manifest
+        """
+        return (int(key),chunk_coords[0],chunk_coords[2]) in self.completed
+    
+    def _record_chunk(self, key, chunk_coords):
+        
+        manifest_path = self._manifest_path()
+        with _manifest_lock:
+            manifest_path.parent.mkdir(parents=True,exist_ok=True)
+            with open(str(manifest_path),'ab') as f:
+                f.write(np.asarray([int(key),chunk_coords[0],chunk_coords[2]],dtype='<u4').tobytes())
+    
+    def remove_manifest(self):
+        """ Remove the manifests once every depth of the pyramid is built
+        
+        Only builds that were interrupted leave manifests behind.
+        """
+        shutil.rmtree(str(self.base_path.joinpath('manifest')),ignore_errors=True)
+    
+    def load_chunk(self, key, chunk_coords):
+        """ Load a chunk completed by a previous build
+        
+        Writers that can't read back their chunks return None, in which case
+        the chunk is rebuilt but not written again.
+        
+        Inputs:
+            key - pyramid scale
+            chunk_coords - X,Y coordinates of the chunk
+        Returns:
+            image - the chunk as a 2-dimensional numpy array, or None
+        """
+        return None
+    
+    def _build_pyramid(self,S,Z):
+        
+        self.load_manifest()
+        
+        if self.build_method == 'breadth-first':
+            _get_lower_res(S,self,Z=Z)
+        else:
+            _get_higher_res(S,self,Z=Z)
+    
     def write_slide(self):
         
         with ProcessManager.process(f'{self.base_path} - {self.output_depth}'):
@@ -227,9 +342,15 @@ class PyramidWriter():
             chunk_coords: X,Y,Z coordinates of data in buf
         """
         
+        # Skip chunks written by a previous build
+        if self.is_complete(key,chunk_coords):
+            return
+        
         buf = self.encoder.encode(image)
         
         self._write_chunk(key,chunk_coords,buf)
+        
+        self._record_chunk(key,chunk_coords)
 
     def _chunk_path(self, key, chunk_coords, pattern=None):
         if pattern is None:
@@ -301,6 +422,12 @@ def _get_higher_res(S: int,
     if Y[1] > scale_info['size'][1]:
         Y[1] = scale_info['size'][1]
     
+    # Load the chunk if it was completed by a previous build
+    if slide_writer.is_complete(str(S),(X[0],X[1],Y[0],Y[1])):
+        image = slide_writer.load_chunk(str(S),(X[0],X[1],Y[0],Y[1]))
+        if image is not None:
+            return image
+    
     if str(S)==slide_writer.scale_info(-1)['key']:
         with ProcessManager.thread():
         
@@ -351,26 +478,165 @@ def _get_higher_res(S: int,
     slide_writer.store_chunk(image,str(S),(X[0],X[1],Y[0],Y[1]))
     return image
 
+def _get_lower_res(S: int,
+                   slide_writer: PyramidWriter,
+                   Z: typing.Tuple[int,int] = (0,1)):
+    """ Breadth first function for pyramid building
+    
+    This is an alternative to _get_higher_res that builds the pyramid from the
+    bottom up. The highest resolution image is read once, one strip of
+    CHUNK_SIZE rows at a time, and the chunks in each strip are written. Each
+    strip is then downsampled and added to a strip buffer for the next scale.
+    When a strip buffer is full (or reaches the bottom of the image at that
+    scale), its chunks are written and it is downsampled into the next scale.
+    
+    Only one strip per scale is held in memory, so memory scales with the
+    image width rather than the image size, and the image is read
+    sequentially from top to bottom. The next strip is read in the background
+    while the current strip is processed.
+    
+    Args:
+        S: Top level scale at which to stop building the pyramid
+        slide_writer: object used to encode and write pyramid tiles
+        Z: Range of Z values [min,max] to read from the image
+    """
+    
+    base_scale = int(slide_writer.scale_info(-1)['key'])
+    
+    # Strip buffers for each scale below the highest resolution
+    buffers = {}
+    for scale in range(S,base_scale):
+        width = slide_writer.scale_info(scale)['size'][0]
+        buffers[scale] = np.zeros((CHUNK_SIZE,width),dtype=slide_writer.dtype)
+    
+    def write_strip(scale,y,image):
+        
+        # Write the chunks in the strip
+        for x in range(0,image.shape[1],CHUNK_SIZE):
+            x_max = min(x+CHUNK_SIZE,image.shape[1])
+            slide_writer.store_chunk(image[:,x:x_max],str(scale),(x,x_max,y,y+image.shape[0]))
+        
+        # Downsample the strip into the next scale
+        if scale > S:
+            add_to_strip(scale-1,y//2,slide_writer.scale(image))
+            
+    def add_to_strip(scale,y,image):
+        
+        height = slide_writer.scale_info(scale)['size'][1]
+        buffer = buffers[scale]
+        row = y % CHUNK_SIZE
+        buffer[row:row+image.shape[0]] = image
+        
+        # Write the strip when it is full or at the bottom of the image
+        rows = row + image.shape[0]
+        if rows == CHUNK_SIZE or y + image.shape[0] == height:
+            write_strip(scale,y - row,buffer[:rows])
+    
+    with bfio.BioReader(slide_writer.image_path) as br:
+        
+        def read_strip(y):
+            return br[y:min(y+CHUNK_SIZE,br.Y),0:br.X,Z[0]:Z[1],...].squeeze(axis=(2,3,4))
+        
+        with ThreadPoolExecutor(1) as executor:
+            strips = range(0,br.Y,CHUNK_SIZE)
+            future = executor.submit(read_strip,strips[0])
+            for i,y in enumerate(strips):
+                image = future.result()
+                if i + 1 < len(strips):
+                    future = executor.submit(read_strip,strips[i+1])
+                write_strip(base_scale,y,image)
+
+def _compressed_morton_code(grid_coords: np.ndarray,
+                            grid_shape: typing.Sequence[int]) -> np.ndarray:
+    """ Get the compressed morton code of chunk grid coordinates
+    
+    The compressed morton code interleaves the bits of the x, y, and z chunk
+    grid coordinates, skipping bits that are not needed to represent the grid
+    shape in a dimension. This is used as the chunk id in the sharded
+    Neuroglancer precomputed format.
+    
+    Args:
+        grid_coords - numpy array (n,3) of x,y,z chunk grid coordinates
+        grid_shape - number of chunks along x, y, and z
+    Returns:
+        code - numpy array (n,) of uint64 chunk ids
+    """
+    
+    grid_coords = np.asarray(grid_coords,dtype=np.uint64).reshape(-1,3)
+    bits = [int(np.ceil(np.log2(g))) for g in grid_shape]
+    
+    code = np.zeros(grid_coords.shape[0],dtype=np.uint64)
+    j = 0
+    for b in range(max(bits)):
+        for d in range(3):
+            if b < bits[d]:
+                code |= ((grid_coords[:,d] >> np.uint64(b)) & np.uint64(1)) << np.uint64(j)
+                j += 1
+                
+    return code
+
+def _sharding_spec(grid_shape: typing.Sequence[int]) -> dict:
+    """ Get the sharding parameters for a scale
+    
+    Chunk ids are not hashed, so that neighboring chunks end up in the same
+    minishard and shard.
+    
+    Args:
+        grid_shape - number of chunks along x, y, and z
+    Returns:
+        spec - sharding specification for the scale in the info file
+    """
+    
+    total_bits = sum(int(np.ceil(np.log2(g))) for g in grid_shape)
+    preshift_bits = min(total_bits,SHARD_PRESHIFT_BITS)
+    minishard_bits = min(total_bits - preshift_bits,SHARD_MINISHARD_BITS)
+    shard_bits = total_bits - preshift_bits - minishard_bits
+    
+    return {
+        "@type": "neuroglancer_uint64_sharded_v1",
+        "hash": "identity",
+        "preshift_bits": preshift_bits,
+        "minishard_bits": minishard_bits,
+        "shard_bits": shard_bits,
+        "minishard_index_encoding": "gzip",
+        "data_encoding": "raw"
+    }
+
 class NeuroglancerWriter(PyramidWriter):
     """ Method to write a Neuroglancer pre-computed pyramid
     
+    If sharded is True, chunks are written in the sharded precomputed format.
+    Since the chunks in a shard can come from any image in the stack, chunks
+    are first appended to one staging file per scale and image, and the shard
+    files are assembled from the staging files by write_info.
+    
+    Chunks are encoded as raw bytes, gzip compressed raw bytes, or using the
+    compressed_segmentation encoding (segmentation images only).
+    
     Inputs:
         base_dir - Where pyramid folders and info file will be stored
+        sharded - Write chunks in the sharded precomputed format
+        encoding - Chunk encoding, must be one of NEUROGLANCER_ENCODERS
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, sharded: bool = False, encoding: str = 'raw', **kwargs):
+        if encoding not in NEUROGLANCER_ENCODERS:
+            raise ValueError('encoding must be one of {}'.format(list(NEUROGLANCER_ENCODERS.keys())))
+        self.encoding = encoding
         super().__init__(*args, **kwargs)
-        self.chunk_pattern = "{key}/{0}-{1}_{2}-{3}_{4}-{5}"
-        
-        min_level = min([int(self.scale_info(-1)['key']),10])
-        self.info = bfio_metadata_to_slide_info(self.image_path,
-                                                self.base_path,
-                                                self.max_output_depth,
-                                                self.image_type,
-                                                min_level)
+        if self.encoding == 'compressed_segmentation' and self.image_type != 'segmentation':
+            raise ValueError('compressed_segmentation encoding can only be used for segmentation images.')
+        self.sharded = sharded
+        if self.sharded:
+            self.chunk_pattern = "{key}/staging/{4}"
+        else:
+            self.chunk_pattern = "{key}/{0}-{1}_{2}-{3}_{4}-{5}"
         
         if self.image_type == 'segmentation':
             self.labels = set()
+        
+        # Staging file indices loaded when resuming a sharded build
+        self._staging_index = {}
             
     def store_chunk(self, image, key, chunk_coords):
         
@@ -394,12 +660,164 @@ class NeuroglancerWriter(PyramidWriter):
     def _write_chunk(self,key,chunk_coords,buf):
         chunk_path = self._chunk_path(key,chunk_coords)
         os.makedirs(str(chunk_path.parent), exist_ok=True)
-        with open(str(chunk_path.with_name(chunk_path.name)),'wb') as f:
-            f.write(buf)
+        
+        if self.sharded:
+            # Append the chunk to the staging file, and record the chunk grid
+            # coordinates and location in the staging file
+            chunk_coords = self._chunk_coords(chunk_coords)
+            with _staging_lock:
+                with open(str(chunk_path.with_suffix('.data')),'ab') as f:
+                    offset = f.tell()
+                    f.write(buf)
+                with open(str(chunk_path.with_suffix('.index')),'ab') as f:
+                    f.write(np.asarray([chunk_coords[0]//CHUNK_SIZE,
+                                        chunk_coords[2]//CHUNK_SIZE,
+                                        chunk_coords[4],
+                                        offset,
+                                        len(buf)],dtype='<u8').tobytes())
+        else:
+            with open(str(chunk_path.with_name(chunk_path.name)),'wb') as f:
+                f.write(buf)
+    
+    def load_chunk(self, key, chunk_coords):
+        
+        # Segmentation chunks are rebuilt so that all labels are aggregated
+        if self.image_type == 'segmentation':
+            return None
+        
+        chunk_path = self._chunk_path(key,chunk_coords)
+        
+        if self.sharded:
+            # Find the most recent copy of the chunk in the staging file
+            if key not in self._staging_index:
+                self._staging_index[key] = np.fromfile(str(chunk_path.with_suffix('.index')),
+                                                       dtype='<u8').reshape(-1,5)
+            index = self._staging_index[key]
+            match = np.argwhere((index[:,0] == chunk_coords[0]//CHUNK_SIZE) &
+                                (index[:,1] == chunk_coords[2]//CHUNK_SIZE) &
+                                (index[:,2] == self.output_depth))
+            if match.size == 0:
+                return None
+            offset,size = index[match[-1,0],3:5]
+            with open(str(chunk_path.with_suffix('.data')),'rb') as f:
+                f.seek(int(offset))
+                buf = f.read(int(size))
+        else:
+            with open(str(chunk_path),'rb') as f:
+                buf = f.read()
+        
+        if self.encoding == 'gzip':
+            buf = gzip.decompress(buf)
+        
+        image = np.frombuffer(buf,dtype=self.dtype)
+        return image.reshape(chunk_coords[3]-chunk_coords[2],chunk_coords[1]-chunk_coords[0])
+                
+    def _write_shards(self,scale):
+        """ Assemble the shard files for a scale from the staging files
+        
+        The staging files are deleted once all shards are written.
+        
+        Inputs:
+            scale - scale info from the info file, including sharding info
+        """
+        
+        staging = self.base_path.joinpath(scale['key'],'staging')
+        if not staging.exists():
+            return
+        
+        sharding = scale['sharding']
+        grid_shape = [int(np.ceil(s/c)) for s,c in zip(scale['size'],scale['chunk_sizes'][0])]
+        preshift_bits = np.uint64(sharding['preshift_bits'])
+        minishard_bits = np.uint64(sharding['minishard_bits'])
+        shard_bits = np.uint64(sharding['shard_bits'])
+        
+        # Load the chunk locations from all staging files
+        data_files = []
+        records = []
+        for index_file in sorted(staging.glob('*.index')):
+            index = np.fromfile(str(index_file),dtype='<u8').reshape(-1,5)
+            records.append(np.concatenate([_compressed_morton_code(index[:,:3],grid_shape)[:,np.newaxis],
+                                           np.full((index.shape[0],1),len(data_files),dtype=np.uint64),
+                                           index[:,3:]],axis=1))
+            data_files.append(index_file.with_suffix('.data'))
+        records = np.concatenate(records,axis=0)
+        
+        # If a chunk was written more than once, keep the last one
+        _,last = np.unique(records[::-1,0],return_index=True)
+        records = records[records.shape[0] - 1 - last]
+        
+        chunk_ids = records[:,0]
+        hashed = chunk_ids >> preshift_bits
+        minishards = hashed & ((np.uint64(1) << minishard_bits) - np.uint64(1))
+        shards = (hashed >> minishard_bits) & ((np.uint64(1) << shard_bits) - np.uint64(1))
+        order = np.lexsort((chunk_ids,minishards,shards))
+        records,minishards,shards = records[order],minishards[order],shards[order]
+        
+        num_minishards = 2**int(minishard_bits)
+        shard_digits = max(1,int(np.ceil(int(shard_bits)/4)))
+        handles = [open(str(f),'rb') for f in data_files]
+        try:
+            for shard in np.unique(shards):
+                in_shard = shards == shard
+                shard_records = records[in_shard]
+                shard_minishards = minishards[in_shard]
+                
+                # Byte offsets are relative to the end of the shard index
+                shard_index = np.zeros((num_minishards,2),dtype='<u8')
+                shard_path = self.base_path.joinpath(scale['key'],
+                                                     '{:0{}x}.shard'.format(int(shard),shard_digits))
+                with open(str(shard_path),'wb') as fw:
+                    fw.write(shard_index.tobytes())
+                    position = 0
+                    for minishard in range(num_minishards):
+                        minishard_records = shard_records[shard_minishards == minishard]
+                        if minishard_records.shape[0] == 0:
+                            shard_index[minishard] = position
+                            continue
+                        
+                        # Write the chunks
+                        starts = []
+                        for chunk_id,file_index,offset,size in minishard_records:
+                            handle = handles[int(file_index)]
+                            handle.seek(int(offset))
+                            starts.append(position)
+                            fw.write(handle.read(int(size)))
+                            position += int(size)
+                        
+                        # Write the minishard index
+                        starts = np.asarray(starts,dtype=np.uint64)
+                        sizes = minishard_records[:,3]
+                        minishard_index = np.zeros((3,minishard_records.shape[0]),dtype='<u8')
+                        minishard_index[0] = np.diff(minishard_records[:,0],prepend=np.uint64(0))
+                        minishard_index[1] = starts - np.concatenate([[0],starts[:-1] + sizes[:-1]]).astype(np.uint64)
+                        minishard_index[2] = sizes
+                        minishard_index = gzip.compress(minishard_index.tobytes())
+                        
+                        shard_index[minishard] = [position,position + len(minishard_index)]
+                        fw.write(minishard_index)
+                        position += len(minishard_index)
+                    
+                    fw.seek(0)
+                    fw.write(shard_index.tobytes())
+        finally:
+            for handle in handles:
+                handle.close()
+        
+        shutil.rmtree(str(staging))
             
+    def _slide_info(self):
+        
+        # Scales below 10 are not created, which is the same as min(num_scales,10)
+        return bfio_metadata_to_slide_info(self.image_path,
+                                           self.base_path,
+                                           self.max_output_depth,
+                                           self.image_type,
+                                           10,
+                                           self.encoding)
+    
     def _encoder(self):
         
-        return NeuroglancerChunkEncoder(self.info)
+        return NEUROGLANCER_ENCODERS[self.encoding](self.info)
     
     def _write_slide(self):
         
@@ -407,8 +825,7 @@ class NeuroglancerWriter(PyramidWriter):
     
         # Don't create a full pyramid to help reduce bounding box size
         start_level = int(self.info['scales'][-1]['key'])
-        image = _get_higher_res(start_level,self,
-                                Z=(self.image_depth,self.image_depth+1))
+        self._build_pyramid(start_level,(self.image_depth,self.image_depth+1))
 
     def write_info(self):
         """ This creates the info file specifying the metadata for the precomputed format """
@@ -417,6 +834,19 @@ class NeuroglancerWriter(PyramidWriter):
         op = pathlib.Path(self.base_path)
         op.mkdir(exist_ok=True,parents=True)
         op = op.joinpath("info")
+        
+        # Assemble the shards, this must be done after all chunks are written
+        if self.sharded:
+            for scale in self.info['scales']:
+                grid_shape = [int(np.ceil(s/c)) for s,c in zip(scale['size'],scale['chunk_sizes'][0])]
+                scale['sharding'] = _sharding_spec(grid_shape)
+                if self.encoding == 'gzip':
+                    scale['sharding']['data_encoding'] = 'gzip'
+                self._write_shards(scale)
+            
+            # Completed chunks are only in the shards once staging files are
+            # removed, so a later build can't resume from the manifests
+            self.remove_manifest()
 
         # Write the neuroglancer info file
         with open(op,'w') as writer:
@@ -466,15 +896,54 @@ class NeuroglancerWriter(PyramidWriter):
             json.dump(info,writer,indent=2)
             
 class ZarrWriter(PyramidWriter):
-    """ Method to write a Zarr pyramid
+    """ Method to write an OME-NGFF Zarr pyramid
+    
+    Each pyramid level is stored as a 5-dimensional (t,c,z,y,x) array, and the
+    multiscales metadata follows version 0.4 of the OME-NGFF specification.
+    
+    Chunks are compressed and written by a pool of threads while the pyramid
+    is being built. Every chunk in a zarr array is only ever written by one
+    pyramid chunk since zarr chunks are aligned to pyramid chunks, so no
+    synchronization is needed between threads (or processes writing other
+    channels). At most 2*max_workers chunks are waiting to be written at any
+    time, which bounds the memory used by the write queue.
     
     Inputs:
         base_dir - Where pyramid folders and info file will be stored
+        codec - Blosc compressor, must be one of ZARR_CODECS
+        clevel - Blosc compression level (0-9)
+        shuffle - Blosc shuffle, must be one of ZARR_SHUFFLE
+        chunk_sizes - zarr chunk size of each pyramid level, starting at the
+                      full resolution level. Levels without a chunk size use
+                      the last chunk size. Each chunk size must evenly divide
+                      CHUNK_SIZE. Defaults to CHUNK_SIZE for all levels.
+        max_workers - Number of threads used to write chunks
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self,
+                 *args,
+                 codec: str = 'zstd',
+                 clevel: int = 3,
+                 shuffle: str = 'bitshuffle',
+                 chunk_sizes: typing.Sequence[int] = None,
+                 max_workers: int = 4,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         
+        if codec not in ZARR_CODECS:
+            raise ValueError('codec must be one of {}'.format(ZARR_CODECS))
+        if shuffle not in ZARR_SHUFFLE:
+            raise ValueError('shuffle must be one of {}'.format(list(ZARR_SHUFFLE.keys())))
+        if clevel not in range(10):
+            raise ValueError('clevel must be an integer from 0-9')
+        if chunk_sizes is None:
+            chunk_sizes = [CHUNK_SIZE]
+        for chunk_size in chunk_sizes:
+            if chunk_size < 1 or CHUNK_SIZE % chunk_size != 0:
+                raise ValueError('chunk_sizes must evenly divide {}'.format(CHUNK_SIZE))
+        self.chunk_sizes = list(chunk_sizes)
+        self.max_workers = max_workers
+        
         out_name = self.base_path.name.replace(''.join(self.base_path.suffixes),'')
         self.base_path = self.base_path.with_name(out_name)
         self.base_path.mkdir(exist_ok=True)
@@ -488,19 +957,51 @@ class ZarrWriter(PyramidWriter):
         
         self.writers = {}
         max_scale = int(self.scale_info(-1)['key'])
-        compressor = Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+        compressor = Blosc(cname=codec, clevel=clevel, shuffle=ZARR_SHUFFLE[shuffle])
         for S in range(10,len(self.info['scales'])):
             scale_info = self.scale_info(S)
             key = str(max_scale - int(scale_info['key']))
+            shape = (1,self.max_output_depth,1,scale_info['size'][1],scale_info['size'][0])
             if key not in self.root.array_keys():
+                chunk_size = self.chunk_sizes[min(int(key),len(self.chunk_sizes)-1)]
                 self.writers[key] = self.root.zeros(key,
-                                                    shape=(1,self.max_output_depth,1) + tuple(scale_info['size'][0:2]),
-                                                    chunks=(1,1,1,CHUNK_SIZE,CHUNK_SIZE),
+                                                    shape=shape,
+                                                    chunks=(1,1,1,chunk_size,chunk_size),
                                                     dtype=self.dtype,
                                                     compressor=compressor)
             else:
-                self.root[key].resize((1,self.max_output_depth,1) + tuple(scale_info['size'][0:2]))
+                self.root[key].resize(shape)
                 self.writers[key] = self.root[key]
+        
+        # The write queue is created in the process that builds the pyramid
+        self._executor = None
+
+    def store_chunk(self, image, key, chunk_coords):
+        
+        # Write synchronously if the pyramid isn't being built by _write_slide
+        if self._executor is None:
+            super().store_chunk(image, key, chunk_coords)
+            return
+        
+        # Skip chunks written by a previous build
+        if self.is_complete(key,chunk_coords):
+            return
+        
+        # Encode now, since the image may be a view of a buffer that is reused
+        buf = self.encoder.encode(image)
+        
+        self._queued.acquire()
+        self._executor.submit(self._write_queued_chunk,key,chunk_coords,buf)
+    
+    def _write_queued_chunk(self,key,chunk_coords,buf):
+        
+        try:
+            self._write_chunk(key,chunk_coords,buf)
+            self._record_chunk(key,chunk_coords)
+        except Exception as err:
+            self._errors.append(err)
+        finally:
+            self._queued.release()
 
     def _write_chunk(self,key,chunk_coords,buf):
         key = str(int(self.scale_info(-1)['key']) - int(key))
@@ -510,33 +1011,68 @@ class ZarrWriter(PyramidWriter):
                           0:1,
                           chunk_coords[2]:chunk_coords[3],
                           chunk_coords[0]:chunk_coords[1]] = buf
+    
+    def load_chunk(self, key, chunk_coords):
+        key = str(int(self.scale_info(-1)['key']) - int(key))
+        chunk_coords = self._chunk_coords(chunk_coords)
+        return self.writers[key][0,
+                                 chunk_coords[4],
+                                 0,
+                                 chunk_coords[2]:chunk_coords[3],
+                                 chunk_coords[0]:chunk_coords[1]]
             
     def _encoder(self):
         
         return ZarrChunkEncoder(self.info)
     
     def _write_slide(self):
-    
-        _get_higher_res(10,self,Z=(self.image_depth,self.image_depth+1))
+        
+        self._queued = threading.BoundedSemaphore(2*self.max_workers)
+        self._errors = []
+        
+        try:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                self._executor = executor
+                self._build_pyramid(10,(self.image_depth,self.image_depth+1))
+        finally:
+            self._executor = None
+        
+        if len(self._errors) > 0:
+            raise self._errors[0]
             
     def write_info(self):
-        """ This creates the multiscales metadata for zarr pyramids """
-        # https://forum.image.sc/t/multiscale-arrays-v0-1/37930
+        """ This creates the OME-NGFF multiscales metadata for zarr pyramids """
+        # https://ngff.openmicroscopy.org/0.4/#multiscale-md
+        space_axis = {"type": "space", "unit": "nanometer"}
         multiscales = [{
-            "version": "0.1",
+            "version": "0.4",
             "name": self.base_path.name,
+            "axes": [
+                {"name": "t", "type": "time"},
+                {"name": "c", "type": "channel"},
+                dict(name="z", **space_axis),
+                dict(name="y", **space_axis),
+                dict(name="x", **space_axis)
+            ],
             "datasets": [],
+            "type": "mean",
             "metadata": {
                 "method": "mean"
             }
         }]
         
-        pad = len(self.scale_info(-1)['key'])
         max_scale = int(self.scale_info(-1)['key'])
         for S in reversed(range(10,len(self.info['scales']))):
             scale_info = self.scale_info(S)
             key = str(max_scale - int(scale_info['key']))
-            multiscales[0]["datasets"].append({"path": key})
+            resolution = scale_info['resolution']
+            multiscales[0]["datasets"].append({
+                "path": key,
+                "coordinateTransformations": [{
+                    "type": "scale",
+                    "scale": [1.0,1.0,resolution[2],resolution[1],resolution[0]]
+                }]
+            })
         self.root.attrs["multiscales"] = multiscales
         
         with bfio.BioReader(self.image_path,max_workers=1) as bfio_reader:
@@ -548,7 +1084,7 @@ class ZarrWriter(PyramidWriter):
             for c in range(self.max_output_depth):
                 metadata.image().Pixels.Channel(c).Name = f'Channel {c}'
             
-            with open(self.base_path.joinpath("METADATA.ome.xml"),'x') as fw:
+            with open(self.base_path.joinpath("METADATA.ome.xml"),'w' if self.resume else 'x') as fw:
                 
                 fw.write(str(metadata).replace("<ome:","<").replace("</ome:","</"))
 
@@ -573,6 +1109,10 @@ class DeepZoomWriter(PyramidWriter):
         os.makedirs(str(chunk_path.parent), exist_ok=True)
         imageio.imwrite(str(chunk_path.with_name(chunk_path.name)),buf,format='PNG-FI',compression=1)
     
+    def load_chunk(self, key, chunk_coords):
+        chunk_path = self._chunk_path(key,chunk_coords)
+        return imageio.imread(str(chunk_path),format='PNG-FI')
+    
     def write_info(self):
         # Create an output path object for the info file
         op = pathlib.Path(self.base_path).parent.joinpath("{}.dzi".format(self.output_depth))
@@ -586,9 +1126,9 @@ class DeepZoomWriter(PyramidWriter):
     
     def _write_slide(self):
         
-        pathlib.Path(self.base_path).mkdir(exist_ok=False)
+        pathlib.Path(self.base_path).mkdir(exist_ok=self.resume)
         
-        _get_higher_res(0,self,Z=(self.image_depth,self.image_depth+1))
+        self._build_pyramid(0,(self.image_depth,self.image_depth+1))
 
     def _encoder(self):
         
@@ -648,6 +1188,121 @@ class NeuroglancerChunkEncoder(ChunkEncoder):
         buf = chunk.tobytes()
         return buf
     
+class NeuroglancerGzipChunkEncoder(NeuroglancerChunkEncoder):
+
+    def encode(self, chunk):
+        """ Encode a chunk from a Numpy array into gzip compressed bytes.
+        
+        The chunk is encoded as raw bytes and then compressed. Unsharded chunk
+        files must be served with a "Content-Encoding: gzip" header.
+        
+        Inputs:
+            chunk - array with 2 dimensions
+        Outputs:
+            buf - encoded chunk (byte stream)
+        """
+        
+        return gzip.compress(super().encode(chunk),compresslevel=6)
+
+class NeuroglancerCompressedSegmentationChunkEncoder(ChunkEncoder):
+    
+    # Number of bits used to store the block lookup table indices
+    ENCODED_BITS = np.asarray([0,1,2,4,8,16,32])
+    
+    def __init__(self, info):
+        super().__init__(info)
+        
+        if self.dtype not in (np.dtype('<u4'),np.dtype('<u8')):
+            raise KeyError("compressed_segmentation requires data_type uint32 or uint64, found {0}".format(self.dtype))
+        
+        self.block_size = info['scales'][0].get('compressed_segmentation_block_size',[8,8,8])
+    
+    def encode(self, chunk):
+        """ Encode a chunk from a Numpy array into compressed_segmentation bytes.
+        
+        Each block of the chunk is encoded as indices into a table of the
+        unique labels in the block, using the smallest number of bits that
+        can represent the indices. Blocks are encoded together using vectorized
+        operations rather than one block at a time.
+        
+        https://github.com/google/neuroglancer/blob/master/src/neuroglancer/sliceview/compressed_segmentation/README.md
+        
+        Inputs:
+            chunk - array with 2 dimensions
+        Outputs:
+            buf - encoded chunk (byte stream)
+        """
+        
+        # Arrange the chunk as (z,y,x) and pad it to a whole number of blocks
+        chunk = np.asarray(chunk).astype(self.dtype).reshape((1,) + chunk.shape[-2:])
+        bx,by,bz = self.block_size
+        grid = [int(np.ceil(d/b)) for d,b in zip(chunk.shape,(bz,by,bx))]
+        chunk = np.pad(chunk,[(0,g*b - d) for g,b,d in zip(grid,(bz,by,bx),chunk.shape)],mode='edge')
+        
+        # Get the values of each block, with x changing fastest within a block
+        blocks = chunk.reshape(grid[0],bz,grid[1],by,grid[2],bx).transpose(0,2,4,1,3,5).reshape(-1,bz*by*bx)
+        num_blocks,block_values = blocks.shape
+        
+        # Find the index of each value in the sorted unique values of its block
+        block_ids = np.repeat(np.arange(num_blocks),block_values)
+        values = blocks.ravel()
+        order = np.lexsort((values,block_ids))
+        sorted_values = values[order]
+        sorted_blocks = block_ids[order]
+        is_unique = np.ones(values.size,dtype=bool)
+        is_unique[1:] = (sorted_values[1:] != sorted_values[:-1]) | (sorted_blocks[1:] != sorted_blocks[:-1])
+        rank = np.cumsum(is_unique) - 1
+        num_unique = np.bincount(sorted_blocks[is_unique],minlength=num_blocks)
+        first_rank = np.concatenate([[0],np.cumsum(num_unique)[:-1]])
+        indices = np.empty(values.size,dtype=np.uint32)
+        indices[order] = rank - first_rank[sorted_blocks]
+        indices = indices.reshape(num_blocks,block_values)
+        
+        # Number of bits and 32-bit words needed to store the indices of each block
+        bits = self.ENCODED_BITS[np.searchsorted(2**self.ENCODED_BITS,num_unique)]
+        encoded_words = -(-block_values*bits//32)
+        table_words = num_unique * (self.dtype.itemsize//4)
+        
+        # Each block is stored as the encoded values followed by the lookup table
+        block_words = encoded_words + table_words
+        encoded_offset = 2*num_blocks + np.concatenate([[0],np.cumsum(block_words)[:-1]])
+        table_offset = encoded_offset + encoded_words
+        
+        # The first word is the offset to the only channel
+        output = np.zeros(1 + 2*num_blocks + block_words.sum(),dtype='<u4')
+        output[0] = 1
+        data = output[1:]
+        data[0:2*num_blocks:2] = table_offset | (bits << 24)
+        data[1:2*num_blocks:2] = encoded_offset
+        
+        # Pack the indices of blocks that use the same number of bits
+        for b in np.unique(bits[bits > 0]):
+            selected = bits == b
+            packed = indices[selected]
+            packed = np.pad(packed,((0,0),(0,-block_values % (32//b))))
+            packed = packed.reshape(packed.shape[0],-1,32//b) << (np.arange(32//b,dtype=np.uint32)*b)
+            packed = np.bitwise_or.reduce(packed,axis=2)
+            positions = encoded_offset[selected,np.newaxis] + np.arange(packed.shape[1])
+            data[positions] = packed
+        
+        # Write the lookup tables
+        table_values = sorted_values[is_unique]
+        table_positions = table_offset[sorted_blocks[is_unique]] + (rank[is_unique] - first_rank[sorted_blocks[is_unique]])*(self.dtype.itemsize//4)
+        if self.dtype.itemsize == 4:
+            data[table_positions] = table_values
+        else:
+            data[table_positions] = table_values & 0xFFFFFFFF
+            data[table_positions + 1] = table_values >> np.uint64(32)
+        
+        return output.tobytes()
+
+# Chunk encoders for each Neuroglancer encoding
+NEUROGLANCER_ENCODERS = {
+    'raw': NeuroglancerChunkEncoder,
+    'gzip': NeuroglancerGzipChunkEncoder,
+    'compressed_segmentation': NeuroglancerCompressedSegmentationChunkEncoder
+}
+
 class ZarrChunkEncoder(ChunkEncoder):
 
     def encode(self, chunk):
@@ -680,7 +1335,7 @@ class DeepZoomChunkEncoder(ChunkEncoder):
         assert chunk.ndim == 2
         return chunk
 
-def bfio_metadata_to_slide_info(image_path,outPath,stackheight,imagetype,min_scale=0):
+def bfio_metadata_to_slide_info(image_path,outPath,stackheight,imagetype,min_scale=0,encoding='raw'):
     """ Generate a Neuroglancer info file from Bioformats metadata
     
     Neuroglancer requires an info file in the root of the pyramid directory.
@@ -690,6 +1345,7 @@ def bfio_metadata_to_slide_info(image_path,outPath,stackheight,imagetype,min_sca
     Inputs:
         bfio_reader - A BioReader object
         outPath - Path to directory where pyramid will be generated
+        encoding - Neuroglancer chunk encoding, raw and gzip are stored as raw
     Outputs:
         info - A dictionary containing the information in the info file
     """
@@ -719,13 +1375,20 @@ def bfio_metadata_to_slide_info(image_path,outPath,stackheight,imagetype,min_sca
     # create a scales template, use the full resolution8
     scales = {
         "chunk_sizes":[[CHUNK_SIZE,CHUNK_SIZE,1]],
-        "encoding":"raw",
+        "encoding":"raw" if encoding == 'gzip' else encoding,
         "key": str(num_scales),
         "resolution":resolution,
         "size":sizes,
         "voxel_offset":[0,0,0]
     }
     
+    if encoding == 'compressed_segmentation':
+        # Chunks are a single plane, so blocks are a single plane
+        scales["compressed_segmentation_block_size"] = [8,8,1]
+        # compressed_segmentation only supports uint32 and uint64 labels
+        if dtype not in ['uint32','uint64']:
+            dtype = 'uint64' if np.dtype(dtype).itemsize == 8 else 'uint32'
+    
     # initialize the json dictionary
     info = {
         "data_type": dtype,
@@ -5,23 +5,340 @@ from concurrent.futures import ThreadPoolExecutor
 import bfio
 from bfio.OmeXml import OMEXML
 import bfio.base_classes
-import struct, copy, zlib, io, typing, logging, threading
+import struct, zlib, io, typing, logging, threading, os, collections
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
 
 logging.basicConfig(format="%(asctime)s - %(name)-8s - %(levelname)-8s - %(message)s",
                     datefmt="%d-%b-%y %H:%M:%S")
 logger = logging.getLogger("bfio.backends")
 
+CacheInfo = collections.namedtuple("CacheInfo",["hits","misses","max_bytes","current_bytes","tiles"])
+
+class TileCache(object):
+    """Process-wide least recently used cache of decoded tiles
+
+    Decoded tiles are stored using a key that contains the file path, file
+    modification time, page index, and tile index, so that a tile decoded by
+    one BioReader can be reused by any other BioReader that opens the same
+    file. When the total number of bytes in the cache exceeds ``max_bytes``,
+    the least recently used tiles are discarded. Setting ``max_bytes`` to 0
+    disables the cache.
+
+    Cached tiles are read-only numpy arrays.
+    """
+
+    logger = logging.getLogger("bfio.backends.TileCache")
+
+    def __init__(self, max_bytes: int = 2 ** 28):
+        """
+        Args:
+            max_bytes: Maximum number of bytes of decoded tiles to keep in
+                memory. *Defaults to 256MB.*
+        """
+        self._lock = threading.Lock()
+        self._tiles = collections.OrderedDict()
+        self._current_bytes = 0
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        """Maximum number of bytes held by the cache"""
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes: int):
+        assert max_bytes >= 0, "max_bytes must be >= 0"
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key: tuple) -> typing.Union[numpy.ndarray,None]:
+        """Get a decoded tile, returns None if the tile is not cached"""
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: tuple, tile: numpy.ndarray):
+        """Add a decoded tile to the cache"""
+        if tile.nbytes > self._max_bytes:
+            return
+        tile.flags.writeable = False
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return
+            self._tiles[key] = tile
+            self._current_bytes += tile.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._current_bytes > self._max_bytes:
+            _, tile = self._tiles.popitem(last=False)
+            self._current_bytes -= tile.nbytes
+
+    def clear(self):
+        """Remove all tiles from the cache and reset the counters"""
+        with self._lock:
+            self._tiles.clear()
+            self._current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self) -> CacheInfo:
+        """Cache statistics
+
+        Returns:
+            A named tuple containing the number of hits, misses, the maximum
+            and current number of bytes, and the number of cached tiles.
+        """
+        with self._lock:
+            return CacheInfo(self.hits,self.misses,self._max_bytes,
+                             self._current_bytes,len(self._tiles))
+
+# Shared by all PythonReader objects
+tile_cache = TileCache()
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def shared_executor(max_workers: int, name: str = "decode") -> ThreadPoolExecutor:
+    """Get a process-wide thread pool
+
+    Thread pools are created the first time they are requested and reused for
+    the lifetime of the process, so that reading many small regions does not
+    create and destroy a thread pool on every read. Pools are identified by
+    name and number of workers. Tasks running in a pool must not wait on other
+    tasks submitted to the same pool, so nested work should use a different
+    name.
+
+    Args:
+        max_workers: Number of threads in the pool
+        name: Name of the pool. *Defaults to "decode".*
+
+    Returns:
+        A ThreadPoolExecutor
+    """
+    key = (name, max_workers)
+    with _executors_lock:
+        if key not in _executors:
+            logger.debug("shared_executor(): Creating {} pool with {} workers".format(name,max_workers))
+            _executors[key] = ThreadPoolExecutor(max_workers,
+                                                 thread_name_prefix="bfio-{}".format(name))
+        return _executors[key]
+
+class SharedTiffFile(object):
+    """Tiff file handle and parsed metadata shared by PythonReader objects
+
+    Opening a tiff file with tifffile parses the IFDs, and parsing the OME
+    metadata builds an OMEXML object. When the same file is opened many times,
+    these steps take much longer than reading a small region of the image.
+    This class does the work once per file and keeps the results in a
+    process-wide pool, so that readers created with
+    :meth:`~bfio.bfio.BioReader.open_shared` only need to look up the pool.
+
+    The page tables (tile offsets and bytecounts) of every page are parsed when
+    the file is opened. File reads are synchronized using the tifffile
+    filehandle lock, so readers using the same SharedTiffFile can be used from
+    different threads.
+
+    Files are identified by their path and modification time, so a file that
+    is modified is opened again. At most ``max_files`` idle files are kept
+    open.
+    """
+
+    logger = logging.getLogger("bfio.backends.SharedTiffFile")
+
+    max_files = 128
+
+    _pool = collections.OrderedDict()
+    _pool_lock = threading.Lock()
+
+    def __init__(self, file_path: Path, key: tuple):
+
+        self.logger.debug("__init__(): Opening {}...".format(file_path))
+        self.key = key
+        self.rdr = tifffile.TiffFile(file_path)
+        self.rdr.filehandle.lock = True
+        self.metadata = OMEXML(self.rdr.ome_metadata)
+        self.page_map = PythonReader._map_pages(self.metadata)
+
+        # Parse the page tables for all pages
+        self.dataoffsets = []
+        self.databytecounts = []
+        for page in self.rdr.pages:
+            self.dataoffsets.append(numpy.asarray(page.dataoffsets,dtype=numpy.int64))
+            self.databytecounts.append(numpy.asarray(page.databytecounts,dtype=numpy.int64))
+
+        self.mmap = None
+        self._mmap_lock = threading.Lock()
+        self._readers = 0
+        self._pooled = True
+
+    @classmethod
+    def acquire(cls, file_path: typing.Union[str,Path]) -> "SharedTiffFile":
+        """Get the shared file for a path, opening it if needed
+
+        Every call to acquire must be matched by a call to :meth:`release`.
+        """
+        file_path = Path(file_path).resolve()
+        key = (str(file_path),os.stat(file_path).st_mtime_ns)
+
+        with cls._pool_lock:
+            shared = cls._pool.get(key)
+            if shared is None:
+                shared = cls(file_path,key)
+                cls._pool[key] = shared
+            else:
+                cls._pool.move_to_end(key)
+            shared._readers += 1
+
+            # Drop files that were modified or that have been idle the longest
+            for k in [k for k in cls._pool.keys() if k[0] == key[0] and k != key]:
+                cls._pool.pop(k)._unpool()
+            idle = [k for k,v in cls._pool.items() if v._readers == 0]
+            for k in idle[:max(len(cls._pool) - cls.max_files,0)]:
+                cls._pool.pop(k)._unpool()
+
+        return shared
+
+    def release(self):
+        """Release a shared file, closing it if it is no longer pooled"""
+        with self._pool_lock:
+            self._readers -= 1
+            close = self._readers == 0 and not self._pooled
+        if close:
+            self._close()
+
+    def get_mmap(self) -> numpy.memmap:
+        """A numpy.memmap of the file, opened on first use"""
+        with self._mmap_lock:
+            if self.mmap is None:
+                self.mmap = numpy.memmap(self.key[0], dtype=numpy.uint8, mode="r")
+            return self.mmap
+
+    def _unpool(self):
+        # Must be called while holding _pool_lock
+        self._pooled = False
+        if self._readers == 0:
+            self._close()
+
+    def _close(self):
+        self.logger.debug("_close(): Closing {}...".format(self.key[0]))
+        self.mmap = None
+        self.rdr.close()
+
+    @classmethod
+    def clear(cls):
+        """Remove all files from the pool
+
+        Files that are not in use are closed immediately, and all other files
+        are closed when the last reader using them is closed.
+        """
+        with cls._pool_lock:
+            while len(cls._pool) > 0:
+                cls._pool.popitem()[1]._unpool()
+
+def _avg2(image: numpy.ndarray) -> numpy.ndarray:
+    """Average pixels together with optical field 2x2 and stride 2
+
+    Images with odd-valued dimensions are padded by repeating the last row or
+    column, so the edge pixels are the mean of the 2 (or 1) pixels in the
+    image.
+
+    Args:
+        image: numpy array with only two dimensions (m,n)
+
+    Returns:
+        numpy array with only two dimensions (ceil(m/2),ceil(n/2))
+    """
+    image = numpy.pad(image,((0,image.shape[0] % 2),(0,image.shape[1] % 2)),mode="edge")
+
+    # Sum in a larger data type to avoid integer overflow
+    if image.dtype.kind == "u":
+        dtype = numpy.uint64
+    elif image.dtype.kind == "i":
+        dtype = numpy.int64
+    else:
+        dtype = image.dtype
+
+    avg_img = image[0::2,0::2].astype(dtype)
+    avg_img += image[1::2,0::2]
+    avg_img += image[0::2,1::2]
+    avg_img += image[1::2,1::2]
+
+    if image.dtype.kind in "ui":
+        avg_img //= 4
+    else:
+        avg_img /= 4
+
+    return avg_img.astype(image.dtype)
+
+def _mode2(image: numpy.ndarray) -> numpy.ndarray:
+    """Find mode of pixels in optical field 2x2 and stride 2
+
+    The mode is the largest value that occurs at least twice in a 2x2 grid of
+    pixels. If all four values are different, the upper left pixel value is
+    used. Images with odd-valued dimensions are padded by repeating the last
+    row or column.
+
+    Args:
+        image: numpy array with only two dimensions (m,n)
+
+    Returns:
+        numpy array with only two dimensions (ceil(m/2),ceil(n/2))
+    """
+    image = numpy.pad(image,((0,image.shape[0] % 2),(0,image.shape[1] % 2)),mode="edge")
+
+    vals = [image[0::2,0::2],image[0::2,1::2],image[1::2,0::2],image[1::2,1::2]]
+
+    mode_img = vals[0].copy()
+    found = numpy.zeros(mode_img.shape,dtype=bool)
+    for i in range(3):
+        for j in range(i+1,4):
+            index = (vals[i] == vals[j]) & (~found | (vals[i] > mode_img))
+            mode_img[index] = vals[i][index]
+            found |= index
+
+    return mode_img
+
 class PythonReader(bfio.base_classes.AbstractReader):
     
     logger = logging.getLogger("bfio.backends.PythonReader")
     
     _rdr = None
+    _shared = None
 
-    def __init__(self, frontend):
+    # Tiles separated by at most read_gap bytes are read in one read, as long
+    # as the read is at most max_read_size bytes
+    read_gap = 2 ** 16
+    max_read_size = 2 ** 26
+
+    def __init__(self, frontend, shared: bool = False):
         super().__init__(frontend)
 
-        self.logger.debug("__init__(): Initializing _rdr (tifffile.TiffFile)...")
-        self._rdr = tifffile.TiffFile(self.frontend._file_path)
+        if shared:
+            self.logger.debug("__init__(): Acquiring _shared (SharedTiffFile)...")
+            self._shared = SharedTiffFile.acquire(self.frontend._file_path)
+            self._rdr = self._shared.rdr
+            self._metadata = self._shared.metadata
+            self._page_map = self._shared.page_map
+        else:
+            self.logger.debug("__init__(): Initializing _rdr (tifffile.TiffFile)...")
+            self._shared = None
+            self._rdr = tifffile.TiffFile(self.frontend._file_path)
+            self._metadata = OMEXML(self._rdr.ome_metadata)
+            self._page_map = self._map_pages(self._metadata)
         metadata = self.read_metadata()
         width = metadata.image().Pixels.get_SizeX()
         height = metadata.image().Pixels.get_SizeY()
@@ -52,123 +369,353 @@ class PythonReader(bfio.base_classes.AbstractReader):
         self._keyframe = None       # tifffile object with decompression and chunking methods
         self._image = None          # output image buffer used for threaded tile reading
         self._tile_indices = None   # list that maps file chunks to XYZ coordinates
-        
+
+        # Uncompressed tiles do not need to be decoded, so they are copied
+        # directly out of a memory map of the file
+        keyframe = self._rdr.pages[0].keyframe
+        self._mmap = None           # numpy.memmap of the file, opened on first read
+        self._use_mmap = keyframe.is_tiled and \
+                         keyframe.compression == tifffile.TIFF.COMPRESSION.NONE and \
+                         keyframe.predictor == 1 and \
+                         keyframe.fillorder == 1 and \
+                         keyframe.samplesperpixel == 1 and \
+                         keyframe.tiledepth == 1
+        self.logger.debug("__init__(): _use_mmap = {}".format(self._use_mmap))
+
+        try:
+            tifffile.TIFF.DECOMPESSORS[keyframe.compression]
+        except KeyError:
+            raise ValueError("{} uses compression {}, which cannot be decoded. ".format(self.frontend._file_path.name,
+                                                                                       keyframe.compression) +
+                             "Decoding zstd or lzw compressed tiles requires the imagecodecs package.")
+
+        # Prefix of the keys used to store decoded tiles in the tile_cache
+        if shared:
+            self._cache_key = self._shared.key
+        else:
+            file_path = Path(self.frontend._file_path).resolve()
+            self._cache_key = (str(file_path),os.stat(file_path).st_mtime_ns)
+        self._chunk_map = None      # list that maps segments being read to _tile_indices
+        self._page_tables = {}      # numpy arrays of tile offsets and bytecounts for each page
+
     def read_metadata(self):
         self.logger.debug("read_metadata(): Reading metadata...")
-        return OMEXML(self._rdr.ome_metadata)
+        return self._metadata
+
+    @staticmethod
+    def _map_pages(metadata: OMEXML) -> numpy.ndarray:
+        """Map (Z,C,T) plane coordinates to IFD indices
+
+        Planes are stored in the order given by DimensionOrder, unless TiffData
+        elements in the metadata place them in specific IFDs.
+
+        Returns:
+            A numpy array with shape (Z,C,T) containing the IFD of each plane
+        """
+        pixels = metadata.image().Pixels
+        order = "XYZCT" if pixels.DimensionOrder is None else pixels.DimensionOrder
+        size = {d:getattr(pixels,"get_Size{}".format(d))() for d in "ZCT"}
+
+        # Plane dimensions, from slowest to fastest varying
+        dims = order[:1:-1]
+        shape = [size[d] for d in dims]
+        num_planes = int(numpy.prod(shape))
+
+        ifds = numpy.arange(num_planes)
+        for i in range(pixels.tiffdata_count):
+            tiffdata = pixels.tiffdata(i)
+            first = {"Z": tiffdata.FirstZ, "C": tiffdata.FirstC, "T": tiffdata.FirstT}
+            start = int(numpy.ravel_multi_index([first[d] or 0 for d in dims],shape))
+            if tiffdata.plane_count is not None:
+                count = tiffdata.plane_count
+            elif tiffdata.IFD is not None:
+                count = 1
+            else:
+                count = num_planes - start
+            count = min(count,num_planes - start)
+            ifds[start:start+count] = (tiffdata.IFD or 0) + numpy.arange(count)
+
+        return ifds.reshape(shape).transpose([dims.index(d) for d in "ZCT"])
+
+    def _page_table(self,page):
+        if self._shared is not None:
+            return self._shared.dataoffsets[page],self._shared.databytecounts[page]
+        if page not in self._page_tables:
+            p = self._rdr.pages[page]
+            self._page_tables[page] = (numpy.asarray(p.dataoffsets,dtype=numpy.int64),
+                                       numpy.asarray(p.databytecounts,dtype=numpy.int64))
+        return self._page_tables[page]
     
-    def _chunk_indices(self,X,Y,Z):
+    def _chunk_indices(self,X,Y,Z,C,T):
         
-        self.logger.debug("_chunk_indices(): (X,Y,Z) -> ({},{},{})".format(X,Y,Z))
+        self.logger.debug("_chunk_indices(): (X,Y,Z,C,T) -> ({},{},{},{},{})".format(X,Y,Z,C,T))
         assert len(X) == 2
         assert len(Y) == 2
         assert len(Z) == 2
         
-        offsets = []
-        bytecounts = []
-        
         ts = self.frontend._TILE_SIZE
         
-        x_tiles = numpy.arange(X[0]//ts,numpy.ceil(X[1]/ts),dtype=int)
+        x_tiles = numpy.arange(X[0]//ts,numpy.ceil(X[1]/ts),dtype=numpy.int64)
+        y_tiles = numpy.arange(Y[0]//ts,numpy.ceil(Y[1]/ts),dtype=numpy.int64)
         y_tile_stride = numpy.ceil(self.frontend.x/ts).astype(int)
         
         self.logger.debug("_chunk_indices(): x_tiles = {}".format(x_tiles))
         self.logger.debug("_chunk_indices(): y_tile_stride = {}".format(y_tile_stride))
+
+        # Tile indices within a page, ordered by row then column
+        ind = (y_tiles[:,numpy.newaxis] * y_tile_stride + x_tiles[numpy.newaxis,:]).ravel()
         
-        for z in range(Z[0],Z[1]):
-            for y in range(Y[0]//ts,int(numpy.ceil(Y[1]/ts))):
-                y_offset = int(y * y_tile_stride)
-                ind = (x_tiles + y_offset).tolist()
-                
-                o = [self._rdr.pages[z].dataoffsets[i] for i in ind]
-                b = [self._rdr.pages[z].databytecounts[i] for i in ind]
-                
-                self.logger.debug("_chunk_indices(): offsets = {}".format(o))
-                self.logger.debug("_chunk_indices(): bytecounts = {}".format(b))
-                
-                offsets.extend(o)
-                bytecounts.extend(b)
+        # Chunks are ordered to match _tile_indices
+        pages = [int(self._page_map[z,c,t]) for t in T for c in C for z in range(Z[0],Z[1])]
+        tables = [self._page_table(page) for page in pages]
+        offsets = numpy.concatenate([dataoffsets[ind] for dataoffsets,_ in tables])
+        bytecounts = numpy.concatenate([databytecounts[ind] for _,databytecounts in tables])
+        keys = [(page,i) for page in pages for i in ind.tolist()]
         
-        return offsets,bytecounts
-    
+        self.logger.debug("_chunk_indices(): offsets = {}".format(offsets))
+        self.logger.debug("_chunk_indices(): bytecounts = {}".format(bytecounts))
+        
+        return offsets,bytecounts,keys
+
+    def _read_segments(self, fh, offsets, bytecounts):
+        """Read segments from the file, merging nearby segments into one read
+
+        Segments are sorted by their position in the file. Neighboring segments
+        separated by no more than ``read_gap`` bytes are read using a single
+        read, as long as the read is no larger than ``max_read_size`` bytes.
+        This turns many small reads into a few large sequential reads, which is
+        much faster on network file systems.
+
+        Yields the same (segment, index) tuples as
+        ``tifffile.FileHandle.read_segments``, where each segment is a
+        memoryview of the data that was read.
+        """
+
+        offsets = numpy.asarray(offsets,dtype=numpy.int64)
+        bytecounts = numpy.asarray(bytecounts,dtype=numpy.int64)
+
+        # Missing segments
+        valid = (offsets > 0) & (bytecounts > 0)
+        for index in numpy.nonzero(~valid)[0].tolist():
+            yield None, index
+
+        index = numpy.nonzero(valid)[0]
+        if index.size == 0:
+            return
+        index = index[numpy.argsort(offsets[index],kind="stable")]
+        starts = offsets[index]
+        ends = starts + bytecounts[index]
+
+        # Start a new read wherever the gap to the previous segment is too big
+        gaps = starts[1:] - numpy.maximum.accumulate(ends)[:-1]
+        breaks = (numpy.nonzero(gaps > self.read_gap)[0] + 1).tolist()
+
+        first = 0
+        for last in breaks + [index.size]:
+            while first < last:
+
+                # Limit the size of a single read
+                stop = first + 1
+                while stop < last and ends[stop] - starts[first] <= self.max_read_size:
+                    stop += 1
+                read_start = int(starts[first])
+                read_end = int(ends[first:stop].max())
+
+                with fh.lock:
+                    fh.seek(read_start)
+                    data = memoryview(fh.read(read_end - read_start))
+
+                for i in range(first,stop):
+                    yield data[starts[i] - read_start:ends[i] - read_start], int(index[i])
+
+                first = stop
+
     def _process_chunk(self, args):
         
         keyframe = self._keyframe
         out = self._image
         
-        w,l,d,_,_ = self._tile_indices[args[1]]
+        index = self._chunk_map[args[1]]
+        w,l,d,c,t = self._tile_indices[index]
         
         # copy decoded segments to output array
         segment, _, shape = keyframe.decode(*args)
         
         if segment is None:
             segment = keyframe.nodata
+        else:
+            segment = segment.squeeze()
+            if tile_cache.max_bytes > 0:
+                tile_cache.put(self._cache_key + self._chunk_keys[index],segment)
             
         self.logger.debug("_process_chunk(): shape = {}".format(shape))
         self.logger.debug("_process_chunk(): (w,l,d) = {},{},{}".format(w[0],l[0],d[0]))
         
         out[l[0]: l[0] + shape[1],
             w[0]: w[0] + shape[2],
-            d[0],0,0] = segment.squeeze()
-        
+            d[0],c[0],t[0]] = segment
+
+    def _read_cached(self, offsets, bytecounts):
+
+        out = self._image
+
+        # copy cached tiles to the output array, return the tiles to decode
+        missing = []
+        for index,key in enumerate(self._chunk_keys):
+            segment = tile_cache.get(self._cache_key + key)
+
+            if segment is None:
+                missing.append(index)
+                continue
+
+            w,l,d,c,t = self._tile_indices[index]
+            out[l[0]: l[0] + segment.shape[0],
+                w[0]: w[0] + segment.shape[1],
+                d[0],c[0],t[0]] = segment
+
+        self.logger.debug("_read_cached(): {} of {} tiles cached".format(len(offsets) - len(missing),len(offsets)))
+
+        self._chunk_map = missing
+
+        return offsets[missing],bytecounts[missing]
+
+    def _process_mmap_chunk(self, args):
+
+        keyframe = self._keyframe
+        out = self._image
+
+        index, offset, bytecount = args
+        w,l,d,c,t = self._tile_indices[index]
+
+        # Missing tiles are left as zeros
+        if bytecount == 0:
+            return
+
+        # Create a view of the tile in the memory map, no data is read until
+        # the view is copied into the output
+        segment = numpy.ndarray(shape=(keyframe.tilelength,keyframe.tilewidth),
+                                dtype=self._mmap_dtype,
+                                buffer=self._mmap,
+                                offset=offset)
+
+        height = min(keyframe.tilelength, out.shape[0] - l[0])
+        width = min(keyframe.tilewidth, out.shape[1] - w[0])
+
+        out[l[0]: l[0] + height,
+            w[0]: w[0] + width,
+            d[0],c[0],t[0]] = segment[:height,:width]
+
+    def _read_mmap(self, offsets, bytecounts):
+
+        if self._mmap is None:
+            self.logger.debug("_read_mmap(): Opening memory map...")
+            if self._shared is not None:
+                self._mmap = self._shared.get_mmap()
+            else:
+                self._mmap = numpy.memmap(self.frontend._file_path, dtype=numpy.uint8, mode="r")
+            self._mmap_dtype = numpy.dtype(self._keyframe.dtype).newbyteorder(self._rdr.byteorder)
+
+        chunks = zip(range(len(offsets)),offsets,bytecounts)
+
+        if self.frontend.max_workers > 1:
+            executor = shared_executor(self.frontend.max_workers)
+            list(executor.map(self._process_mmap_chunk,chunks))
+        else:
+            for args in chunks:
+                self._process_mmap_chunk(args)
+
     def _read_image(self,X,Y,Z,C,T,output):
-        if (len(C)>1 and C[0]!=0) or (len(T)>0 and T[0]!=0):
-            raise Warning("More than channel 0 was specified for either channel or timepoint data." + \
-                          "For the Python backend, only the first channel/timepoint will be loaded.")
-        
+
         # Get keyframe and filehandle objects
         self._keyframe = self._rdr.pages[0].keyframe
         fh = self._rdr.pages[0].parent.filehandle
 
         # Get binary data info
-        offsets,bytecounts = self._chunk_indices(X,Y,Z)
-        
+        offsets,bytecounts,self._chunk_keys = self._chunk_indices(X,Y,Z,C,T)
+        self._chunk_map = list(range(len(offsets)))
+
         self.logger.debug("read_image(): _tile_indices = {}".format(self._tile_indices))
+
+        if self._use_mmap:
+            self._read_mmap(offsets,bytecounts)
+            return
         
+        # Only decode tiles that are not in the tile cache
+        if tile_cache.max_bytes > 0:
+            offsets,bytecounts = self._read_cached(offsets,bytecounts)
+
         if self.frontend.max_workers > 1:
-            with ThreadPoolExecutor(self.frontend.max_workers) as executor:
-                executor.map(self._process_chunk,fh.read_segments(offsets,bytecounts))
+            executor = shared_executor(self.frontend.max_workers)
+            list(executor.map(self._process_chunk,self._read_segments(fh,offsets,bytecounts)))
         else:
-            for args in fh.read_segments(offsets,bytecounts):
+            for args in self._read_segments(fh,offsets,bytecounts):
                 self._process_chunk(args)
 
     def close(self):
-        self._rdr.close()
+        self._mmap = None
+        if self._shared is not None:
+            self._shared.release()
+            self._shared = None
+        elif self._rdr is not None:
+            self._rdr.close()
+        self._rdr = None
 
 class PythonWriter(bfio.base_classes.AbstractWriter):
     _page_open = False
     _current_page = None
+    _executor = None
+    _levels = []
     
     logger = logging.getLogger("bfio.backends.PythonWriter")
+
+    # Supported compression methods: (tiff compression tag, default level)
+    _COMPRESSION = {"none": (tifffile.TIFF.COMPRESSION.NONE, None),
+                    "deflate": (tifffile.TIFF.COMPRESSION.ADOBE_DEFLATE, 1),
+                    "zlib": (tifffile.TIFF.COMPRESSION.ADOBE_DEFLATE, 1),
+                    "lzw": (tifffile.TIFF.COMPRESSION.LZW, None),
+                    "zstd": (tifffile.TIFF.COMPRESSION.ZSTD, 1)}
+
+    # Methods used to downsample pyramid levels
+    _REDUCTION = {"mean": _avg2,
+                  "mode": _mode2}
     
     def __init__(self, frontend):
         super().__init__(frontend)
-        
-        if self.frontend.C > 1:
-            self.logger.warning("The BioWriter only writes single channel " +
-                                "images, but the metadata has {} channels. ".format(self.frontend.C) +
-                                "Setting the number of channels to 1 " +
-                                "and discarding extra channels.")
-            self.frontend.C = 1
-        if self.frontend.T > 1:
-            self.logger.warning("The BioWriter only writes single timepoint " +
-                                "images, but the metadata has {} timepoints. ".format(self.frontend.T) +
-                                "Setting the number of timepoints to 1." +
-                                "and discarding extra timepoints.")
-            self.frontend.T = 1
 
+        compression = "deflate" if self.frontend._compression is None else self.frontend._compression.lower()
+        if compression not in self._COMPRESSION:
+            raise ValueError("compression must be one of {}, but found {}.".format(list(self._COMPRESSION.keys()),
+                                                                                   self.frontend._compression))
+        if compression in ["lzw","zstd"] and \
+            (imagecodecs is None or not hasattr(imagecodecs,"{}_encode".format(compression))):
+            raise ImportError("{} compression requires the imagecodecs package ".format(compression) +
+                              "with {} support.".format(compression))
+        self._compresstag, self._compresslevel = self._COMPRESSION[compression]
+        if self.frontend._compression_level is not None:
+            self._compresslevel = self.frontend._compression_level
+        self.logger.debug("__init__(): compression = {}, level = {}".format(compression,self._compresslevel))
+
+        if self.frontend._pyramid_reduction not in self._REDUCTION:
+            raise ValueError("pyramid_reduction must be one of {}, but found {}.".format(list(self._REDUCTION.keys()),
+                                                                                         self.frontend._pyramid_reduction))
+        if self.frontend._pyramid_levels < 0:
+            raise ValueError("pyramid_levels must be greater than or equal to 0.")
+        self._reducer = self._REDUCTION[self.frontend._pyramid_reduction]
+        
     def _pack(self, fmt, *val):
         return struct.pack(self._byteorder + fmt, *val)
     
-    def _addtag(self,code, dtype, count, value, writeonce=False):
-        tags = self._tags
+    def _addtag(self,code, dtype, count, value, writeonce=False, tags=None, tifftype=None):
+        if tags is None:
+            tags = self._tags
         
         # compute ifdentry & ifdvalue bytes from code, dtype, count, value
         # append (code, ifdentry, ifdvalue, writeonce) to tags list
         if not isinstance(code, int):
             code = tifffile.TIFF.TAGS[code]
         try:
-            tifftype = tifffile.TIFF.DATA_DTYPES[dtype]
+            if tifftype is None:
+                tifftype = tifffile.TIFF.DATA_DTYPES[dtype]
         except KeyError as exc:
             raise ValueError(f"unknown dtype {dtype}") from exc
         rawcount = count
@@ -241,6 +788,10 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
 
         self._writer = tifffile.TiffWriter(self.frontend._file_path, bigtiff=True, append=False)
 
+        # Thread pool used to compress tiles, reused for every write
+        if self.frontend.max_workers > 1:
+            self._executor = ThreadPoolExecutor(self.frontend.max_workers)
+
         self._byteorder = self._writer._byteorder
 
         self._datashape = (1, 1, 1) + (self.frontend.Y, self.frontend.X) + (1,)
@@ -253,9 +804,6 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
         offsetsize = self._writer._offsetsize
         tagsize = self._writer._tagsize
 
-        # self._compresstag = tifffile.TIFF.COMPRESSION.NONE
-        self._compresstag = tifffile.TIFF.COMPRESSION.ADOBE_DEFLATE
-
         # normalize data shape to 5D or 6D, depending on volume:
         #   (pages, planar_samples, height, width, contig_samples)
         self._samplesperpixel = 1
@@ -341,6 +889,12 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
         self._addtag(self._tagoffsets, self._writer._offsetformat, self._numtiles, [0] * self._numtiles)
         self._bytecountformat = self._bytecountformat * self._numtiles
 
+        # Reduced resolution images are stored in SubIFDs of each page
+        self._init_pyramid()
+        if len(self._levels) > 0:
+            self._addtag(330, self._writer._offsetformat, len(self._levels), [0] * len(self._levels),
+                         tifftype=18 if self._writer._offsetsize == 8 else 13)  # SubIFDs
+
         # the entries in an IFD must be sorted in ascending order by tag code
         self._tags = sorted(self._tags, key=lambda x: x[0])
 
@@ -410,6 +964,8 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
                         self._dataoffsetsoffset = offset, pos
                     elif code == tagbytecounts:
                         self._databytecountsoffset = offset, pos
+                    elif code == 330:
+                        self._subifdsoffset = offset, pos
                     elif code == 270 and value.endswith(b"\0\0\0\0"):
                         # image description buffer
                         self._descriptionoffset = self._ifdpos + pos
@@ -419,6 +975,8 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
                     self._dataoffsetsoffset = offset, None
                 elif code == tagbytecounts:
                     self._databytecountsoffset = offset, None
+                elif code == 330:
+                    self._subifdsoffset = offset, None
             self._ifdsize = self._ifd.tell()
             if self._ifdsize % 2:
                 self._ifd.write(b"\0")
@@ -427,6 +985,12 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
         self._databytecounts = [0 for _ in self._databytecounts]
         self._databyteoffsets = [0 for _ in self._databytecounts]
 
+        for level in self._levels:
+            level["pending"] = {}
+            level["filled"] = collections.Counter()
+            level["offsets"] = [0] * level["tiles"][0] * level["tiles"][1]
+            level["bytecounts"] = [0] * level["tiles"][0] * level["tiles"][1]
+
         # move to file position where data writing will begin
         # will write the tags later when the tile offsets are known
         fh.seek(self._ifdsize, 1)
@@ -465,6 +1029,16 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
             self._ifd.seek(pos)
         self._ifd.write(self._pack(bytecountformat, *self._databytecounts))
 
+        # write the reduced resolution images and point to them from the page
+        if len(self._levels) > 0:
+            subifds = self._close_pyramid()
+            offset, pos = self._subifdsoffset
+            self._ifd.seek(offset)
+            if pos != None:
+                self._ifd.write(self._pack(offsetformat, self._ifdpos + pos))
+                self._ifd.seek(pos)
+            self._ifd.write(self._pack(str(len(subifds)) + offsetformat, *subifds))
+
         self._fhpos = fh.tell()
         fh.seek(self._ifdpos)
         fh.write(self._ifd.getvalue())
@@ -479,6 +1053,37 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
 
         self._page_open = False
 
+    def _compress(self, data):
+        if self._compresstag == tifffile.TIFF.COMPRESSION.NONE:
+            return memoryview(data).cast("B")
+        elif self._compresstag == tifffile.TIFF.COMPRESSION.LZW:
+            return imagecodecs.lzw_encode(data)
+        elif self._compresstag == tifffile.TIFF.COMPRESSION.ZSTD:
+            return imagecodecs.zstd_encode(data, level=self._compresslevel)
+
+        data = memoryview(data)
+        cpr = zlib.compressobj(self._compresslevel,
+                               memLevel=9,
+                               wbits=15)
+        output = b"".join([cpr.compress(data), cpr.flush()])
+        return output
+
+    def _compress_tile(self, data, y, x):
+
+        ts = self.frontend._TILE_SIZE
+
+        # Tiles are compressed from a view of the input, and only copied to
+        # make the tile contiguous or to pad tiles on the edge of the image
+        tile = data[y:y + ts, x:x + ts]
+        if tile.shape != (ts, ts):
+            chunk = numpy.zeros((ts, ts), dtype=self._datadtype)
+            chunk[:tile.shape[0], :tile.shape[1]] = tile
+            tile = chunk
+        else:
+            tile = numpy.ascontiguousarray(tile, dtype=self._datadtype)
+
+        return self._compress(tile)
+
     def _write_tiles(self, data, X, Y):
 
         assert len(X) == 2 and len(Y) == 2
@@ -487,55 +1092,198 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
             logger.warning("X or Y positions are not on tile boundary, tile may save incorrectly")
 
         fh = self._writer._fh
+        ts = self.frontend._TILE_SIZE
 
-        x_tiles = list(range(X[0] // self.frontend._TILE_SIZE, 1 + (X[1] - 1) // self.frontend._TILE_SIZE))
+        # (file tile index, row, column) of each tile in the data
         tiles = []
-        for y in range(Y[0] // self.frontend._TILE_SIZE, 1 + (Y[1] - 1) // self.frontend._TILE_SIZE):
-            tiles.extend([y * self._tiles[1] + x for x in x_tiles])
+        for y in range(0, Y[1] - Y[0], ts):
+            for x in range(0, X[1] - X[0], ts):
+                tiles.append(((Y[0] + y) // ts * self._tiles[1] + (X[0] + x) // ts, y, x))
+
+        def write(tileindex, t):
+            self._databyteoffsets[tileindex] = fh.tell()
+            fh.write(t)
+            self._databytecounts[tileindex] = len(t)
+
+        if self._executor is not None:
+
+            # Tiles are written in order as they finish compressing, with a
+            # limited number of compressed tiles held in memory at once
+            max_pending = 2 * self.frontend.max_workers
+            pending = collections.deque()
+            for tileindex, y, x in tiles:
+                if len(pending) >= max_pending:
+                    t = pending.popleft()
+                    write(t[0], t[1].result())
+                pending.append((tileindex, self._executor.submit(self._compress_tile, data, y, x)))
+
+            while len(pending) > 0:
+                t = pending.popleft()
+                write(t[0], t[1].result())
 
-        tile_shape = ((Y[1] - Y[0] - 1 + self.frontend._TILE_SIZE) // self.frontend._TILE_SIZE,
-                        (X[1] - X[0] - 1 + self.frontend._TILE_SIZE) // self.frontend._TILE_SIZE)
+        else:
+            for tileindex, y, x in tiles:
+                write(tileindex, self._compress_tile(data, y, x))
 
-        data = data.reshape(1, 1, 1, data.shape[0], data.shape[1], 1)
-        tileiter = tifffile.iter_tiles(data,
-                                        (self.frontend._TILE_SIZE, self.frontend._TILE_SIZE), tile_shape)
+        if len(self._levels) > 0:
+            self._reduce(data, X[0], Y[0], 0)
 
-        # define compress function
-        compressor = tifffile.TIFF.COMPESSORS[self._compresstag]
+        return None
 
-        def compress(data, level=1):
-            data = memoryview(data)
-            cpr = zlib.compressobj(level,
-                                    memLevel=9,
-                                    wbits=15)
-            output = b"".join([cpr.compress(data), cpr.flush()])
-            return output
+    def _init_pyramid(self):
 
-        offsetformat = self._writer._offsetformat
-        tagnoformat = self._writer._tagnoformat
+        ts = self.frontend._TILE_SIZE
 
+        # Each level is half the size of the level above it
+        self._levels = []
+        Y, X = self.frontend.Y, self.frontend.X
+        for _ in range(self.frontend._pyramid_levels):
+            Y, X = (Y + 1) // 2, (X + 1) // 2
+            self._levels.append({"shape": (Y, X),
+                                 "tiles": ((Y + ts - 1) // ts, (X + ts - 1) // ts)})
 
-        tileiter = [copy.deepcopy(tile) for tile in tileiter]
-        if self.frontend.max_workers > 1:
-            
-            with ThreadPoolExecutor(max_workers=self.frontend.max_workers) as executor:
-                
-                compressed_tiles = iter(executor.map(compress, tileiter))
-        
-            for tileindex in tiles:
-                t = next(compressed_tiles)
-                self._databyteoffsets[tileindex] = fh.tell()
-                fh.write(t)
-                self._databytecounts[tileindex] = len(t)
+        self.logger.debug("_init_pyramid(): levels = {}".format([l["shape"] for l in self._levels]))
+
+    def _reduce(self, data, X, Y, level):
+        """Downsample data into a pyramid level
+
+        Reduced tiles are held in memory until all pixels in the tile have
+        been written, then the tile is written to the file and downsampled
+        into the next pyramid level.
+
+        Args:
+            data: Image data from the level above, starting at pixel (Y,X)
+            X: Starting column of the data in the level above
+            Y: Starting row of the data in the level above
+            level: Index of the pyramid level to write to
+        """
+
+        ts = self.frontend._TILE_SIZE
+        lvl = self._levels[level]
+        reduced = self._reducer(data)
+        y0, x0 = Y // 2, X // 2
+        y1 = min(y0 + reduced.shape[0], lvl["shape"][0])
+        x1 = min(x0 + reduced.shape[1], lvl["shape"][1])
+
+        complete = []
+        for ty in range(y0 // ts, (y1 - 1) // ts + 1):
+            for tx in range(x0 // ts, (x1 - 1) // ts + 1):
+                tileindex = ty * lvl["tiles"][1] + tx
+                if tileindex not in lvl["pending"]:
+                    lvl["pending"][tileindex] = numpy.zeros((ts, ts), dtype=data.dtype)
+                tile = lvl["pending"][tileindex]
+
+                # Copy the overlapping region into the tile
+                ys, ye = max(y0, ty * ts), min(y1, (ty + 1) * ts)
+                xs, xe = max(x0, tx * ts), min(x1, (tx + 1) * ts)
+                tile[ys - ty * ts:ye - ty * ts, xs - tx * ts:xe - tx * ts] = reduced[ys - y0:ye - y0, xs - x0:xe - x0]
+                lvl["filled"][tileindex] += (ye - ys) * (xe - xs)
+
+                # Write the tile once every pixel in the image has been filled
+                height = min(ts, lvl["shape"][0] - ty * ts)
+                width = min(ts, lvl["shape"][1] - tx * ts)
+                if lvl["filled"][tileindex] >= height * width:
+                    del lvl["filled"][tileindex]
+                    complete.append((tileindex, ty, tx, lvl["pending"].pop(tileindex)))
+
+        self._write_level_tiles(complete, level)
+
+    def _write_level_tiles(self, tiles, level):
+
+        fh = self._writer._fh
+        ts = self.frontend._TILE_SIZE
+        lvl = self._levels[level]
+
+        def compress(tile):
+            return self._compress_tile(tile[3], 0, 0)
+
+        if self._executor is not None:
+            compressed = self._executor.map(compress, tiles)
         else:
-            for tileindex, tile in zip(tiles,tileiter):
-                
-                t = compress(tile)
-                self._databyteoffsets[tileindex] = fh.tell()
-                fh.write(t)
-                self._databytecounts[tileindex] = len(t)
-                
-        return None
+            compressed = map(compress, tiles)
+
+        for tile, data in zip(tiles, compressed):
+            lvl["offsets"][tile[0]] = fh.tell()
+            fh.write(data)
+            lvl["bytecounts"][tile[0]] = len(data)
+
+        # Downsample into the next level
+        if level + 1 < len(self._levels):
+            for tileindex, ty, tx, tile in tiles:
+                height = min(ts, lvl["shape"][0] - ty * ts)
+                width = min(ts, lvl["shape"][1] - tx * ts)
+                self._reduce(tile[:height, :width], tx * ts, ty * ts, level + 1)
+
+    def _close_pyramid(self):
+
+        ts = self.frontend._TILE_SIZE
+
+        # Write partially filled tiles, which happens when part of a plane
+        # was not written
+        for level, lvl in enumerate(self._levels):
+            tiles = sorted(lvl["pending"].items())
+            lvl["pending"] = {}
+            lvl["filled"] = collections.Counter()
+            self._write_level_tiles([(i, i // lvl["tiles"][1], i % lvl["tiles"][1], t) for i, t in tiles], level)
+
+        # Write one IFD for each level
+        sampleformat = {"u": 1, "i": 2, "f": 3, "c": 6}[self._datadtype.kind]
+        subifds = []
+        for lvl in self._levels:
+            tags = []
+            self._addtag(254, "I", 1, 1, tags=tags)  # NewSubfileType = reduced resolution
+            self._addtag(256, "I", 1, lvl["shape"][1], tags=tags)  # ImageWidth
+            self._addtag(257, "I", 1, lvl["shape"][0], tags=tags)  # ImageLength
+            self._addtag(258, "H", 1, self._bitspersample, tags=tags)
+            self._addtag(259, "H", 1, self._compresstag, tags=tags)  # Compression
+            self._addtag(262, "H", 1, tifffile.TIFF.PHOTOMETRIC.MINISBLACK.value, tags=tags)
+            self._addtag(277, "H", 1, self._samplesperpixel, tags=tags)
+            self._addtag(322, "I", 1, ts, tags=tags)  # TileWidth
+            self._addtag(323, "I", 1, ts, tags=tags)  # TileLength
+            self._addtag(self._tagoffsets, self._writer._offsetformat, len(lvl["offsets"]), lvl["offsets"], tags=tags)
+            self._addtag(self._tagbytecounts, self._writer._offsetformat, len(lvl["bytecounts"]), lvl["bytecounts"], tags=tags)
+            self._addtag(339, "H", 1, sampleformat, tags=tags)
+            subifds.append(self._write_ifd(tags))
+
+        return subifds
+
+    def _write_ifd(self, tags):
+        """Write an IFD with known tag values at the current file position
+
+        Returns:
+            The position of the IFD in the file
+        """
+
+        fh = self._writer._fh
+        offsetformat = self._writer._offsetformat
+        offsetsize = self._writer._offsetsize
+        tagsize = self._writer._tagsize
+        tags = sorted(tags, key=lambda x: x[0])
+
+        ifdpos = fh.tell()
+        if ifdpos % 2:
+            fh.write(b"\0")
+            ifdpos += 1
+
+        ifd = io.BytesIO()
+        ifd.write(self._pack(self._writer._tagnoformat, len(tags)))
+        tagoffset = ifd.tell()
+        ifd.write(b"".join(t[1] for t in tags))
+        ifd.write(self._pack(offsetformat, 0))  # offset to next IFD
+        for tagindex, tag in enumerate(tags):
+            if tag[2]:
+                pos = ifd.tell()
+                if pos % 2:
+                    ifd.write(b"\0")
+                    pos += 1
+                ifd.seek(tagoffset + tagindex * tagsize + offsetsize + 4)
+                ifd.write(self._pack(offsetformat, ifdpos + pos))
+                ifd.seek(pos)
+                ifd.write(tag[2])
+
+        fh.write(ifd.getvalue())
+
+        return ifdpos
 
     def close(self):
         """close_image Close the image
@@ -544,24 +1292,44 @@ class PythonWriter(bfio.base_classes.AbstractWriter):
         to. This allows for proper closing and organization of metadata.
         """
         if self._writer != None:
+            # Add empty pages for any planes that were not written
+            num_pages = self.frontend.Z * self.frontend.C * self.frontend.T
+            while self._current_page < num_pages - 1:
+                if self._page_open:
+                    self._close_page()
+                self._open_next_page()
             if self._page_open:
                 self._close_page()
             self._ifd.close()
             self._writer._fh.close()
+        if self._executor != None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _page_index(self,z,c,t):
+        # Pages are stored in XYZCT order
+        return z + self.frontend.Z * (c + self.frontend.C * t)
 
     def _write_image(self,X,Y,Z,C,T,image):
 
-        if self._current_page != None and Z[0] < self._current_page:
-            raise ValueError("Cannot write z layers below the current open page. (current page={},Z[0]={})".format(
-                self._current_page, Z[0]))
+        pages = []
+        for ti, t in enumerate(T):
+            for ci, c in enumerate(C):
+                for zi, z in enumerate(range(Z[0], Z[1])):
+                    pages.append((self._page_index(z,c,t),zi,ci,ti))
+        pages.sort()
+
+        if self._current_page != None and pages[0][0] < self._current_page:
+            raise ValueError("Cannot write planes below the current open page. (current page={},page={})".format(
+                self._current_page, pages[0][0]))
 
         # Do the work
-        for zi, z in zip(range(0, Z[1] - Z[0]), range(Z[0], Z[1])):
-            while z != self._current_page:
+        for page, zi, ci, ti in pages:
+            while page != self._current_page:
                 if self._page_open:
                     self._close_page()
                 self._open_next_page()
-            self._write_tiles(image[..., zi, 0, 0], X, Y)
+            self._write_tiles(image[..., zi, ci, ti], X, Y)
 
 try:
     import bioformats
@@ -654,9 +1422,25 @@ try:
         
         # For Bioformats, the first tile has to be written before any other tile
         first_tile = False
+
+        # Bioformats names of the supported compression methods
+        _COMPRESSION = {"none": "Uncompressed",
+                        "deflate": "zlib",
+                        "zlib": "zlib",
+                        "lzw": "LZW"}
         
         def __init__(self, frontend):
             super().__init__(frontend)
+
+            compression = "lzw" if self.frontend._compression is None else self.frontend._compression.lower()
+            if compression not in self._COMPRESSION:
+                raise ValueError("compression must be one of {} when using the java backend, ".format(list(self._COMPRESSION.keys())) +
+                                 "but found {}.".format(self.frontend._compression))
+            if self.frontend._compression_level is not None:
+                self.logger.warning("The java backend does not support setting the compression level.")
+            if self.frontend._pyramid_levels > 0:
+                raise ValueError("The java backend does not support writing pyramid levels.")
+            self._compression = self._COMPRESSION[compression]
             
             # Test to see if the loci_tools.jar is present
             if bfio.JARS == None:
@@ -720,7 +1504,7 @@ try:
                                        writer=writer))
             writer.setId(str(self.frontend._file_path))
             writer.setInterleaved(False)
-            writer.setCompression("LZW")
+            writer.setCompression(self._compression)
             x = writer.setTileSizeX(self.frontend._TILE_SIZE)
             y = writer.setTileSizeY(self.frontend._TILE_SIZE)
 
@@ -214,12 +214,16 @@ class BioBase(object,metaclass=abc.ABCMeta) :
         setattr(self._metadata.image(0).Pixels,"Size{}".format(dimension.upper()),value)
         if dimension.upper() == "C":
             self._metadata.image(0).Pixels.channel_count = value
+        self._set_tiffdata()
+
+    def _set_tiffdata(self):
+        # One TiffData per plane, with planes stored in XYZCT order
         self._metadata.image().Pixels.tiffdata_count = self.Z * self.C * self.T
         
         count = 0
-        for z in range(self.Z):
+        for t in range(self.T):
             for c in range(self.C):
-                for t in range(self.T):
+                for z in range(self.Z):
                     self._metadata.image().Pixels.tiffdata(count).FirstZ = z
                     self._metadata.image().Pixels.tiffdata(count).FirstC = c
                     self._metadata.image().Pixels.tiffdata(count).FirstT = t
@@ -591,7 +595,15 @@ class AbstractBackend(object,metaclass=abc.ABCMeta):
                                                        (t,T[t])))
         
         self.logger.debug("_image_io(): _tile_indices = {}".format(self._tile_indices))
-        
+
+    def attach(self):
+        """Attach the current thread to the backend, if required"""
+        pass
+
+    def detach(self):
+        """Detach the current thread from the backend, if required"""
+        pass
+
     @abc.abstractmethod
     def close(self):
         pass
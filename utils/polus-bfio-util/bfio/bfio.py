@@ -1,4 +1,4 @@
-import typing, numpy, struct, logging
+import typing, numpy, struct, logging, asyncio, functools
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from bfio import backends, OmeXml
@@ -33,6 +33,9 @@ class BioReader(BioBase):
     
     logger = logging.getLogger("bfio.bfio.BioReader")
 
+    # Number of threads shared by all asyncio reads (aread and async for)
+    async_workers = 32
+
     def __init__(self,
                  file_path: typing.Union[str,Path],
                  max_workers: typing.Union[int,None] = None,
@@ -60,7 +63,52 @@ class BioReader(BioBase):
         
         # Preload the metadata
         self._metadata = self._backend.read_metadata()
-                           
+
+    @classmethod
+    def open_shared(cls,
+                    file_path: typing.Union[str,Path],
+                    max_workers: typing.Union[int,None] = None) -> "BioReader":
+        """Open a lightweight reader that shares the parsed file
+
+        Creating a BioReader opens the file, parses all of the IFDs, and parses
+        the OME metadata. For small reads, this can take longer than reading
+        the pixels. Readers created with this method share one open file, page
+        table, and metadata object per file path, so that only the first
+        reader for a file does this work. The python backend is always used.
+
+        Readers returned by this method are independent objects and can be
+        used from different threads. The shared metadata should not be
+        modified.
+
+        Args:
+            file_path: Path to file to read
+            max_workers: Number of threads used to read and image. *Default is
+                half the number of detected cores.*
+
+        Returns:
+            A BioReader using the python backend
+
+        Example:
+
+            .. code-block:: python
+
+                import bfio
+
+                # Only the first reader parses the file
+                for x in range(0,10240,1024):
+                    with bfio.BioReader.open_shared("Path/To/File.ome.tif") as br:
+                        tile = br[:1024,x:x+1024,0,0,0]
+        """
+
+        reader = cls.__new__(cls)
+        super(BioReader, reader).__init__(file_path,
+                                          max_workers=max_workers,
+                                          backend="python")
+        reader._backend = backends.PythonReader(reader,shared=True)
+        reader._metadata = reader._backend.read_metadata()
+
+        return reader
+
     def __getitem__(self,keys: typing.Union[tuple,slice]) -> numpy.ndarray:
         """Image loading using numpy-like indexing
         
@@ -171,194 +219,127 @@ class BioReader(BioBase):
 
         return output[Y[0]-Y_tile_start:Y[1]-Y_tile_start,X[0]-X_tile_start:X[1]-X_tile_start,...]
 
-    def _fetch(self) -> numpy.ndarray:
-        """Method for fetching image supertiles
-        
-        This method is intended to be run within a thread, and grabs a chunk of
-        the image according to the coordinates in a queue.
-
-        Currently, this function will only grab the first Z, C, and T positions
-        regardless of what Z, C, and T coordinate are provided to the function.
-        This function will need to be changed in then future to account for
-        this.
-
-        If the first value in X or Y is negative, then the image is pre-padded
-        with the number of pixels equal to the absolute value of the negative
-        number.
-
-        If the last value in X or Y is larger than the size of the image, then
-        the image is post-padded with the difference between the number and the
-        size of the image. Input coordinate are read from the _supertile_index
-        Queue object. Output data is stored in the _raw_buffer Queue object.
-
-        As soon as the method is executed, a boolean value is put into the
-        _data_in_buffer Queue to indicate that data is either in the buffer or
-        will be put into the buffer.
-        
-        Returns:
-            An image supertile
-        """
+    async def aread(self,
+                    X: typing.Union[list,tuple,None] = None,
+                    Y: typing.Union[list,tuple,None] = None,
+                    Z: typing.Union[list,tuple,None] = None,
+                    C: typing.Union[list,tuple,None] = None,
+                    T: typing.Union[list,tuple,None] = None) -> numpy.ndarray:
+        """Read the image without blocking the event loop
+
+        This is the asyncio version of :meth:`read`. The read is run in a
+        process-wide thread pool with :attr:`async_workers` threads, so many
+        regions can be requested concurrently without creating a thread pool
+        for each request. Reads from the same BioReader are still performed
+        one at a time, so to serve concurrent requests from one file open a
+        BioReader for each request with :meth:`open_shared`.
 
-        self._data_in_buffer.put(True)
-        X, Y, Z, C, T = self._supertile_index.get()
+        Example:
+            .. code:: python
 
-        # Attach the jvm to the thread if present
-        self._backend.attach()
+                import asyncio
+                from bfio import BioReader
 
-        # Determine padding if needed
-        reflect_x = False
-        x_min = X[0]
-        x_max = X[1]
-        y_min = Y[0]
-        y_max = Y[1]
-        prepad_x = 0
-        postpad_x = 0
-        prepad_y = 0
-        postpad_y = 0
-        if x_min < 0:
-            prepad_x = abs(x_min)
-            x_min = 0
-        if y_min < 0:
-            prepad_y = abs(y_min)
-            y_min = 0
-        if x_max > self.num_x():
-            if x_min >= self.num_x():
-                x_min = self._TILE_SIZE * ((self.num_x() - 1) // self._TILE_SIZE)
-                reflect_x = True
-            x_max = self.num_x()
-            postpad_x = x_max - self.num_x()
-        if y_max > self.num_y():
-            y_max = self.num_y()
-            postpad_y = y_max - self.num_y()
+                async def main():
+                    readers = [BioReader.open_shared("/path/to/file") for _ in range(4)]
+                    images = await asyncio.gather(*[br.aread(X=[i*1024,(i+1)*1024]) for i,br in enumerate(readers)])
 
-        # Read the image
-        I = self.read([x_min, x_max], [y_min, y_max], [0, 1], [0], [0]).squeeze()
-        if reflect_x:
-            I = numpy.fliplr(I)
+                asyncio.run(main())
 
-        # Pad the image if needed
-        if sum(1 for p in [prepad_x, prepad_y, postpad_x, postpad_y] if p != 0) > 0:
-            I = numpy.pad(I, ((prepad_y, postpad_y), (prepad_x, postpad_x)), mode="symmetric")
+        Args:
+            X: The (min,max) range of pixels to load along the x-axis (columns).
+                If None, loads the full range. *Defaults to None.*
+            Y: The (min,max) range of pixels to load along the y-axis (rows). If
+                None, loads the full range. *Defaults to None.*
+            Z: The (min,max) range of pixels to load along the z-axis (depth).
+                If None, loads the full range. *Defaults to None.*
+            C: Values indicating channel indices to load. If None, loads the
+                full range. *Defaults to None.*
+            T: Values indicating timepoints to load. If None, loads the full
+                range. *Defaults to None.*
 
-        # Store the data in the buffer
-        self._raw_buffer.put(I)
+        Returns:
+            A 5-dimensional numpy array.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(backends.shared_executor(self.async_workers,"io"),
+                                          functools.partial(self._read_attached,X=X,Y=Y,Z=Z,C=C,T=T))
 
-        # Detach the jvm
-        self._backend.detach()
+    def _read_attached(self, **kwargs) -> numpy.ndarray:
+        """Call :meth:`read` from a thread that may not be attached to the jvm"""
+        self._backend.attach()
+        try:
+            return self.read(**kwargs)
+        finally:
+            self._backend.detach()
+
+    def _fetch(self,
+               X: typing.List[int],
+               Z: int,
+               C: typing.List[int],
+               T: int) -> numpy.ndarray:
+        """Method for fetching image supertiles
 
-        return I
+        This method is intended to be run within a thread, and reads a full
+        height column of the image for a single z-slice and timepoint.
 
-    def _buffer_supertile(self, column_start: int, column_end: int):
-        """_buffer_supertile Process the pixel buffer
-        
-        Give the column indices of the data to process, and determine if the
-        buffer needs to be processed. This method performs two operations on the
-        buffer. First, it checks to see if data in the buffer can be shifted out
-        of the buffer if it's already been processed, where data before
-        column_start is assumed to have been processed. Second, this function
-        loads data into the buffer if the image reader has made some available
-        and there is room in _pixel_buffer for it.
-        
         Args:
-            column_start: First column index of data to be loaded
-            column_end: Last column index of data to be loaded
-        """
-
-        # If the column indices are outside what is available in the buffer,
-        # shift the buffer so more data can be loaded.
-        if column_end - self._tile_x_offset >= self._TILE_SIZE:
-            x_min = column_start - self._tile_x_offset
-            x_max = self._pixel_buffer.shape[1] - x_min
-            self._pixel_buffer[:, 0:x_max] = self._pixel_buffer[:, x_min:]
-            self._pixel_buffer[:, x_max:] = 0
-            self._tile_x_offset = column_start
-            self._tile_last_column = numpy.argwhere((self._pixel_buffer == 0).all(axis=0))[0, 0]
+            X: The (min,max) range of columns to load
+            Z: The z-slice to load
+            C: The channels to load
+            T: The timepoint to load
 
-        # Is there data in the buffer?
-        if (self._supertile_index.qsize() > 0 or self._data_in_buffer.qsize() > 0):
-
-            # If there is data in the _raw_buffer, return if there isn't room to load
-            # it into the _pixel_buffer
-            if self._pixel_buffer.shape[1] - self._tile_last_column < self._TILE_SIZE:
-                return
-
-            I = self._raw_buffer.get()
-            if self._tile_last_column == 0:
-                self._pixel_buffer[:I.shape[0], :I.shape[1]] = I
-                self._tile_last_column = I.shape[1]
-                self._tile_x_offset = column_start
-            else:
-                self._pixel_buffer[:I.shape[0], self._tile_last_column:self._tile_last_column + I.shape[1]] = I
-                self._tile_last_column += I.shape[1]
-
-            self._data_in_buffer.get()
-
-    def _get_tiles(self,
-                   X:typing.List[typing.List[int]],
-                   Y:typing.List[typing.List[int]],
-                   Z:typing.List[typing.List[int]],
-                   C:typing.List[typing.List[int]],
-                   T:typing.List[typing.List[int]]) -> numpy.ndarray:
-        """_get_tiles Handle data buffering and tiling
-        
-        This function returns tiles of data according to the input coordinates.
-        The X, Y, Z, C, and T are lists of lists, where each internal list
-        indicates a set of coordinates specifying the range of pixel values to
-        grab from an image.
-        
-        Args:
-            X: List of 2-tuples indicating the (min,max) range of pixels to load
-                within a tile.
-            Y: List of 2-tuples indicating the (min,max) range of pixels to load
-                within a tile.
-            Z: Placeholder, to be implemented.
-            C: Placeholder, to be implemented.
-            T: Placeholder, to be implemented.
-            
         Returns:
-            numpy.ndarray: 2-dimensional ndarray.
+            An image supertile with dimensions ``[Y,X[1]-X[0],len(C)]``
         """
 
-        self._buffer_supertile(X[0][0], X[0][1])
-
-        if X[-1][0] - self._tile_x_offset > self._TILE_SIZE:
-            shift_buffer = True
-            split_ind = 0
-            while X[split_ind][0] - self._tile_x_offset < self._TILE_SIZE:
-                split_ind += 1
-        else:
-            shift_buffer = False
-            split_ind = len(X)
+        # Attach the jvm to the thread if present
+        self._backend.attach()
 
-        # Tile the data
-        num_rows = Y[0][1] - Y[0][0]
-        num_cols = X[0][1] - X[0][0]
-        num_tiles = len(X)
-        images = numpy.zeros((num_tiles, num_rows, num_cols, 1), dtype=self.pixel_type())
+        try:
+            image = self.read(X=X, Z=[Z, Z+1], C=C, T=[T])
+        finally:
+            # Detach the jvm
+            self._backend.detach()
 
-        for ind in range(split_ind):
-            images[ind, :, :, 0] = self._pixel_buffer[Y[ind][0] - self._tile_y_offset:Y[ind][1] - self._tile_y_offset,
-                                                      X[ind][0] - self._tile_x_offset:X[ind][1] - self._tile_x_offset]
+        return image[:, :, 0, :, 0]
 
-        if split_ind != num_tiles:
-            self._buffer_supertile(X[-1][0], X[-1][1])
-            for ind in range(split_ind, num_tiles):
-                images[ind, :, :, 0] = self._pixel_buffer[
-                                       Y[ind][0] - self._tile_y_offset:Y[ind][1] - self._tile_y_offset,
-                                       X[ind][0] - self._tile_x_offset:X[ind][1] - self._tile_x_offset]
+    @staticmethod
+    def _reflect(index: numpy.ndarray, size: int) -> numpy.ndarray:
+        """Map pixel indices outside of an image dimension back into the image
 
-        return images
+        This mirrors the ``symmetric`` mode of ``numpy.pad``, so that index -1
+        maps to 0 and index ``size`` maps to ``size-1``.
+        """
+        index = numpy.where(index < 0, -index - 1, index)
+        index = numpy.where(index >= size, 2 * size - index - 1, index)
+        return numpy.clip(index, 0, size - 1)
 
     def __call__(self,
                  tile_size: typing.Union[list,tuple],
                  tile_stride: typing.Union[list,tuple,None] = None,
                  batch_size: typing.Union[int,None] = None,
-                 channels: typing.Union[list] = [0]) -> typing.Iterable[typing.Tuple[numpy.ndarray,tuple]]:
+                 channels: typing.Union[list] = [0],
+                 Z: typing.Union[list,None] = None,
+                 T: typing.Union[list,None] = None,
+                 prefetch: int = 2) -> typing.Iterable[typing.Tuple[numpy.ndarray,tuple]]:
         """Iterate through tiles of an image
         
         The BioReader object can be called, and will act as an iterator to load
-        tiles of an image. The iterator buffers the loading of pixels
-        asynchronously to quickly deliver images of the appropriate size.
+        tiles of an image. The image is loaded in supertiles, which are full
+        height columns of the image that are one file tile wide. Up to
+        ``prefetch`` supertiles are read ahead in background threads while
+        tiles are being processed, so that reading overlaps with whatever is
+        done with the tiles.
+
+        Tiles are returned in column order (all tiles in the first column of
+        tiles, then the second column, etc.) for each z-slice, and each
+        z-slice is returned for a timepoint before moving to the next
+        timepoint. All channels are returned together.
+
+        If the tile size is larger than the tile stride, tiles are centered on
+        the stride. Tiles that extend beyond the edge of the image are padded
+        by reflecting the image (``numpy.pad`` with ``mode="symmetric"``).
         
         Args:
             tile_size: A list/tuple of length 2, indicating the height and width
@@ -369,8 +350,12 @@ class BioReader(BioBase):
             batch_size: Number of tiles to return on each iteration. *Defaults
                 to None, which is the smaller of 32 or the*
                 :attr:`~.maximum_batch_size`
-            channels: A placeholder. Only the first channel
-                is ever loaded. *Defaults to [0].*
+            channels: The channels to load. *Defaults to [0].*
+            Z: The z-slices to load. If None, loads all z-slices. *Defaults to
+                None.*
+            T: The timepoints to load. If None, loads all timepoints. *Defaults
+                to None.*
+            prefetch: Number of supertiles to read ahead. *Defaults to 2.*
                 
         Returns:
             A tuple containing a list of X,Y,Z,C,T indices and a 4-d numpy array 
@@ -385,11 +370,11 @@ class BioReader(BioBase):
 
                 br = BioReader("/path/to/file")
 
-                for tiles,ind in br(tile_size=[256,256],tile_stride=[200,200]):
-                    for i in tiles.shape[0]:
-                        print("Displaying tile with X,Y coords: {},{}".format(ind[i][0],ind[i][1]))
+                for ind,tiles in br(tile_size=[256,256],tile_stride=[200,200]):
+                    for i in range(tiles.shape[0]):
+                        print("Displaying tile with X,Y coords: {},{}".format(ind[0][i],ind[1][i]))
                         plt.figure()
-                        plt.imshow(tiles[ind,:,:,0].squeeze())
+                        plt.imshow(tiles[i,:,:,0].squeeze())
                         plt.show()
 
         """
@@ -398,6 +383,9 @@ class BioReader(BioBase):
         self._iter_tile_stride = tile_stride
         self._iter_batch_size = batch_size
         self._iter_channels = channels
+        self._iter_z = Z
+        self._iter_t = T
+        self._iter_prefetch = prefetch
         
         return self
 
@@ -407,6 +395,9 @@ class BioReader(BioBase):
         tile_stride = self._iter_tile_stride
         batch_size = self._iter_batch_size
         channels = self._iter_channels
+        Z = self._iter_z
+        T = self._iter_t
+        prefetch = self._iter_prefetch
         
         if tile_size == None:
             raise SyntaxError("Cannot directly iterate over a BioReader object. Call it (i.e. for i in bioreader(256,256))")
@@ -415,113 +406,134 @@ class BioReader(BioBase):
         self._iter_tile_stride = None
         self._iter_batch_size = None
         self._iter_channels = None
-
-        # Ensure that the number of tiles does not exceed the supertile width
-        if batch_size == None:
-            batch_size = min([32, self.maximum_batch_size(tile_size, tile_stride)])
-        else:
-            assert batch_size <= self.maximum_batch_size(tile_size, tile_stride), \
-                "batch_size must be less than or equal to {}.".format(self.maximum_batch_size(tile_size, tile_stride))
+        self._iter_z = None
+        self._iter_t = None
+        self._iter_prefetch = None
 
         # input error checking
         assert len(tile_size) == 2, "tile_size must be a list with 2 elements"
         if tile_stride != None:
             assert len(tile_stride) == 2, "stride must be a list with 2 elements"
         else:
-            stride = tile_size
-
-        # calculate padding if needed
-        if not (set(tile_size) & set(tile_stride)):
-            xyoffset = [(tile_size[0] - tile_stride[0]) / 2, (tile_size[1] - tile_stride[1]) / 2]
-            xypad = [(tile_size[0] - tile_stride[0]) / 2, (tile_size[1] - tile_stride[1]) / 2]
-            xypad[0] = xyoffset[0] + (tile_stride[0] - numpy.mod(self.Y, tile_stride[0])) / 2
-            xypad[1] = xyoffset[1] + (tile_stride[1] - numpy.mod(self.X, tile_stride[1])) / 2
-            xypad = ((int(xyoffset[0]), int(2 * xypad[0] - xyoffset[0])),
-                     (int(xyoffset[1]), int(2 * xypad[1] - xyoffset[1])))
-        else:
-            xyoffset = [0, 0]
-            xypad = ((0, max([tile_size[0] - tile_stride[0], 0])),
-                     (0, max([tile_size[1] - tile_stride[1], 0])))
-
-        # determine supertile sizes
-        y_tile_dim = int(numpy.ceil((self.Y - 1) / self._TILE_SIZE))
-        x_tile_dim = 1
+            tile_stride = tile_size
+        assert prefetch >= 1, "prefetch must be at least 1"
 
-        # Initialize the pixel buffer
-        self._pixel_buffer = numpy.zeros((y_tile_dim * self._TILE_SIZE + tile_size[0], 2 * x_tile_dim * self._TILE_SIZE + tile_size[1]),
-                                         dtype=self.dtype)
-        self._tile_x_offset = -xypad[1][0]
-        self._tile_y_offset = -xypad[0][0]
-
-        # Generate the supertile loading order
-        tiles = []
-        y_tile_list = list(range(0, self.Y + xypad[0][1], self._TILE_SIZE * y_tile_dim))
-        if y_tile_list[-1] != self._TILE_SIZE * y_tile_dim:
-            y_tile_list.append(self._TILE_SIZE * y_tile_dim)
-        if y_tile_list[0] != xypad[0][0]:
-            y_tile_list[0] = -xypad[0][0]
-        x_tile_list = list(range(0, self.X + xypad[1][1], self._TILE_SIZE * x_tile_dim))
-        if x_tile_list[-1] < self.X + xypad[1][1]:
-            x_tile_list.append(x_tile_list[-1] + self._TILE_SIZE)
-        if x_tile_list[0] != xypad[1][0]:
-            x_tile_list[0] = -xypad[1][0]
-        for yi in range(len(y_tile_list) - 1):
-            for xi in range(len(x_tile_list) - 1):
-                y_range = [y_tile_list[yi], y_tile_list[yi + 1]]
-                x_range = [x_tile_list[xi], x_tile_list[xi + 1]]
-                tiles.append([x_range, y_range])
-                self._supertile_index.put((x_range, y_range, [0, 1], [0], [0]))
-
-        # Start the thread pool and start loading the first supertile
-        thread_pool = ThreadPoolExecutor(self._max_workers)
-        self._fetch_thread = thread_pool.submit(self._fetch)
-
-        # generate the indices for each tile
-        # TODO: modify this to grab more than just the first z-index
-        X = []
-        Y = []
-        Z = []
-        C = []
-        T = []
-        x_list = numpy.array(numpy.arange(-xypad[1][0], self.X, tile_stride[1]))
-        y_list = numpy.array(numpy.arange(-xypad[0][0], self.Y, tile_stride[0]))
-        for x in x_list:
-            for y in y_list:
-                X.append([x, x + tile_size[1]])
-                Y.append([y, y + tile_size[0]])
-                Z.append([0, 1])
-                C.append(channels)
-                T.append([0])
-
-        # Set up batches
-        batches = list(range(0, len(X), batch_size))
-
-        # get the first batch
-        b = min([batch_size, len(X)])
-        index = (X[0:b], Y[0:b], Z[0:b], C[0:b], T[0:b])
-        images = self._get_tiles(*index)
-
-        # start looping through batches
-        for bn in batches[1:]:
-            # start the thread to get the next batch
-            b = min([bn + batch_size, len(X)])
-            self._tile_thread = thread_pool.submit(self._get_tiles, X[bn:b], Y[bn:b], Z[bn:b], C[bn:b], T[bn:b])
-
-            # Load another supertile if possible
-            if self._supertile_index.qsize() > 0 and not self._fetch_thread.running():
-                self._fetch_thread = thread_pool.submit(self._fetch)
-
-            # return the curent set of images
-            yield index, images
+        if batch_size == None:
+            batch_size = min([32, self.maximum_batch_size(tile_size, tile_stride)])
 
-            # get the images from the thread
-            index = (X[bn:b], Y[bn:b], Z[bn:b], C[bn:b], T[bn:b])
-            images = self._tile_thread.result()
+        Z = list(range(self.Z)) if Z == None else list(Z)
+        T = list(range(self.T)) if T == None else list(T)
+        C = self._val_ct(channels, "C")
+
+        # Tiles are centered on the stride
+        y_offset = (tile_size[0] - tile_stride[0]) // 2
+        x_offset = (tile_size[1] - tile_stride[1]) // 2
+        x_list = numpy.arange(-x_offset, self.X, tile_stride[1])
+        y_list = numpy.arange(-y_offset, self.Y, tile_stride[0])
+        rows = [self._reflect(numpy.arange(y, y + tile_size[0]), self.Y) for y in y_list]
+
+        # Supertiles are loaded in this order
+        ts = self._TILE_SIZE
+        num_columns = int(numpy.ceil(self.X / ts))
+        supertiles = [(z, t, k) for t in T for z in Z for k in range(num_columns)]
+        order = {s:i for i,s in enumerate(supertiles)}
+
+        thread_pool = ThreadPoolExecutor(prefetch)
+        loaded = {}     # supertiles in memory
+        pending = {}    # supertiles being read
+        next_fetch = 0
+
+        def fetch(supertile):
+            z, t, k = supertile
+            return thread_pool.submit(self._fetch, [k * ts, min((k + 1) * ts, self.X)], z, C, t)
+
+        # Allocate the first batch
+        index = ([], [], [], [], [])
+        images = numpy.zeros((batch_size, tile_size[0], tile_size[1], len(C)), dtype=self.dtype)
+
+        try:
+            for t in T:
+                for z in Z:
+                    for x in x_list:
+                        cols = self._reflect(numpy.arange(x, x + tile_size[1]), self.X)
+                        col_supertiles = cols // ts
+                        needed = [(z, t, int(k)) for k in numpy.unique(col_supertiles)]
+                        first_needed = min(order[s] for s in needed)
+
+                        # Free supertiles that are no longer needed
+                        for s in [s for s in loaded if s not in needed and order[s] < first_needed]:
+                            del loaded[s]
+                        for s in [s for s in pending if order[s] < first_needed]:
+                            pending.pop(s).cancel()
+
+                        # Get the needed supertiles
+                        for s in needed:
+                            if s not in loaded:
+                                if s not in pending:
+                                    pending[s] = fetch(s)
+                                loaded[s] = pending.pop(s).result()
+                        next_fetch = max(next_fetch, max(order[s] for s in needed) + 1)
+
+                        # Read ahead
+                        while len(pending) < prefetch and next_fetch < len(supertiles):
+                            if supertiles[next_fetch] not in loaded and supertiles[next_fetch] not in pending:
+                                pending[supertiles[next_fetch]] = fetch(supertiles[next_fetch])
+                            next_fetch += 1
+
+                        for y, r in zip(y_list, rows):
+                            n = len(index[0])
+
+                            # Copy the tile out of the supertiles
+                            for s in needed:
+                                mask = col_supertiles == s[2]
+                                images[n, :, mask, :] = loaded[s][numpy.ix_(r, cols[mask] - s[2] * ts)].transpose(1, 0, 2)
+
+                            index[0].append([int(x), int(x) + tile_size[1]])
+                            index[1].append([int(y), int(y) + tile_size[0]])
+                            index[2].append([z, z + 1])
+                            index[3].append(C)
+                            index[4].append([t])
+
+                            if n + 1 == batch_size:
+                                yield index, images
+                                index = ([], [], [], [], [])
+                                images = numpy.zeros((batch_size, tile_size[0], tile_size[1], len(C)), dtype=self.dtype)
+
+            # return the last set of images
+            if len(index[0]) > 0:
+                yield index, images[:len(index[0])]
+
+        finally:
+            for s in pending:
+                pending[s].cancel()
+            thread_pool.shutdown()
+
+    async def __aiter__(self):
+        """Asynchronously iterate through tiles of an image
+
+        This is the asyncio version of iterating over a called BioReader (see
+        :meth:`__call__`). Each batch of tiles is loaded in the process-wide
+        thread pool used by :meth:`aread`, so the event loop is free to handle
+        other requests while tiles are being read.
 
-        thread_pool.shutdown()
+        Example:
+            .. code:: python
 
-        # return the last set of images
-        yield index, images
+                async for ind,tiles in br(tile_size=[256,256]):
+                    ...
+        """
+        loop = asyncio.get_running_loop()
+        executor = backends.shared_executor(self.async_workers,"io")
+        tiles = iter(self)
+
+        try:
+            while True:
+                batch = await loop.run_in_executor(executor, next, tiles, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            await loop.run_in_executor(executor, tiles.close)
         
     @classmethod
     def image_size(cls,filepath):
@@ -622,8 +634,8 @@ class BioWriter(BioBase):
     version of this tool that directly interacts with the Bioformats codebase
     written in Java through the javabridge package, using the native
     ``OMETiffWriter`` class. There is also a Python backend, which is
-    significantly faster but is limited to writing only single channel and
-    single timepoint .
+    significantly faster. The Python backend writes planes in XYZCT order, so
+    planes must be written in order of increasing Z, then C, then T.
     
     One of the features of this class is that it handles some of the potential
     issues that are not caught by the python-bioformats package. For example,
@@ -651,6 +663,10 @@ class BioWriter(BioBase):
                  backend: str = "python",
                  metadata: typing.Union[OmeXml.OMEXML,None] = None,
                  image: typing.Union[numpy.ndarray,None] = None,
+                 compression: typing.Union[str,None] = None,
+                 compression_level: typing.Union[int,None] = None,
+                 pyramid_levels: int = 0,
+                 pyramid_reduction: str = "mean",
                  **kwargs) -> None:
         """
 
@@ -664,18 +680,41 @@ class BioWriter(BioBase):
             image: The metadata will be set based on the dimensions and data
                 type of the numpy array specified by this keyword argument.
                 Ignored if metadata is specified. *Defaults to None.*
+            compression: Tile compression, must be one of ``none``,
+                ``deflate`` (same as ``zlib``), ``lzw``, or ``zstd``. The java
+                backend does not support ``zstd``, and images compressed with
+                ``zstd`` can only be read using the python backend. *Defaults
+                to None, which uses deflate for the python backend and lzw for
+                the java backend.*
+            compression_level: Compression level used for deflate or zstd
+                compression. Ignored for other compression methods. *Defaults
+                to None, which uses level 1.*
+            pyramid_levels: Number of reduced resolution images to write as
+                SubIFDs of each plane. Each level is half the width and height
+                of the level above it, and is created as tiles are written so
+                that the image does not need to be read again. Only supported
+                by the python backend. *Defaults to 0.*
+            pyramid_reduction: Method used to downsample pyramid levels, must
+                be ``mean`` for intensity images or ``mode`` for labeled
+                images. *Defaults to mean.*
             kwargs: Most BioWriter object properties can be passed as keyword
                 arguments to initialize the image metadata. If the metadata
                 argument is used, then keyword arguments are ignored.
         """
         super(BioWriter, self).__init__(file_path, max_workers, backend, False)
 
+        self._compression = compression
+        self._compression_level = compression_level
+        self._pyramid_levels = pyramid_levels
+        self._pyramid_reduction = pyramid_reduction
+
         if metadata:
             assert metadata.__class__.__name__ == "OMEXML"
             self._metadata = OmeXml.OMEXML(str(metadata))
             self._metadata.image(0).Name = self._file_path.name
             self._metadata.image().Pixels.channel_count = self.C
             self._metadata.image().Pixels.DimensionOrder = OmeXml.DO_XYZCT
+            self._set_tiffdata()
 
         else:
             self._metadata = self._minimal_xml()
@@ -706,7 +745,7 @@ class BioWriter(BioBase):
         elif self._backend_name == "java":
             self._backend = backends.JavaWriter(self)
         else:
-            raise ValueError('backend must be 'python' or 'java'")
+            raise ValueError("backend must be 'python' or 'java'")
 
     def __setitem__(self,
                     keys: typing.Union[tuple,slice],
@@ -782,7 +821,7 @@ class BioWriter(BioBase):
         Returns:
             OMEXML object
         """
-        assert not self._backend._writer, "The image has started to be written. To modify the xml again, reinitialize."
+        assert self._backend is None or not self._backend._writer, "The image has started to be written. To modify the xml again, reinitialize."
         omexml = OmeXml.OMEXML()
         omexml.image(0).Name = Path(self._file_path).name
         p = omexml.image(0).Pixels